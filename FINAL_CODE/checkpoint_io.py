@@ -0,0 +1,191 @@
+"""Checkpoint I/O budget for K-fold training.
+
+`checkpoint_mode` of a fold:
+
+- "trainer": the original behaviour. Trainer writes a full checkpoint (weights + optimizer + scheduler)
+  every epoch, reloads the best one at the end, and `save_model` writes `best_model` again.
+- "memory": no Trainer checkpoints. `BestWeightsCallback` keeps a CPU copy of the best epoch's weights
+  and restores it when training ends. `best_model` is written once, weights only (safetensors), on a
+  background thread.
+- "weights": like "memory", but the weights are also written every time the best epoch improves. The
+  new copy replaces the old one, so each fold keeps at most one checkpoint on disk, and a crashed run
+  still leaves its best weights.
+
+`CheckpointIO` records the bytes written and the seconds spent saving for every fold. For async
+saves it also records the time the training loop itself was blocked, i.e. the copy of the weights
+to CPU.
+"""
+
+import os
+import time
+import shutil
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from transformers import TrainerCallback
+
+logger = logging.getLogger('Violationresult')
+
+CHECKPOINT_MODES = ("trainer", "memory", "weights")
+
+
+def directory_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def cpu_state(model):
+    """Detached contiguous CPU copy of the weights (safe to write from another thread while training goes on)"""
+    return {name: tensor.detach().to("cpu", copy=True).contiguous() for name, tensor in model.state_dict().items()}
+
+
+def write_weights(model, state, directory, tokenizer=None):
+    """
+    Write state as safetensors (+ config / tokenizer files) into directory, replacing it atomically
+
+    Uses save_pretrained for transformers models and safetensors.save_file for plain modules
+    (MultiTaskModel), so `from_pretrained` / `load_multi_task_model` read the result unchanged.
+    """
+    tmp_dir = f"{directory}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    if hasattr(model, "save_pretrained"):
+        model.save_pretrained(tmp_dir, state_dict=state, safe_serialization=True)
+    else:
+        from safetensors.torch import save_file
+        os.makedirs(tmp_dir, exist_ok=True)
+        save_file(state, os.path.join(tmp_dir, "model.safetensors"))
+    if tokenizer is not None:
+        tokenizer.save_pretrained(tmp_dir)
+    written = directory_bytes(tmp_dir)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_dir, directory)
+    return written
+
+
+class CheckpointIO:
+    """
+    Weights writes on a background thread (or inline) plus a per-fold log of bytes and seconds
+
+    Saves are queued on one writer thread, so they run in order and never compete with each other
+    for the disk. Call wait() before reading the report.
+    """
+
+    def __init__(self, background=True):
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint-io") if background else None
+        self.records = []
+        self.futures = []
+        self._lock = threading.Lock()
+
+    def record(self, fold, kind, written, seconds, blocking=None):
+        with self._lock:
+            self.records.append({'fold': fold, 'kind': kind, 'bytes': int(written), 'seconds': float(seconds),
+                                 'blocking_seconds': float(seconds if blocking is None else blocking)})
+
+    def _write(self, fold, kind, model, state, directory, tokenizer, blocking):
+        start = time.perf_counter()
+        written = write_weights(model, state, directory, tokenizer)
+        self.record(fold, kind, written, time.perf_counter() - start, blocking)
+
+    def save(self, fold, kind, model, state, directory, tokenizer=None, blocking=0.0):
+        """Write state to directory, in the background when enabled; blocking is the caller's copy time"""
+        if self.pool is None:
+            self._write(fold, kind, model, state, directory, tokenizer, None)
+            return
+        self.futures.append(self.pool.submit(self._write, fold, kind, model, state, directory, tokenizer, blocking))
+
+    def wait(self):
+        for future in self.futures:
+            future.result()
+        self.futures = []
+
+    def close(self):
+        self.wait()
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def report(self, fold):
+        """Totals of one fold: bytes written, seconds writing, seconds the training loop was blocked"""
+        with self._lock:
+            records = [r for r in self.records if r['fold'] == fold]
+        return {
+            'saves': len(records),
+            'bytes_written': sum(r['bytes'] for r in records),
+            'save_seconds': round(sum(r['seconds'] for r in records), 3),
+            'blocking_seconds': round(sum(r['blocking_seconds'] for r in records), 3),
+        }
+
+
+class BestWeightsCallback(TrainerCallback):
+    """
+    Keep the best epoch's weights in memory (no Trainer checkpoints) and restore them when training ends
+
+    With save_each_best the new best weights are also handed to io.save, which replaces the fold's
+    single checkpoint directory.
+    """
+
+    def __init__(self, io, fold, save_dir, metric="eval_f1", greater_is_better=True, save_each_best=False,
+                 tokenizer=None):
+        self.io = io
+        self.fold = fold
+        self.save_dir = save_dir
+        self.metric = metric
+        self.greater_is_better = greater_is_better
+        self.save_each_best = save_each_best
+        self.tokenizer = tokenizer
+        self.best_metric = None
+        self.best_epoch = None
+        self.best_state = None
+        self.copy_seconds = 0.0
+        self.training = True
+
+    def _is_better(self, value):
+        if self.best_metric is None:
+            return True
+        return value > self.best_metric if self.greater_is_better else value < self.best_metric
+
+    def on_evaluate(self, args, state, control, metrics=None, model=None, **kwargs):
+        # 训练结束后的 trainer.evaluate() 不再参与比较
+        if not self.training or not metrics or self.metric not in metrics:
+            return
+        value = metrics[self.metric]
+        if not self._is_better(value):
+            return
+        start = time.perf_counter()
+        # 每次替换为新字典（不原地修改），后台线程写入的仍是它拿到的那份权重
+        self.best_state = cpu_state(model)
+        copy_seconds = time.perf_counter() - start
+        self.copy_seconds += copy_seconds
+        self.best_metric, self.best_epoch = value, state.epoch
+        if self.save_each_best:
+            self.io.save(self.fold, "best", model, self.best_state, self.save_dir, self.tokenizer, blocking=copy_seconds)
+
+    def on_train_end(self, args, state, control, model=None, **kwargs):
+        self.training = False
+        if self.best_state is not None:
+            model.load_state_dict(self.best_state)
+            logger.info(f"Fold {self.fold}: restored best weights from memory (epoch {self.best_epoch}, "
+                        f"{self.metric}={self.best_metric:.4f})")
+
+
+class CheckpointTimingCallback(TrainerCallback):
+    """Bytes and seconds of the Trainer's own epoch checkpoints ("trainer" mode)"""
+
+    def __init__(self, io, fold):
+        self.io = io
+        self.fold = fold
+        self._evaluated_at = None
+
+    def on_evaluate(self, args, state, control, **kwargs):
+        self._evaluated_at = time.perf_counter()
+
+    def on_save(self, args, state, control, **kwargs):
+        # Trainer 在 on_evaluate 之后写检查点，再调用 on_save
+        seconds = time.perf_counter() - self._evaluated_at if self._evaluated_at else 0.0
+        checkpoint = os.path.join(args.output_dir, f"checkpoint-{state.global_step}")
+        written = directory_bytes(checkpoint) if os.path.isdir(checkpoint) else 0
+        self.io.record(self.fold, "checkpoint", written, seconds)
@@ -0,0 +1,270 @@
+"""Frozen-encoder embedding cache and head-only training for the Legal-BERT classifiers.
+
+The inputs are deterministic templated sentences, so the (frozen) encoder output for the corpus is
+computed once and stored in a memory-mapped .npy file; linear / MLP heads are then trained per fold
+(and per target) from that cache in seconds instead of fine-tuning the whole encoder each time.
+
+With `unfreeze_top=N` the cache holds the hidden states entering the top N encoder layers (float16,
+padded to the longest text) plus the attention masks; training then runs and updates only those N
+layers, the pooler and the head, still without recomputing the lower layers.
+"""
+
+import os
+import copy
+import time
+import hashlib
+import logging
+
+import numpy as np
+import torch
+from torch import nn
+
+from fold_training import compute_metrics
+from multi_task import MultiTaskModel, MISSING_LABEL
+
+logger = logging.getLogger('Violationresult')
+
+POOLINGS = ("cls", "mean", "pooler")
+
+
+def weights_fingerprint(model):
+    """Hash of the encoder weights (a fine-tuned model gets a different cache than the pretrained one)"""
+    h = hashlib.sha1()
+    for name, tensor in model.state_dict().items():
+        h.update(name.encode("utf-8"))
+        h.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return h.hexdigest()[:16]
+
+
+def base_model(model):
+    """Transformer body: base_model of a *ForSequenceClassification model, the shared encoder of a MultiTaskModel"""
+    return model.encoder if isinstance(model, MultiTaskModel) else model.base_model
+
+
+def _encoder_layers(base):
+    encoder = getattr(base, "encoder", None)
+    layers = getattr(encoder, "layer", None)
+    if layers is None:
+        raise ValueError(f"unfreeze_top needs a BERT-style encoder (base_model.encoder.layer), got {type(base).__name__}")
+    return layers
+
+
+def _extended_mask(mask, dtype):
+    """Additive attention mask (batch, 1, 1, seq) as BertModel builds it"""
+    return (1.0 - mask[:, None, None, :].to(dtype)) * torch.finfo(dtype).min
+
+
+def _run_layer(layer, hidden, extended_mask):
+    output = layer(hidden, attention_mask=extended_mask)
+    return output[0] if isinstance(output, tuple) else output
+
+
+def _pool(hidden, mask, pooling, pooler=None):
+    if pooling == "cls":
+        return hidden[:, 0]
+    if pooling == "pooler":
+        return pooler(hidden)
+    weights = mask.unsqueeze(-1).to(hidden.dtype)
+    return (hidden * weights).sum(dim=1) / weights.sum(dim=1).clamp(min=1)
+
+
+class ClassifierHead(nn.Module):
+    """Linear or one-hidden-layer MLP head on top of pooled embeddings"""
+
+    def __init__(self, hidden_size, num_labels, head="linear", mlp_size=256, dropout=0.1):
+        super().__init__()
+        if head == "linear":
+            self.net = nn.Sequential(nn.Dropout(dropout), nn.Linear(hidden_size, num_labels))
+        elif head == "mlp":
+            self.net = nn.Sequential(nn.Dropout(dropout), nn.Linear(hidden_size, mlp_size), nn.GELU(),
+                                     nn.Dropout(dropout), nn.Linear(mlp_size, num_labels))
+        else:
+            raise ValueError(f"Unknown head: {head}")
+
+    def forward(self, features):
+        return self.net(features)
+
+
+class TopLayers(nn.Module):
+    """Copies of the top N encoder layers + pooling + head, fed with cached hidden states"""
+
+    def __init__(self, base, unfreeze_top, head, pooling):
+        super().__init__()
+        # 复制顶部层：每折从原始权重开始，编码器本身（以及缓存键）保持不变
+        self.layers = nn.ModuleList(copy.deepcopy(layer) for layer in list(_encoder_layers(base))[-unfreeze_top:])
+        pooler = getattr(base, "pooler", None)
+        self.pooler = copy.deepcopy(pooler) if pooling == "pooler" else None
+        self.head = head
+        self.pooling = pooling
+
+    def forward(self, hidden, mask):
+        extended_mask = _extended_mask(mask, hidden.dtype)
+        for layer in self.layers:
+            hidden = _run_layer(layer, hidden, extended_mask)
+        return self.head(_pool(hidden, mask, self.pooling, self.pooler))
+
+
+class FrozenEncoderCache:
+    """
+    冻结编码器的输出缓存
+
+    build() 对整个语料跑一次编码器，把池化向量（unfreeze_top=0）或进入顶部 N 层之前的隐藏状态
+    写入 cache_dir 下的内存映射 .npy 文件；文件名包含模型权重、分词缓存和设置的哈希，
+    同样的输入再次运行时直接映射读取。train_fold() 只训练分类头（以及顶部 N 层）。
+    """
+
+    def __init__(self, model, cache_dir, unfreeze_top=0, pooling="cls"):
+        if pooling not in POOLINGS:
+            raise ValueError(f"pooling must be one of {POOLINGS}")
+        self.model = model
+        self.base = base_model(model)
+        self.cache_dir = cache_dir
+        self.unfreeze_top = unfreeze_top
+        self.pooling = pooling
+        self.features = None
+        self.masks = None
+        if unfreeze_top:
+            self.num_layers = len(_encoder_layers(self.base))
+            if not 0 < unfreeze_top <= self.num_layers:
+                raise ValueError(f"unfreeze_top must be between 1 and {self.num_layers}")
+
+    def _cache_paths(self, corpus_key):
+        settings = f"top{self.unfreeze_top}" if self.unfreeze_top else self.pooling
+        key = hashlib.sha1(f"{weights_fingerprint(self.model)}|{corpus_key}|{settings}".encode("utf-8")).hexdigest()[:16]
+        return (os.path.join(self.cache_dir, f"embeddings_{key}.npy"),
+                os.path.join(self.cache_dir, f"embeddings_{key}_mask.npy"))
+
+    def build(self, tokenized, corpus_key, batch_size=64, device="cpu"):
+        """
+        Encode tokenized (a tokenized Dataset with input_ids / attention_mask) once
+
+        corpus_key: identifies the tokenized corpus (e.g. its Arrow cache file name)
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        feature_path, mask_path = self._cache_paths(corpus_key)
+        if os.path.exists(feature_path) and (not self.unfreeze_top or os.path.exists(mask_path)):
+            self.features = np.load(feature_path, mmap_mode="r")
+            self.masks = np.load(mask_path, mmap_mode="r") if self.unfreeze_top else None
+            logger.info(f"Loaded cached encoder outputs {self.features.shape}: {feature_path}")
+            return self
+
+        columns = [c for c in ("input_ids", "attention_mask", "token_type_ids") if c in tokenized.column_names]
+        n = len(tokenized)
+        max_len = max(len(ids) for ids in tokenized["input_ids"])
+        hidden_size = self.model.config.hidden_size
+        if self.unfreeze_top:
+            # 进入顶部 N 层之前的隐藏状态（float16 存储，按语料最长文本补齐）
+            shape, dtype = (n, max_len, hidden_size), np.float16
+            masks = np.lib.format.open_memmap(f"{mask_path}.tmp.npy", mode="w+", dtype=np.int8, shape=(n, max_len))
+        else:
+            shape, dtype = (n, hidden_size), np.float32
+        features = np.lib.format.open_memmap(f"{feature_path}.tmp.npy", mode="w+", dtype=dtype, shape=shape)
+
+        self.model.to(device)
+        self.model.eval()
+        pad_id = self.model.config.pad_token_id or 0
+        start = time.time()
+        with torch.no_grad():
+            for begin in range(0, n, batch_size):
+                rows = tokenized[begin:begin + batch_size]
+                length = max(len(ids) for ids in rows["input_ids"])
+                batch = {}
+                for column in columns:
+                    pad = pad_id if column == "input_ids" else 0
+                    batch[column] = torch.tensor([list(v) + [pad] * (length - len(v)) for v in rows[column]], device=device)
+                if self.unfreeze_top:
+                    outputs = self.base(**batch, output_hidden_states=True)
+                    # hidden_states[0] 是 embedding 输出，第 i 层输出为 hidden_states[i]
+                    hidden = outputs.hidden_states[self.num_layers - self.unfreeze_top]
+                    features[begin:begin + len(hidden), :length] = hidden.cpu().numpy().astype(np.float16)
+                    masks[begin:begin + len(hidden), :length] = batch["attention_mask"].cpu().numpy()
+                else:
+                    outputs = self.base(**batch)
+                    pooled = (outputs.pooler_output if self.pooling == "pooler"
+                              else _pool(outputs.last_hidden_state, batch["attention_mask"], self.pooling))
+                    features[begin:begin + len(pooled)] = pooled.cpu().numpy()
+        features.flush()
+        del features
+        os.replace(f"{feature_path}.tmp.npy", feature_path)
+        if self.unfreeze_top:
+            masks.flush()
+            del masks
+            os.replace(f"{mask_path}.tmp.npy", mask_path)
+        logger.info(f"Encoded {n} texts once in {time.time() - start:.1f}s -> {feature_path}")
+        return self.build(tokenized, corpus_key, batch_size, device)
+
+    def _new_model(self, num_labels, head, seed):
+        torch.manual_seed(seed)
+        head_module = ClassifierHead(self.model.config.hidden_size, num_labels, head)
+        if not self.unfreeze_top:
+            return head_module
+        return TopLayers(self.base, self.unfreeze_top, head_module, self.pooling)
+
+    def _inputs(self, rows, device):
+        """Cached features (and masks) of the given sorted rows, trimmed to their longest text"""
+        features = torch.from_numpy(np.asarray(self.features[rows], dtype=np.float32)).to(device)
+        if not self.unfreeze_top:
+            return (features,)
+        masks = np.asarray(self.masks[rows])
+        length = int(masks.sum(axis=1).max())
+        return features[:, :length], torch.from_numpy(masks[:, :length].astype(np.int64)).to(device)
+
+    def train_fold(self, train_idx, val_idx, labels, num_labels, head="linear", epochs=None, batch_size=32,
+                   learning_rate=None, weight_decay=0.01, seed=42, device="cpu"):
+        """
+        Train a head (and the top N layers) on cached encoder outputs; the best epoch by macro F1 is kept
+
+        Rows labelled MISSING_LABEL (a multi-task target unknown for that case) are left out of the fold.
+
+        Returns:
+            (fold result dict with eval_results / training_time, trained module)
+        """
+        epochs = epochs or (3 if self.unfreeze_top else 30)
+        learning_rate = learning_rate or (3e-5 if self.unfreeze_top else 1e-3)
+        labels = np.asarray(labels)
+        train_rows, val_rows = np.sort(train_idx), np.sort(val_idx)
+        train_rows = train_rows[labels[train_rows] != MISSING_LABEL]
+        val_rows = val_rows[labels[val_rows] != MISSING_LABEL]
+        model = self._new_model(num_labels, head, seed).to(device)
+        if not self.unfreeze_top:
+            # 编码器冻结：训练集的池化向量一次性读入内存
+            train_inputs = self._inputs(train_rows, device)
+        val_inputs = self._inputs(val_rows, device)
+        train_labels = torch.from_numpy(labels[train_rows]).long().to(device)
+        val_labels = labels[val_rows]
+        optimizer = torch.optim.AdamW(model.parameters(), lr=learning_rate, weight_decay=weight_decay)
+        loss_fn = nn.CrossEntropyLoss()
+        generator = torch.Generator().manual_seed(seed)
+
+        best, best_state = None, None
+        start = time.time()
+        for epoch in range(epochs):
+            model.train()
+            order = torch.randperm(len(train_labels), generator=generator)
+            for begin in range(0, len(order), batch_size):
+                picked = order[begin:begin + batch_size]
+                if self.unfreeze_top:
+                    # 按行号排序读取内存映射，目标按相同顺序
+                    picked = picked.sort().values
+                    inputs = self._inputs(train_rows[picked.numpy()], device)
+                    targets = train_labels[picked]
+                else:
+                    inputs = tuple(x[picked] for x in train_inputs)
+                    targets = train_labels[picked]
+                loss = loss_fn(model(*inputs), targets)
+                loss.backward()
+                optimizer.step()
+                optimizer.zero_grad()
+
+            model.eval()
+            with torch.no_grad():
+                logits = torch.cat([model(*tuple(x[b:b + 256] for x in val_inputs))
+                                    for b in range(0, len(val_labels), 256)]).cpu().numpy()
+            metrics = compute_metrics((logits, val_labels))
+            eval_results = {f"eval_{k}": float(v) for k, v in metrics.items()}
+            eval_results["epoch"] = epoch + 1
+            if best is None or eval_results["eval_f1"] > best["eval_f1"]:
+                best = eval_results
+                best_state = {k: v.detach().clone() for k, v in model.state_dict().items()}
+        model.load_state_dict(best_state)
+        return {'eval_results': best, 'training_time': time.time() - start}, model
@@ -0,0 +1,302 @@
+"""Shared, typed feature table for every model family (decision tree, Legal-BERT, fine amount, inference).
+
+`build_feature_store` parses the CSV once (separator sniffed, so `;` and `,` exports both work) and writes
+an uncompressed Arrow IPC file that is memory-mapped on load:
+
+- 0/1 columns as int8, other integers in the smallest fitting type
+- text columns as dictionary (categorical) columns whose sorted dictionary *is* the LabelEncoder
+  `classes_`, so the stored codes equal `LabelEncoder().fit_transform(...)` codes
+- encoders and source metadata persisted next to the table, so test data and single-case predictions
+  reuse the training encoders instead of re-fitting them
+- the parsed gdpr_clause references as a sparse matrix / inverted index (`load_articles`)
+
+Two views reproduce the preprocessing that was copy-pasted across the notebooks and scripts:
+`load_frame` (original values, as `pd.read_csv` returns them, for the text models) and
+`load_encoded` (`'unspecific'`->0 volume, missing-value fill, label-encoded categoricals, as in
+Final_DecisionTree.ipynb).
+"""
+
+import os
+import json
+import time
+import hashlib
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from sklearn.preprocessing import LabelEncoder
+
+TABLE_FILE = "features.arrow"
+ENCODERS_FILE = "encoders.json"
+META_FILE = "meta.json"
+STORE_VERSION = 2
+
+# 不做标签编码的长文本列（与各 notebook 的处理一致）
+TEXT_COLUMNS = ['gdpr_clause']
+VOLUME_COLUMN = 'Affected_data_volume'
+
+
+def sniff_separator(csv_path):
+    """Return ';' or ',' depending on which one splits the header line"""
+    with open(csv_path, 'r', encoding='utf-8') as f:
+        header = f.readline()
+    return ';' if header.count(';') > header.count(',') else ','
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _int_type(values):
+    if values.size and values.min() >= 0 and values.max() <= 1:
+        return pa.int8()
+    for arrow_type, dtype in ((pa.int8(), np.int8), (pa.int16(), np.int16), (pa.int32(), np.int32)):
+        info = np.iinfo(dtype)
+        if not values.size or (values.min() >= info.min and values.max() <= info.max):
+            return arrow_type
+    return pa.int64()
+
+
+def _to_arrow(df):
+    """Typed Arrow table plus the per-column encoder classes"""
+    arrays = []
+    fields = []
+    encoders = {}
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_integer_dtype(series) and not series.isna().any():
+            values = series.to_numpy(dtype=np.int64)
+            arrow_type = _int_type(values)
+            arrays.append(pa.array(values, type=arrow_type))
+        elif pd.api.types.is_float_dtype(series) or pd.api.types.is_bool_dtype(series):
+            arrays.append(pa.array(series.to_numpy(), from_pandas=True))
+        else:
+            values = series.astype(object)
+            present = values.notna()
+            # 排序后的类别与 LabelEncoder.classes_ 相同，字典编码即标签编码
+            classes = sorted(values[present].astype(str).unique())
+            codes = np.full(len(values), -1, dtype=np.int32)
+            codes[present.to_numpy()] = np.searchsorted(classes, values[present].astype(str).to_numpy())
+            index_type = pa.int16() if len(classes) < 2 ** 15 else pa.int32()
+            indices = pa.array(codes, mask=codes < 0, type=index_type)
+            arrays.append(pa.DictionaryArray.from_arrays(indices, pa.array(classes, type=pa.string())))
+            encoders[col] = classes
+        fields.append(pa.field(col, arrays[-1].type))
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields)), encoders
+
+
+def build_feature_store(csv_path, store_dir, rebuild=False):
+    """
+    Parse csv_path once into store_dir; skipped when the store already matches the CSV content
+
+    Returns:
+        store metadata dict
+    """
+    source_hash = file_sha256(csv_path)
+    os.makedirs(store_dir, exist_ok=True)
+    meta_path = os.path.join(store_dir, META_FILE)
+    if not rebuild and os.path.exists(meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get("source_sha256") == source_hash and meta.get("version") == STORE_VERSION:
+            return meta
+
+    start = time.time()
+    sep = sniff_separator(csv_path)
+    df = pd.read_csv(csv_path, sep=sep)
+    table, encoders = _to_arrow(df)
+
+    # 先写临时文件再替换，避免读到一半写入的表
+    table_path = os.path.join(store_dir, TABLE_FILE)
+    feather.write_feather(table, f"{table_path}.tmp", compression="uncompressed")
+    os.replace(f"{table_path}.tmp", table_path)
+    with open(os.path.join(store_dir, ENCODERS_FILE), 'w', encoding='utf-8') as f:
+        json.dump(encoders, f, ensure_ascii=False, indent=1)
+    if 'gdpr_clause' in df.columns:
+        from gdpr_articles import ArticleIndex
+        ArticleIndex.from_clauses(df['gdpr_clause']).save(store_dir)
+    meta = {
+        "version": STORE_VERSION,
+        "source": os.path.abspath(csv_path),
+        "source_sha256": source_hash,
+        "sep": sep,
+        "rows": table.num_rows,
+        "columns": table.column_names,
+        "built_at": time.time(),
+    }
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=1)
+    print(f"特征表已生成: {store_dir}（{table.num_rows} 行 x {table.num_columns} 列，"
+          f"{os.path.getsize(table_path) / 1e6:.2f} MB，耗时 {time.time() - start:.2f}秒）")
+    return meta
+
+
+def load_table(store_dir, columns=None):
+    """Memory-mapped Arrow table (zero-copy for the numeric columns)"""
+    return feather.read_table(os.path.join(store_dir, TABLE_FILE), columns=columns, memory_map=True)
+
+
+def load_encoders(store_dir):
+    """Persisted LabelEncoders keyed by column"""
+    with open(os.path.join(store_dir, ENCODERS_FILE), 'r', encoding='utf-8') as f:
+        classes = json.load(f)
+    encoders = {}
+    for col, values in classes.items():
+        le = LabelEncoder()
+        le.classes_ = np.array(values, dtype=object)
+        encoders[col] = le
+    return encoders
+
+
+def load_frame(store_dir, columns=None, compact=False):
+    """
+    Original-value view: same values as pd.read_csv on the source (text columns as strings)
+
+    compact: keep the storage types (int8/int16 integers, categorical text) instead of
+        widening to int64 / object
+    """
+    table = load_table(store_dir, columns)
+    data = {}
+    for name, column in zip(table.column_names, table.columns):
+        if pa.types.is_dictionary(column.type) and compact:
+            data[name] = column.to_pandas()
+        elif pa.types.is_dictionary(column.type):
+            values = column.to_pandas()
+            data[name] = values.astype(object).where(values.notna(), np.nan)
+        elif pa.types.is_integer(column.type) and not compact:
+            data[name] = column.to_numpy().astype(np.int64)
+        else:
+            data[name] = column.to_pandas()
+    return pd.DataFrame(data)
+
+
+def load_articles(store_dir):
+    """Sparse gdpr_clause reference matrix / inverted index stored with the table (see gdpr_articles.py)"""
+    from gdpr_articles import ArticleIndex
+    return ArticleIndex.load(store_dir)
+
+
+def load_csv_frame(csv_path, store_dir):
+    """
+    Drop-in for pd.read_csv(csv_path, sep=...): builds the store on first use, then memory-maps it
+
+    store_dir is chosen by the caller (e.g. under the model's output_dir), so the source dataset folder,
+    which may be read-only or shared, is never written to.
+    """
+    build_feature_store(csv_path, store_dir)
+    return load_frame(store_dir)
+
+
+def volume_to_number(values):
+    """'unspecific' (or anything non-numeric) -> 0, as in every notebook's Affected_data_volume handling"""
+    return pd.to_numeric(pd.Series(values, dtype=object).replace('unspecific', 0), errors='coerce').fillna(0)
+
+
+def load_encoded(store_dir, columns=None, fill_numeric=0):
+    """
+    Model-ready view matching Final_DecisionTree.ipynb preprocessing
+
+    Affected_data_volume -> number ('unspecific' -> 0), categorical columns -> persisted label codes
+    (missing -> most frequent code), numeric missing -> fill_numeric; gdpr_clause stays text.
+
+    Returns:
+        (DataFrame, {column: LabelEncoder})
+    """
+    table = load_table(store_dir, columns)
+    encoders = load_encoders(store_dir)
+    data = {}
+    for name, column in zip(table.column_names, table.columns):
+        if not pa.types.is_dictionary(column.type):
+            values = column.to_pandas()
+            if values.isna().any():
+                values = values.fillna(fill_numeric)
+            elif pa.types.is_integer(column.type):
+                values = values.astype(np.int64)
+            data[name] = values
+            continue
+        combined = column.combine_chunks()
+        codes = combined.indices.to_numpy(zero_copy_only=False)
+        missing = combined.indices.is_null().to_numpy(zero_copy_only=False)
+        if name == VOLUME_COLUMN:
+            # 只对字典里的几百个取值做数值转换，再按编码展开
+            numbers = volume_to_number(combined.dictionary.to_pylist()).to_numpy()
+            values = np.where(missing, 0, numbers[np.where(missing, 0, codes)])
+            data[name] = pd.Series(values).astype(np.int64 if np.all(np.mod(values, 1) == 0) else np.float64)
+        elif name in TEXT_COLUMNS:
+            data[name] = load_frame(store_dir, [name])[name]
+        else:
+            codes = codes.astype(np.int64)
+            if missing.any():
+                codes[missing] = np.bincount(codes[~missing]).argmax() if (~missing).any() else 0
+            data[name] = pd.Series(codes)
+    return pd.DataFrame(data), {k: v for k, v in encoders.items() if k in data and k not in TEXT_COLUMNS
+                                and k != VOLUME_COLUMN}
+
+
+def encode_frame(df, store_dir, unknown=-1):
+    """
+    Apply the persisted training encoders to new data (external test set, single-case prediction)
+
+    Unlike re-fitting a LabelEncoder on the test set, codes stay consistent with training;
+    categories never seen in training map to `unknown`.
+    """
+    encoders = load_encoders(store_dir)
+    out = df.copy()
+    if VOLUME_COLUMN in out.columns and not pd.api.types.is_numeric_dtype(out[VOLUME_COLUMN]):
+        out[VOLUME_COLUMN] = volume_to_number(out[VOLUME_COLUMN]).to_numpy()
+    for col, le in encoders.items():
+        if col in out.columns and col not in TEXT_COLUMNS and col != VOLUME_COLUMN:
+            classes = list(le.classes_)
+            lookup = {value: code for code, value in enumerate(classes)}
+            out[col] = out[col].astype(object).map(lambda v: lookup.get(str(v), unknown) if pd.notna(v) else unknown) \
+                .astype(np.int64)
+    return out
+
+
+def legacy_encoded(csv_path):
+    """The notebooks' preprocessing on a freshly parsed CSV, kept to verify load_encoded"""
+    df = pd.read_csv(csv_path, sep=sniff_separator(csv_path))
+    for col in df.columns:
+        if df[col].isna().any():
+            if df[col].dtype in ['int64', 'float64']:
+                df[col] = df[col].fillna(0)
+            else:
+                df[col] = df[col].fillna(df[col].mode()[0])
+    if VOLUME_COLUMN in df.columns and not pd.api.types.is_numeric_dtype(df[VOLUME_COLUMN]):
+        df[VOLUME_COLUMN] = pd.to_numeric(df[VOLUME_COLUMN].replace('unspecific', 0), errors='coerce').fillna(0)
+    for col in df.columns:
+        if col not in TEXT_COLUMNS and not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = LabelEncoder().fit_transform(df[col])
+    return df
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Build the shared feature store and verify its views")
+    parser.add_argument("--data", default="../Dataset/FINAL_dataset.csv")
+    parser.add_argument("--store", default="./feature_store")
+    parser.add_argument("--rebuild", action="store_true")
+    args = parser.parse_args()
+
+    build_feature_store(args.data, args.store, rebuild=args.rebuild)
+
+    start = time.perf_counter()
+    raw = pd.read_csv(args.data, sep=sniff_separator(args.data))
+    csv_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    frame = load_frame(args.store)
+    store_seconds = time.perf_counter() - start
+    pd.testing.assert_frame_equal(frame, raw.astype({c: object for c in raw.columns if raw[c].dtype != np.int64}),
+                                  check_dtype=False)
+    print(f"原始值视图与 read_csv 一致；解析CSV {csv_seconds * 1000:.1f}ms，读取特征表 {store_seconds * 1000:.1f}ms")
+
+    encoded, encoders = load_encoded(args.store)
+    pd.testing.assert_frame_equal(encoded, legacy_encoded(args.data), check_dtype=False)
+    print(f"编码视图与 notebook 预处理一致；编码器: {sorted(encoders)}")
+    print(f"紧凑存储内存: {load_frame(args.store, compact=True).memory_usage(deep=True).sum() / 1e6:.2f} MB，"
+          f"CSV 解析后: {raw.memory_usage(deep=True).sum() / 1e6:.2f} MB")
@@ -0,0 +1,177 @@
+"""Templated feature sentences shared by training, external test, SHAP and inference code.
+
+`features_to_text` is a columnar version of the original `TransformerClassifier._features_to_text`
+loop (kept below as `features_to_text_reference`); it returns byte-identical strings.
+"""
+
+import hashlib
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import infer_dtype, is_bool_dtype, is_numeric_dtype
+
+TEXT_CACHE_SIZE = 8
+# 模板句式改变时加一，使磁盘上的分词缓存（token_batches.tokenize_cached）失效
+TEMPLATE_VERSION = 1
+_text_cache = OrderedDict()
+
+
+def features_to_text_reference(df):
+    """The original row-by-row implementation, kept for equivalence checks and benchmarks"""
+    texts = []
+    for _, row in df.iterrows():
+        text = ""
+        for col, val in row.items():
+            if col == 'gdpr_clause' and isinstance(val, str):
+                clauses = [clause.strip() for clause in str(val).split(',')]
+                clause_text = " and ".join(clauses)
+                text += f"GDPR clauses are {clause_text}. "
+            elif col == 'Date' and isinstance(val, str):
+                text += f"Date is {val}. "
+            elif col in ['country', 'company_industry'] and isinstance(val, str):
+                text += f"{col} is {val}. "
+            elif isinstance(val, (int, float)):
+                if val == 1:
+                    feature_name = col.replace('_', ' ').lower()
+                    text += f"{feature_name} is true. "
+            elif isinstance(val, str):
+                text += f"{col} is {val}. "
+        texts.append(text)
+    return texts
+
+
+def _cell_text(col, val):
+    """Fragment for one cell, same branching as the reference loop (used for mixed-type columns)"""
+    if isinstance(val, str):
+        if col == 'gdpr_clause':
+            return f"GDPR clauses are {' and '.join(clause.strip() for clause in val.split(','))}. "
+        return f"{col} is {val}. "
+    if isinstance(val, (int, float)) and val == 1:
+        return f"{col.replace('_', ' ').lower()} is true. "
+    return ""
+
+
+def _column_fragments(col, series):
+    """Sentence fragment of one column for every row, as an object array"""
+    if is_numeric_dtype(series) or is_bool_dtype(series):
+        # 数值/布尔列：等于1时输出 "<feature> is true. "，NaN / NA 不输出
+        is_one = series.eq(1).fillna(False).to_numpy(dtype=bool)
+        return np.where(is_one, f"{col.replace('_', ' ').lower()} is true. ", "").astype(object)
+
+    if infer_dtype(series, skipna=True) in ("string", "empty"):
+        # 纯字符串列（缺失值为 None/NaN/NA，原实现对它们不输出任何内容）
+        present = series.notna().to_numpy()
+        fragments = np.full(len(series), "", dtype=object)
+        values = series[present].astype(object)
+        if col == 'gdpr_clause':
+            # 等价于逐段 strip 后用 " and " 连接
+            values = values.str.strip().str.replace(r'\s*,\s*', ' and ', regex=True)
+            fragments[present] = ("GDPR clauses are " + values + ". ").to_numpy(dtype=object)
+        else:
+            fragments[present] = (f"{col} is " + values + ". ").to_numpy(dtype=object)
+        return fragments
+
+    # 混合类型列：逐元素按原逻辑处理
+    return np.array([_cell_text(col, val) for val in series.tolist()], dtype=object)
+
+
+def frame_fingerprint(df):
+    """Content hash of a dataframe (values, index, column names and dtypes)"""
+    h = hashlib.sha1()
+    h.update(repr([(str(c), str(t)) for c, t in df.dtypes.items()]).encode("utf-8"))
+    h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def features_to_text(df, use_cache=True):
+    """
+    Columnar equivalent of the original `_features_to_text`
+
+    Builds one fragment array per column and joins them row-wise. Results are memoised on a
+    dataframe fingerprint, so repeated calls on the same frame (each fold, SHAP, inference) are free.
+    """
+    key = None
+    if use_cache:
+        key = frame_fingerprint(df)
+        if key in _text_cache:
+            _text_cache.move_to_end(key)
+            return list(_text_cache[key])
+
+    if len(df.columns) == 0:
+        texts = [""] * len(df)
+    else:
+        fragments = [_column_fragments(col, df[col]) for col in df.columns]
+        texts = ["".join(parts) for parts in zip(*fragments)]
+
+    if use_cache:
+        _text_cache[key] = texts
+        if len(_text_cache) > TEXT_CACHE_SIZE:
+            _text_cache.popitem(last=False)
+        return list(texts)
+    return texts
+
+
+def check_equivalence(df):
+    """Raise AssertionError on the first row where the columnar output differs from the reference"""
+    expected = features_to_text_reference(df)
+    actual = features_to_text(df, use_cache=False)
+    assert len(expected) == len(actual), f"row count differs: {len(expected)} != {len(actual)}"
+    for i, (e, a) in enumerate(zip(expected, actual)):
+        assert e == a, f"row {i} differs:\n  reference: {e!r}\n  columnar:  {a!r}"
+    return True
+
+
+def edge_case_frame():
+    """Small frame covering the type combinations the reference branches on"""
+    return pd.DataFrame({
+        'Affected_data_volume': ['unspecific', '1000', None, ''],
+        'Date': ['2020', None, '2019', '2021'],
+        'country': ['Spain', 'Italy', np.nan, 'France'],
+        'gdpr_clause': ['Article 5(1)(a), Article 6 ,Art. 32', ' Article 9(2)(a) ', np.nan, 'a,,b'],
+        'data_category_Children_data': [1, 0, 1, 0],
+        'violation_rate': [1.0, 0.5, np.nan, 1.0],
+        'flag_bool': [True, False, True, False],
+        'mixed_col': ['text', 1, 2.0, None],
+        'nullable_int': pd.array([1, None, 0, 1], dtype="Int64"),
+    })
+
+
+def benchmark(df, scale=100, repeat=3):
+    """Compare reference and columnar implementations on `df` repeated `scale` times"""
+    big = pd.concat([df] * scale, ignore_index=True)
+    print(f"基准数据: {len(big)} 行 x {big.shape[1]} 列")
+    report = {}
+    for name, func in (("reference", features_to_text_reference),
+                       ("columnar", lambda frame: features_to_text(frame, use_cache=False))):
+        start = time.perf_counter()
+        for _ in range(repeat if name == "columnar" else 1):
+            func(big)
+        report[name] = (time.perf_counter() - start) / (repeat if name == "columnar" else 1)
+        print(f"{name:>9}: {report[name]:.3f}秒")
+    start = time.perf_counter()
+    features_to_text(big)
+    features_to_text(big)
+    report["cached"] = time.perf_counter() - start - report["columnar"]
+    print(f"   cached: {report['cached']:.3f}秒（含指纹计算）")
+    print(f"加速: {report['reference'] / report['columnar']:.1f}x")
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Check and benchmark the columnar feature-to-text conversion")
+    parser.add_argument("--data", default="../Dataset/FINAL_dataset.csv")
+    parser.add_argument("--sep", default=",")
+    parser.add_argument("--scale", type=int, default=100)
+    args = parser.parse_args()
+
+    data = pd.read_csv(args.data, sep=args.sep)
+    # 与 prepare_data 相同的列排除与缺失值填充
+    prepared = data.drop(columns=['fine_amount', 'gdpr_clause', 'violation_result', 'case_group'] +
+                         [c for c in data.columns if c.startswith('violation_nature_')], errors='ignore')
+    for frame, label in ((data, "原始数据"), (prepared, "prepare_data 预处理后"), (edge_case_frame(), "边界用例")):
+        check_equivalence(frame)
+        print(f"等价性检查通过: {label}（{len(frame)} 行）")
+    benchmark(prepared, scale=args.scale)
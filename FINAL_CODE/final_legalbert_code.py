@@ -28,14 +28,25 @@ import pandas as pd
 import numpy as np
 import torch
 from datasets import Dataset
-from transformers import AutoTokenizer, AutoModelForSequenceClassification, TrainingArguments, Trainer
-from sklearn.model_selection import KFold
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+from sklearn.model_selection import KFold, GroupKFold
 from sklearn.preprocessing import LabelEncoder
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.linear_model import LogisticRegression
 from sklearn.pipeline import make_pipeline
 from sklearn.metrics import accuracy_score, precision_recall_fscore_support, classification_report, confusion_matrix
 
+from feature_text import features_to_text
+from feature_store import load_csv_frame
+from token_batches import token_length_histogram, tokenize_cached
+from fold_training import (snapshot_state, train_fold, run_folds_parallel, make_trainer, prediction_arguments, compute_metrics,
+                           log_checkpoint_io)
+from checkpoint_io import CheckpointIO
+from inference_export import EXPORT_FORMATS, export_model, ExportedPredictor, fp32_predict_proba, check_parity
+from embedding_cache import FrozenEncoderCache
+from multi_task import (MultiTaskModel, MISSING_LABEL, FINE_BRACKET, FINE_BRACKET_NAMES, fine_bracket,
+                        multi_task_metrics, task_reports, save_task_config, load_multi_task_model)
+
 warnings.filterwarnings('ignore')
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -45,20 +56,46 @@ logger = logging.getLogger('Violationresult')
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 class TransformerClassifier:
-    def __init__(self, model_name="JQ1984/legalbert_gdpr_pretrained", num_labels=None, output_dir="./results", multi_label=False):
+    def __init__(self, model_name="JQ1984/legalbert_gdpr_pretrained", num_labels=None, output_dir="./results", multi_label=False,
+                 max_length=256, dynamic_padding=True, group_by_length=False, multi_task=False, task_weights=None,
+                 feature_store_dir=None):
         self.model_name = model_name
         self.num_labels = num_labels
         self.output_dir = output_dir
         self.multi_label = multi_label
+        # multi_task: one shared encoder with a head per target column (every target of prepare_data),
+        # trained with one summed loss; task_weights optionally weights each target's loss
+        self.multi_task = multi_task
+        self.task_weights = task_weights
+        self.target_columns = None
+        self.task_num_labels = None # {target: class count} in multi-task mode
+        self.task_label_names = {} # {target: class names} in multi-task mode
+        self.label_encoders = {} # LabelEncoder of each categorical target in multi-task mode
+        # dynamic_padding: pad per batch (DataCollatorWithPadding) instead of to max_length;
+        # group_by_length: batch examples of similar token length together during training
+        self.max_length = max_length
+        self.dynamic_padding = dynamic_padding
+        self.group_by_length = group_by_length
+        self.token_length_stats = None
         self.tokenizer = None
         self.model = None
+        self.initial_state = None # CPU copy of the pretrained weights + initial classifier head
         self.trainer = None
         self.train_time = None # User's original attribute
 
         # Attributes from user's original prepare_data/load_external_test_data
         self.label_encoder = None
         self.kf = None # KFold object
-        self.fold_datasets = [] # List of (train_dataset, val_dataset) tuples for K-Fold
+        self.full_dataset = None # Dataset of every training text, built once in prepare_data
+        self.fold_indices = [] # List of (train_idx, val_idx) row arrays into full_dataset
+        self.fold_datasets = [] # List of (train_dataset, val_dataset) index views over full_dataset
+        self.tokenized_corpus = None # full_dataset tokenized once (Arrow cache under output_dir/token_cache)
+        self.token_cache_dir = os.path.join(output_dir, "token_cache")
+        self.embedding_cache_dir = os.path.join(output_dir, "embedding_cache")
+        # Parsed CSV feature tables, one sub-directory per source file (never next to the dataset itself)
+        self.feature_store_dir = feature_store_dir or os.path.join(output_dir, "feature_store")
+        self.embedding_cache = None # FrozenEncoderCache of the last frozen-encoder run
+        self.frozen_head = None # Head (+ top layers) trained on the last fold of the frozen-encoder run
 
         # Attributes needed for external test data handling by original methods and baseline
         self.X_test_external_original = None # List of text strings for external test set
@@ -75,33 +112,27 @@ class TransformerClassifier:
         self.baseline_model_last_fold = None # Stores the pipeline from the last fold of baseline CV
 
 
-    def _features_to_text(self, df): # User's original method
-        texts = []
-        for _, row in df.iterrows():
-            text = ""
-            for col, val in row.items():
-                if col == 'gdpr_clause' and isinstance(val, str):
-                    clauses = [clause.strip() for clause in str(val).split(',')]
-                    clause_text = " and ".join(clauses)
-                    text += f"GDPR clauses are {clause_text}. "
-                elif col == 'Date' and isinstance(val, str):
-                    text += f"Date is {val}. "
-                elif col in ['country', 'company_industry'] and isinstance(val, str):
-                    text += f"{col} is {val}. "
-                elif isinstance(val, (int, float)):
-                    if val == 1:
-                        feature_name = col.replace('_', ' ').lower()
-                        text += f"{feature_name} is true. "
-                elif isinstance(val, str):
-                    text += f"{col} is {val}. "
-            texts.append(text)
-        return texts
-
-    def prepare_data(self, df, target_columns, n_splits=5): # User's original method
-        """Prepare data for K-fold cross validation"""
+    def load_csv(self, file_path):
+        """Read a dataset CSV through the shared feature store under feature_store_dir"""
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        return load_csv_frame(file_path, os.path.join(self.feature_store_dir, name))
+
+    def _features_to_text(self, df):
+        """Templated feature sentences; columnar and memoised, byte-identical to the original iterrows loop
+        (see feature_text.features_to_text_reference / check_equivalence)"""
+        return features_to_text(df)
+
+    def prepare_data(self, df, target_columns, n_splits=5, groups=None): # User's original method
+        """Prepare data for K-fold cross validation
+
+        groups: optional near-duplicate group key per row (defaults to the 'case_group' column written by
+        Annotation_Sink.export_dataset when present); rows of one group never straddle train and validation.
+        """
         logger.info(f"Preparing dataset for {n_splits}-fold cross validation, target columns: {target_columns}")
 
-        exclude_columns = ['fine_amount']
+        if groups is None and 'case_group' in df.columns:
+            groups = df['case_group'].values
+        exclude_columns = ['fine_amount', 'case_group']
         exclude_columns.extend([col for col in df.columns if col.startswith('violation_nature_')])
 
         if 'gdpr_clause' in df.columns:
@@ -113,63 +144,125 @@ class TransformerClassifier:
         if not target_columns:
             raise ValueError("Target columns not specified. Ensure the dataset contains a 'violation_result' column or provide a custom list of target columns.")
 
-        missing_cols = [col for col in target_columns if col not in df_copy.columns]
-        if missing_cols:
-            raise ValueError(f"The following target columns are missing from the dataset after exclusions: {missing_cols}")
-
-        for col in df_copy.select_dtypes(include=['object']).columns:
-            df_copy[col] = df_copy[col].fillna('')
-        for col in df_copy.select_dtypes(include=['number']).columns:
-            if col not in target_columns:
-                df_copy[col] = df_copy[col].fillna(df_copy[col].median())
-
-        target_col = target_columns[0]
-
-        if df_copy[target_col].dtype == 'object':
-            logger.info(f"Target column '{target_col}' is categorical, converting to numeric categories")
-            le = LabelEncoder()
-            df_copy[target_col] = le.fit_transform(df_copy[target_col])
-            self.label_encoder = le
-            logger.info(f"Category mapping: {dict(zip(le.classes_, le.transform(le.classes_)))}")
-
-        X = df_copy.drop(columns=target_columns)
-        Y = df_copy[target_col].astype('int64')
-
-        # Set self.num_labels if not already set or if it mismatches
-        if self.num_labels is None or self.num_labels != len(Y.unique()):
-            if self.num_labels is not None and self.num_labels != len(Y.unique()):
-                 logger.warning(f"Initialized num_labels ({self.num_labels}) does not match unique values in target ({len(Y.unique())}). Updating.")
-            self.num_labels = len(Y.unique())
-
-
-        logger.info(f"Feature count (after exclusions for text generation): {X.shape[1]}, Sample count: {X.shape[0]}")
-        logger.info(f"Category count: {self.num_labels}, Category distribution: {Y.value_counts().to_dict()}")
+        self.target_columns = list(target_columns)
+        if self.multi_task:
+            X, Y = self._multi_task_targets(df, df_copy, target_columns)
+            labels = Y.values.tolist()
+            logger.info(f"Feature count (after exclusions for text generation): {X.shape[1]}, Sample count: {X.shape[0]}")
+        else:
+            if len(target_columns) > 1:
+                logger.warning(f"Only the first target column '{target_columns[0]}' is used; "
+                               f"set multi_task=True to train {target_columns} together.")
+            missing_cols = [col for col in target_columns if col not in df_copy.columns]
+            if missing_cols:
+                raise ValueError(f"The following target columns are missing from the dataset after exclusions: {missing_cols}")
+
+            for col in df_copy.select_dtypes(include=['object']).columns:
+                df_copy[col] = df_copy[col].fillna('')
+            for col in df_copy.select_dtypes(include=['number']).columns:
+                if col not in target_columns:
+                    df_copy[col] = df_copy[col].fillna(df_copy[col].median())
+
+            target_col = target_columns[0]
+
+            if df_copy[target_col].dtype == 'object':
+                logger.info(f"Target column '{target_col}' is categorical, converting to numeric categories")
+                le = LabelEncoder()
+                df_copy[target_col] = le.fit_transform(df_copy[target_col])
+                self.label_encoder = le
+                logger.info(f"Category mapping: {dict(zip(le.classes_, le.transform(le.classes_)))}")
+
+            X = df_copy.drop(columns=target_columns)
+            Y = df_copy[target_col].astype('int64')
+            labels = Y.values
+
+            # Set self.num_labels if not already set or if it mismatches
+            if self.num_labels is None or self.num_labels != len(Y.unique()):
+                if self.num_labels is not None and self.num_labels != len(Y.unique()):
+                     logger.warning(f"Initialized num_labels ({self.num_labels}) does not match unique values in target ({len(Y.unique())}). Updating.")
+                self.num_labels = len(Y.unique())
+
+
+            logger.info(f"Feature count (after exclusions for text generation): {X.shape[1]}, Sample count: {X.shape[0]}")
+            logger.info(f"Category count: {self.num_labels}, Category distribution: {Y.value_counts().to_dict()}")
 
         X_text = self._features_to_text(X)
-
-        self.kf = KFold(n_splits=n_splits, shuffle=True, random_state=42)
+        try:
+            self.token_length_stats = token_length_histogram(self._load_tokenizer(), X_text, self.max_length)
+        except Exception as e:
+            logger.warning(f"Could not compute token length histogram: {e}")
+
+        if groups is not None:
+            logger.info(f"Using GroupKFold over {len(set(groups))} near-duplicate groups")
+            self.kf = GroupKFold(n_splits=n_splits)
+        else:
+            self.kf = KFold(n_splits=n_splits, shuffle=True, random_state=42)
+        self.full_dataset = Dataset.from_dict({'text': X_text, 'labels': labels})
+        self.tokenized_corpus = None
+        self.fold_indices = []
         self.fold_datasets = []
 
-        for train_idx, val_idx in self.kf.split(X_text):
-            X_train_fold_text = [X_text[i] for i in train_idx]
-            X_val_fold_text = [X_text[i] for i in val_idx]
-            y_train_fold = Y.iloc[train_idx].values
-            y_val_fold = Y.iloc[val_idx].values
-
-            train_dataset = Dataset.from_dict({'text': X_train_fold_text, 'labels': y_train_fold})
-            val_dataset = Dataset.from_dict({'text': X_val_fold_text, 'labels': y_val_fold})
-            self.fold_datasets.append((train_dataset, val_dataset))
+        for train_idx, val_idx in self.kf.split(X_text, groups=groups):
+            # select() only stores a row-index mapping, the texts are not copied per fold
+            self.fold_indices.append((train_idx, val_idx))
+            self.fold_datasets.append((self.full_dataset.select(train_idx), self.full_dataset.select(val_idx)))
 
         logger.info(f"Created {n_splits} folds for cross-validation stored in self.fold_datasets")
         return True
 
 
+    def _target_codes(self, df, col, fit):
+        """Integer codes of one target column (MISSING_LABEL where unknown) and its class names"""
+        if col == FINE_BRACKET:
+            return fine_bracket(df['fine_amount']), list(FINE_BRACKET_NAMES)
+        values = df[col]
+        if values.dtype == 'object' or isinstance(values.dtype, pd.StringDtype):
+            if fit:
+                self.label_encoders[col] = LabelEncoder().fit(values.dropna().astype(str))
+            le = self.label_encoders[col]
+            known = values.notna() & values.astype(str).isin(le.classes_)
+            codes = np.full(len(values), MISSING_LABEL, dtype='int64')
+            codes[known.to_numpy()] = le.transform(values[known].astype(str))
+            return codes, list(le.classes_)
+        codes = pd.to_numeric(values, errors='coerce').fillna(MISSING_LABEL).to_numpy(dtype='int64')
+        return codes, list(range(int(codes.max()) + 1))
+
+    def _multi_task_targets(self, df, df_copy, target_columns):
+        """Feature frame and (rows x targets) label frame for multi-task training
+
+        Targets may be excluded feature columns (violation_nature_*) or 'fine_bracket', derived from
+        fine_amount; they are never part of the text.
+        """
+        missing_cols = [col for col in target_columns
+                        if col not in df.columns and not (col == FINE_BRACKET and 'fine_amount' in df.columns)]
+        if missing_cols:
+            raise ValueError(f"The following target columns are missing from the dataset: {missing_cols}")
+
+        for col in df_copy.select_dtypes(include=['object']).columns:
+            df_copy[col] = df_copy[col].fillna('')
+        for col in df_copy.select_dtypes(include=['number']).columns:
+            if col not in target_columns:
+                df_copy[col] = df_copy[col].fillna(df_copy[col].median())
+
+        Y = pd.DataFrame(index=df.index)
+        self.task_num_labels, self.task_label_names, self.label_encoders = {}, {}, {}
+        for col in target_columns:
+            Y[col], names = self._target_codes(df, col, fit=True)
+            self.task_num_labels[col] = len(names)
+            self.task_label_names[col] = names
+            known = Y[col][Y[col] != MISSING_LABEL]
+            logger.info(f"Target '{col}': {len(names)} categories, distribution: {known.value_counts().sort_index().to_dict()}"
+                        + (f", {len(Y) - len(known)} rows unlabeled" if len(known) < len(Y) else ""))
+        self.num_labels = dict(self.task_num_labels)
+        return df_copy.drop(columns=target_columns, errors='ignore'), Y
+
     def load_external_test_data(self, file_path, target_columns): # User's original method
         """Load external test dataset"""
         logger.info(f"Loading external test data from {file_path}")
 
         if file_path.endswith('.csv'):
-            test_df = pd.read_csv(file_path, sep=';')
+            # 通过共享特征表读取（首次使用时生成，之后直接内存映射）
+            test_df = self.load_csv(file_path)
         else:
             raise ValueError("Unsupported file format")
 
@@ -187,6 +280,9 @@ class TransformerClassifier:
             if col not in target_columns:
                 test_df[col] = test_df[col].fillna(test_df[col].median())
 
+        if self.multi_task:
+            return self._load_external_multi_task(test_df, target_columns)
+
         target_col = target_columns[0]
         has_labels_in_file = False
         if target_col in test_df.columns:
@@ -219,142 +315,176 @@ class TransformerClassifier:
         logger.info(f"External test size: {len(self.external_test_dataset)}")
         return True
 
+    def _load_external_multi_task(self, test_df, target_columns):
+        """External test set in multi-task mode: a label matrix (targets absent from the file are unlabeled)"""
+        present = [col for col in target_columns
+                   if col in test_df.columns or (col == FINE_BRACKET and 'fine_amount' in test_df.columns)]
+        if present:
+            labels = np.full((len(test_df), len(target_columns)), MISSING_LABEL, dtype='int64')
+            for i, col in enumerate(target_columns):
+                if col in present:
+                    labels[:, i] = self._target_codes(test_df, col, fit=False)[0]
+            self.y_test_external = labels
+        else:
+            self.y_test_external = None
+
+        # 与 prepare_data 相同的排除列，目标列不进入文本
+        exclude_columns = list(target_columns) + ['fine_amount', 'case_group', 'gdpr_clause']
+        exclude_columns.extend([col for col in test_df.columns if col.startswith('violation_nature_')])
+        self.X_test_external_original = self._features_to_text(test_df.drop(columns=exclude_columns, errors='ignore'))
+        data = {'text': self.X_test_external_original}
+        if self.y_test_external is not None:
+            data['labels'] = self.y_test_external.tolist()
+        self.external_test_dataset = Dataset.from_dict(data)
+        logger.info(f"External test size: {len(self.external_test_dataset)}, labeled targets: {present}")
+        return True
+
+    def _load_tokenizer(self):
+        if self.tokenizer is None:
+            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        return self.tokenizer
+
     def load_model(self): # User's original method
         logger.info(f"Loading model: {self.model_name}")
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        self._load_tokenizer()
         if self.num_labels is None: # Ensure num_labels is set
             raise ValueError("self.num_labels has not been set. Run prepare_data first.")
-        self.model = AutoModelForSequenceClassification.from_pretrained(
-            self.model_name,
-            num_labels=self.num_labels,
-            problem_type="multi_label_classification" if self.multi_label else None
-        )
+        if self.multi_task:
+            self.model = MultiTaskModel.from_pretrained(self.model_name, self.task_num_labels, self.task_weights)
+            save_task_config(self._task_config_path(), self.task_num_labels, self.task_weights, self.task_label_names)
+        else:
+            self.model = AutoModelForSequenceClassification.from_pretrained(
+                self.model_name,
+                num_labels=self.num_labels,
+                problem_type="multi_label_classification" if self.multi_label else None
+            )
         self.model.to(device)
+        # Snapshot once; every fold restores it with load_state_dict instead of reloading from disk
+        self.initial_state = snapshot_state(self.model)
+
+    def _task_config_path(self):
+        return os.path.join(self.output_dir, "task_config.json")
+
+    def tokenize_data(self, dataset, max_length=None, tag="dataset"): # User's original method
+        """Tokenize a single dataset (unpadded when dynamic_padding is on; the collator pads each batch)
 
-    def tokenize_data(self, dataset, max_length=256): # User's original method
-        """Tokenize a single dataset"""
+        The result is cached on disk keyed by tokenizer, template version, settings and content, so
+        an unchanged dataset is never tokenized twice.
+        """
         if not self.tokenizer: # Added check
             logger.error("Tokenizer not available. Load model first.")
             return None
-        def tokenize_function(examples):
-            return self.tokenizer(
-                examples['text'],
-                padding="max_length",
-                truncation=True,
-                max_length=max_length
-            )
-        return dataset.map(tokenize_function, batched=True)
+        return tokenize_cached(
+            dataset,
+            self.tokenizer,
+            self.token_cache_dir,
+            max_length=max_length or self.max_length,
+            padding=False if self.dynamic_padding else "max_length",
+            return_length=self.group_by_length,
+            tag=tag
+        )
 
-    def train_and_evaluate_kfold(self, epochs=3, batch_size=16, learning_rate=3e-5, weight_decay=0.01): # User's original method
-        """Train and evaluate using K-fold cross validation, but avoid multiple model loads"""
+    def tokenize_corpus(self):
+        """Tokenize full_dataset once; folds are select() views over the result"""
+        if self.tokenized_corpus is None:
+            self.tokenized_corpus = self.tokenize_data(self.full_dataset, tag="corpus")
+        return self.tokenized_corpus
+
+    def train_and_evaluate_kfold(self, epochs=3, batch_size=16, learning_rate=3e-5, weight_decay=0.01,
+                                 parallel_folds=None, threads_per_fold=None, checkpoint_mode="trainer",
+                                 async_saves=True): # User's original method
+        """Train and evaluate using K-fold cross validation, but avoid multiple model loads
+
+        Every fold restores the in-memory snapshot of the initial weights, so folds are independent of
+        each other. parallel_folds > 1 trains that many folds at once in a process pool (CPU only),
+        each with threads_per_fold torch threads (default: cores split evenly); the metrics match a
+        sequential run with the same thread count per fold.
+
+        checkpoint_mode: "trainer" (full checkpoint every epoch, as before), "memory" (best weights kept
+        in memory, best_model written once as safetensors) or "weights" (best weights rewritten as the
+        fold's single checkpoint whenever they improve); async_saves writes them on a background thread.
+        Bytes written and seconds spent saving are reported per fold (result['checkpoint_io']).
+        """
         logger.info("Starting K-fold cross validation training")
 
-        self.load_model() # Load model only once (sets self.model and self.tokenizer)
+        self.load_model() # Load model only once (sets self.model, self.tokenizer and self.initial_state)
 
         fold_results = []
-        fold_accuracies = []
-        all_fold_train_times = []
-
-        for fold, (train_dataset, val_dataset) in enumerate(self.fold_datasets):
-            logger.info(f"Training fold {fold+1}/{len(self.fold_datasets)}")
-
-            fold_output_dir = os.path.join(self.output_dir, f"fold_{fold+1}")
-            if not os.path.exists(fold_output_dir):
-                os.makedirs(fold_output_dir)
-
-            tokenized_train = self.tokenize_data(train_dataset)
-            tokenized_val = self.tokenize_data(val_dataset)
-
-            if tokenized_train is None or tokenized_val is None:
-                logger.error(f"Tokenization failed for fold {fold+1}. Skipping.")
-                fold_accuracies.append(0.0)
-                fold_results.append({
-                    'fold': fold+1,
-                    'eval_results': {'eval_accuracy': 0.0, 'eval_f1': 0.0, 'eval_precision': 0.0, 'eval_recall': 0.0},
-                    'training_time': 0.0
-                })
-                continue
 
-            if fold > 0:
-                logger.info(f"Reinitializing model weights for fold {fold+1} using local files.")
-                self.model = AutoModelForSequenceClassification.from_pretrained(
-                    self.model_name,
-                    num_labels=self.num_labels,
-                    problem_type="multi_label_classification" if self.multi_label else None,
-                    from_tf=False,
-                    local_files_only=True
+        tokenized_corpus = self.tokenize_corpus()
+        if tokenized_corpus is None:
+            logger.error("Tokenization failed. Skipping K-fold training.")
+            fold_results = [{
+                'fold': fold+1,
+                'eval_results': {'eval_accuracy': 0.0, 'eval_f1': 0.0, 'eval_precision': 0.0, 'eval_recall': 0.0},
+                'training_time': 0.0
+            } for fold in range(len(self.fold_indices))]
+        else:
+            jobs = [{
+                'fold': fold+1,
+                'output_dir': os.path.join(self.output_dir, f"fold_{fold+1}"),
+                'train_idx': train_idx,
+                'val_idx': val_idx,
+                'epochs': epochs,
+                'batch_size': batch_size,
+                'learning_rate': learning_rate,
+                'weight_decay': weight_decay,
+                'group_by_length': self.group_by_length,
+                'task_num_labels': self.task_num_labels if self.multi_task else None,
+                'task_weights': self.task_weights,
+                'checkpoint_mode': checkpoint_mode,
+                'async_saves': async_saves
+            } for fold, (train_idx, val_idx) in enumerate(self.fold_indices)]
+
+            if parallel_folds and parallel_folds > 1 and device.type == "cpu":
+                fold_results = run_folds_parallel(
+                    jobs, self.model.config, self.tokenizer, tokenized_corpus.cache_files[0]['filename'],
+                    self.initial_state, workers=min(parallel_folds, len(jobs)), threads_per_worker=threads_per_fold
                 )
+                # The last fold's trainer lives in a worker: rebuild one from its saved best model for prediction
+                last_fold_dir = jobs[-1]['output_dir']
+                if self.multi_task:
+                    self.model = load_multi_task_model(os.path.join(last_fold_dir, "best_model"), self.model.config,
+                                                       self._task_config_path())
+                else:
+                    self.model = AutoModelForSequenceClassification.from_pretrained(os.path.join(last_fold_dir, "best_model"))
                 self.model.to(device)
-
-            training_args = TrainingArguments(
-                output_dir=fold_output_dir,
-                num_train_epochs=epochs,
-                per_device_train_batch_size=batch_size,
-                per_device_eval_batch_size=batch_size,
-                weight_decay=weight_decay,
-                learning_rate=learning_rate,
-                logging_dir=f"{fold_output_dir}/logs",
-                evaluation_strategy="epoch",
-                save_strategy="epoch",
-                load_best_model_at_end=True,
-                metric_for_best_model="f1",
-                greater_is_better=True,
-                push_to_hub=False,
-                report_to="none"
-            )
-
-            def compute_metrics(eval_pred): # User's original compute_metrics
-                logits, labels = eval_pred
-                if np.isnan(labels).any() or np.isinf(labels).any():
-                    print("Warning: Labels contain NaN or Inf values")
-                    labels = np.nan_to_num(labels, nan=0.0, posinf=1.0, neginf=0.0)
-                preds = np.argmax(logits, axis=1)
-                print(f"Labels shape: {labels.shape}, Predictions shape: {preds.shape}")
-                print(f"Labels type: {type(labels)}, Predictions type: {type(preds)}")
-                print(f"Unique labels: {np.unique(labels)}")
-                print(f"Unique predictions: {np.unique(preds)}")
-                try:
-                    precision, recall, f1, _ = precision_recall_fscore_support(
-                        labels, preds, average='macro', zero_division=0
+                self.trainer = make_trainer(self.model, self.tokenizer, prediction_arguments(last_fold_dir, batch_size),
+                                            device=device, metrics=self._metrics())
+            else:
+                if parallel_folds and parallel_folds > 1:
+                    logger.warning("Fold-parallel training is CPU only; running folds sequentially on the GPU.")
+                if threads_per_fold:
+                    torch.set_num_threads(threads_per_fold)
+                # One writer thread for every fold: a fold's weights are written while the next fold trains
+                checkpoint_io = CheckpointIO(background=async_saves)
+                for job in jobs:
+                    logger.info(f"Training fold {job['fold']}/{len(jobs)}")
+                    result, current_trainer = train_fold(
+                        job, self.model, self.tokenizer,
+                        tokenized_corpus.select(job['train_idx']), tokenized_corpus.select(job['val_idx']),
+                        self.initial_state, device, io=checkpoint_io
                     )
-                    acc = (preds == labels).mean()
-                    return {'accuracy': acc, 'f1': f1, 'precision': precision, 'recall': recall}
-                except Exception as e:
-                    print(f"Error calculating metrics: {e}")
-                    return {'accuracy': 0.0, 'f1': 0.0, 'precision': 0.0, 'recall': 0.0}
-
-            current_trainer = Trainer( # Renamed to avoid confusion with self.trainer
-                model=self.model,
-                args=training_args,
-                train_dataset=tokenized_train,
-                eval_dataset=tokenized_val,
-                compute_metrics=compute_metrics,
-                tokenizer=self.tokenizer
-            )
+                    fold_results.append(result)
+                    if job is jobs[-1]:
+                        self.trainer = current_trainer
+                checkpoint_io.close()
+                for result in fold_results:
+                    result['checkpoint_io'] = log_checkpoint_io(result['fold'], checkpoint_io.report(result['fold']))
 
-            start_time_fold = time.time()
-            current_trainer.train()
-            # self.train_time = time.time() - start_time_fold # User's original used self.train_time
-            # For clarity, using a local variable for fold-specific time and then for avg
-            current_fold_train_time = time.time() - start_time_fold
-            all_fold_train_times.append(current_fold_train_time)
+        return self._summarize_folds(fold_results, 'avg_kfold_results.json')
 
+    def _metrics(self):
+        return multi_task_metrics(list(self.task_num_labels)) if self.multi_task else compute_metrics
 
-            eval_results = current_trainer.evaluate()
-            fold_accuracy = eval_results['eval_accuracy']
-            fold_accuracies.append(fold_accuracy)
-            logger.info(f"Fold {fold+1} training time: {current_fold_train_time:.2f}s, Accuracy: {fold_accuracy:.4f}")
-
-            with open(os.path.join(fold_output_dir, 'eval_results.json'), 'w') as f:
-                json.dump(eval_results, f)
-            fold_results.append({
-                'fold': fold+1,
-                'eval_results': eval_results,
-                'training_time': current_fold_train_time # User's original was self.train_time
-            })
-            current_trainer.save_model(os.path.join(fold_output_dir, "best_model"))
-            if fold == len(self.fold_datasets) - 1:
-                self.trainer = current_trainer
+    def _summarize_folds(self, fold_results, results_file):
+        """Print the fold accuracies, average the fold metrics and save them under output_dir"""
+        fold_accuracies = []
+        all_fold_train_times = []
+        for result in fold_results:
+            fold_accuracies.append(result['eval_results']['eval_accuracy'])
+            if result['training_time']:
+                all_fold_train_times.append(result['training_time'])
 
         print("\n===== K-fold Cross Validation Accuracies =====")
         for i, acc in enumerate(fold_accuracies):
@@ -368,11 +498,76 @@ class TransformerClassifier:
             'avg_recall': np.mean([res['eval_results'].get('eval_recall', 0.0) for res in fold_results if 'eval_results' in res]) if fold_results else 0.0,
             'avg_training_time': np.mean(all_fold_train_times) if all_fold_train_times else 0.0 # Changed from user's [fold['training_time'] for fold in fold_results] to use collected times
         }
-        with open(os.path.join(self.output_dir, 'avg_kfold_results.json'), 'w') as f:
+        if self.multi_task and fold_results and f"eval_f1_{self.target_columns[0]}" in fold_results[0]['eval_results']:
+            # 多任务：每个目标单独的平均指标（上面的 avg_* 是各目标的平均）
+            print("\n===== Per-target K-fold averages =====")
+            for name in self.target_columns:
+                for metric in ('accuracy', 'f1', 'precision', 'recall'):
+                    avg_results[f'avg_{metric}_{name}'] = float(np.mean([res['eval_results'][f'eval_{metric}_{name}'] for res in fold_results]))
+                print(f"{name}: Accuracy {avg_results[f'avg_accuracy_{name}']:.4f}, F1 {avg_results[f'avg_f1_{name}']:.4f}")
+        io_reports = [res['checkpoint_io'] for res in fold_results if 'checkpoint_io' in res]
+        if io_reports:
+            print("\n===== Checkpoint I/O per fold =====")
+            for res in fold_results:
+                report = res['checkpoint_io']
+                print(f"Fold {res['fold']}: {report['bytes_written'] / 2**20:.1f} MB in {report['saves']} saves, "
+                      f"{report['save_seconds']:.2f}s saving, {report['blocking_seconds']:.2f}s blocking")
+            avg_results['total_checkpoint_bytes'] = int(sum(r['bytes_written'] for r in io_reports))
+            avg_results['total_checkpoint_seconds'] = float(sum(r['save_seconds'] for r in io_reports))
+            avg_results['total_checkpoint_blocking_seconds'] = float(sum(r['blocking_seconds'] for r in io_reports))
+        with open(os.path.join(self.output_dir, results_file), 'w') as f:
             json.dump(avg_results, f)
         logger.info(f"K-fold cross validation complete. Average Accuracy: {avg_results['avg_accuracy']:.4f}")
         return fold_results, avg_results, fold_accuracies
 
+    def train_and_evaluate_kfold_frozen(self, head="linear", unfreeze_top=0, pooling="cls", epochs=None, batch_size=32,
+                                        learning_rate=None, weight_decay=0.01, labels=None, num_labels=None):
+        """K-fold cross validation of a head trained on frozen-encoder outputs
+
+        The encoder runs once over the tokenized corpus and its outputs are kept in a memory-mapped
+        cache (output_dir/embedding_cache, reused while model weights and corpus are unchanged). Each fold
+        then trains only a linear / MLP head, or with unfreeze_top=N the top N encoder layers + head, from
+        that cache. labels / num_labels select another target over the same rows (default: prepare_data's).
+
+        In multi-task mode the shared encoder is cached and one target is trained per call: labels is a
+        target name (default: the first target); rows where it is unknown (MISSING_LABEL) are skipped.
+        """
+        if self.multi_label:
+            raise ValueError("The frozen-encoder mode supports single-label targets only.")
+        if self.multi_task and labels is not None and not isinstance(labels, str):
+            raise ValueError(f"In multi-task mode labels is a target name, one of {self.target_columns}")
+        logger.info(f"Starting frozen-encoder K-fold cross validation (head={head}, unfreeze_top={unfreeze_top})")
+        if self.model is None:
+            self.load_model()
+        target = None
+        if self.multi_task:
+            target = labels or self.target_columns[0]
+            if target not in self.target_columns:
+                raise ValueError(f"Unknown target {target!r}, expected one of {self.target_columns}")
+            labels = np.asarray(self.full_dataset['labels'])[:, self.target_columns.index(target)]
+            num_labels = num_labels or self.task_num_labels[target]
+            logger.info(f"Multi-task model: training a frozen-encoder head for target '{target}'")
+        elif labels is None:
+            labels = np.asarray(self.full_dataset['labels'])
+        labels = np.asarray(labels)
+        num_labels = num_labels or int(labels[labels != MISSING_LABEL].max()) + 1
+
+        tokenized_corpus = self.tokenize_corpus()
+        self.embedding_cache = FrozenEncoderCache(self.model, self.embedding_cache_dir, unfreeze_top, pooling).build(
+            tokenized_corpus, os.path.basename(tokenized_corpus.cache_files[0]['filename']), device=device)
+
+        fold_results = []
+        for fold, (train_idx, val_idx) in enumerate(self.fold_indices):
+            result, self.frozen_head = self.embedding_cache.train_fold(
+                train_idx, val_idx, labels, num_labels, head=head, epochs=epochs, batch_size=batch_size,
+                learning_rate=learning_rate, weight_decay=weight_decay, device=device)
+            result['fold'] = fold + 1
+            logger.info(f"Fold {fold+1} head training time: {result['training_time']:.2f}s, "
+                        f"Accuracy: {result['eval_results']['eval_accuracy']:.4f}")
+            fold_results.append(result)
+        suffix = f"_{target}" if target else ""
+        return self._summarize_folds(fold_results, f"avg_kfold_frozen_{head}_top{unfreeze_top}{suffix}_results.json")
+
     def evaluate_external_test(self): # User's original method
         """Evaluate on the external test set using the last fold's model"""
         logger.info("Evaluating model on external test set")
@@ -385,11 +580,14 @@ class TransformerClassifier:
             logger.error("No trainer available. Run train_and_evaluate_kfold first.")
             return None
 
-        tokenized_test = self.tokenize_data(self.external_test_dataset)
+        tokenized_test = self.tokenize_data(self.external_test_dataset, tag="external")
         if tokenized_test is None:
             logger.error("Tokenization of external test set failed.")
             return None
 
+        if self.multi_task:
+            return self._evaluate_external_multi_task(tokenized_test)
+
         # User's original logic for checking labels in external_test_dataset directly
         has_labels_in_dataset = 'labels' in self.external_test_dataset.features
 
@@ -434,6 +632,54 @@ class TransformerClassifier:
             logger.error("No trainer available for prediction.")
             return None
 
+    def _evaluate_external_multi_task(self, tokenized_test):
+        """Per-target classification reports (or predictions) of the multi-task model on the external test set"""
+        test_predictions_output = self.trainer.predict(tokenized_test)
+        logits = test_predictions_output.predictions
+        if self.y_test_external is not None:
+            reports = task_reports(logits, self.y_test_external, self.target_columns, self.task_label_names,
+                                   output_dir=self.output_dir)
+            return {'test_results': test_predictions_output.metrics, 'task_reports': reports}
+        pred_df = pd.DataFrame({name: np.argmax(logits[i], axis=1) for i, name in enumerate(self.target_columns)})
+        pred_df.to_csv(os.path.join(self.output_dir, 'external_test_predictions.csv'), index=False)
+        print("\nPredictions for external test set saved to 'external_test_predictions.csv'")
+        return {'predictions': pred_df}
+
+    def _baseline_labels(self, labels):
+        """Baseline targets: in multi-task mode the baseline is trained on the first target column"""
+        labels = np.array(labels)
+        return labels[:, 0] if labels.ndim == 2 else labels
+
+    def export_for_inference(self, export_dir=None, formats=EXPORT_FORMATS, parity_texts=None):
+        """Export the last fold's model for CPU inference (ONNX / ONNX int8 / PyTorch dynamic int8)
+
+        Each format goes to export_dir/<format> and is loaded back with ExportedPredictor; when
+        parity_texts are given (default: the external test texts) its probabilities are checked
+        against the fp32 model. Returns {format: ExportedPredictor}.
+        """
+        if self.model is None:
+            logger.error("No trained model available. Run train_and_evaluate_kfold first.")
+            return None
+        export_dir = export_dir or os.path.join(self.output_dir, "inference_export")
+        if self.multi_task:
+            label_names = self.task_label_names
+            task_config = {'task_num_labels': self.task_num_labels, 'task_weights': self.task_weights}
+        else:
+            label_names = list(self.label_encoder.classes_) if self.label_encoder is not None else None
+            task_config = None
+        if parity_texts is None:
+            parity_texts = self.X_test_external_original
+        reference = fp32_predict_proba(self.model, self.tokenizer, self.max_length)
+        predictors = {}
+        for fmt in formats:
+            fmt_dir = export_model(self.model, self.tokenizer, os.path.join(export_dir, fmt), fmt, self.max_length,
+                                   label_names, task_config)
+            predictors[fmt] = ExportedPredictor(fmt_dir)
+            if parity_texts:
+                check_parity(reference, predictors[fmt], list(parity_texts))
+        self.model.to(device)
+        return predictors
+
     # --- BASELINE MODEL METHODS START ---
     def train_and_evaluate_baseline_kfold(self): # Removed n_splits_param, will use len(self.fold_datasets)
         """Train and evaluate baseline model (TF-IDF + Logistic Regression) using K-fold cross validation."""
@@ -458,9 +704,9 @@ class TransformerClassifier:
             logger.info(f"Training baseline fold {fold+1}/{actual_n_splits}")
 
             X_train_text = train_hf_dataset['text']
-            y_train = np.array(train_hf_dataset['labels'])
+            y_train = self._baseline_labels(train_hf_dataset['labels'])
             X_val_text = val_hf_dataset['text']
-            y_val = np.array(val_hf_dataset['labels'])
+            y_val = self._baseline_labels(val_hf_dataset['labels'])
 
             pipeline = make_pipeline(
                 TfidfVectorizer(max_features=5000, ngram_range=(1, 2), min_df=2, max_df=0.95),
@@ -536,9 +782,10 @@ class TransformerClassifier:
             return None
 
         X_test_text = self.X_test_external_original # List of text strings
+        y_test_external = self._baseline_labels(self.y_test_external) if self.y_test_external is not None else None
 
         # Check if external test labels are available
-        if self.y_test_external is not None:
+        if y_test_external is not None:
             logger.info("External test set has labels. Evaluating Baseline model with metrics.")
             try:
                 preds_test_baseline = self.baseline_model_last_fold.predict(X_test_text)
@@ -546,8 +793,8 @@ class TransformerClassifier:
                 logger.error(f"Error predicting with baseline model on external test data: {e}")
                 return None
 
-            acc_test = accuracy_score(self.y_test_external, preds_test_baseline)
-            precision_test, recall_test, f1_test, _ = precision_recall_fscore_support(self.y_test_external, preds_test_baseline, average='macro', zero_division=0)
+            acc_test = accuracy_score(y_test_external, preds_test_baseline)
+            precision_test, recall_test, f1_test, _ = precision_recall_fscore_support(y_test_external, preds_test_baseline, average='macro', zero_division=0)
 
             test_metrics_baseline = {
                 'test_accuracy': acc_test,
@@ -555,12 +802,12 @@ class TransformerClassifier:
                 'test_precision': precision_test,
                 'test_recall': recall_test
             }
-            cm_baseline = confusion_matrix(self.y_test_external, preds_test_baseline)
+            cm_baseline = confusion_matrix(y_test_external, preds_test_baseline)
             target_names_for_report = None
             if hasattr(self, 'label_encoder') and self.label_encoder is not None:
                 try:
                     # Ensure all label indices are within the range of label_encoder.classes_
-                    max_label_idx = max(np.max(self.y_test_external), np.max(preds_test_baseline))
+                    max_label_idx = max(np.max(y_test_external), np.max(preds_test_baseline))
                     if max_label_idx < len(self.label_encoder.classes_):
                         target_names_for_report = self.label_encoder.classes_
                     else:
@@ -569,7 +816,7 @@ class TransformerClassifier:
                     logger.warning(f"Could not determine target names for baseline classification report: {e_classes}")
 
             report_dict_baseline = classification_report(
-                self.y_test_external, preds_test_baseline, output_dict=True, zero_division=0,
+                y_test_external, preds_test_baseline, output_dict=True, zero_division=0,
                 target_names=target_names_for_report
             )
             report_df_baseline = pd.DataFrame(report_dict_baseline).transpose()
@@ -599,8 +846,15 @@ if __name__ == '__main__':
     use_dummy_data = False # Set to True to use dummy data if original paths fail
     if not os.path.exists(train_file_path) or not os.path.exists(test_file_path):
         logger.warning(f"Original train/test file paths not found. Consider using dummy data.")
+    classifier = TransformerClassifier(
+        model_name="JQ1984/legalbert_gdpr_pretrained", # User's original model
+        output_dir="./violation_result_model",       # User's original output_dir
+        multi_label=False
+    )
+
     try:
-        df = pd.read_csv(train_file_path, sep=';')
+        # 特征表写在 output_dir/feature_store 下，不写入数据集目录
+        df = classifier.load_csv(train_file_path)
     except FileNotFoundError:
         logger.error(f"Training file not found at {train_file_path}. Please check the path or enable dummy data.")
         exit()
@@ -610,12 +864,6 @@ if __name__ == '__main__':
 
     target_columns = ['violation_result']
 
-    classifier = TransformerClassifier(
-        model_name="JQ1984/legalbert_gdpr_pretrained", # User's original model
-        output_dir="./violation_result_model",       # User's original output_dir
-        multi_label=False
-    )
-
     # Prepare data for K-fold cross validation (sets self.num_labels and self.fold_datasets)
     if not classifier.prepare_data(df, target_columns, n_splits=5): # User's original n_splits
         logger.error("Data preparation failed. Exiting.")
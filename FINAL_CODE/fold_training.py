@@ -0,0 +1,230 @@
+"""One K-fold training run, shared by the sequential loop and the fold-parallel process pool.
+
+Every fold starts from the same in-memory snapshot of the initial weights (restored with
+`load_state_dict`, no reload from disk) and the Trainer seeds itself, so a fold's metrics do not depend
+on which folds ran before it or in which process it runs. `run_folds_parallel` trains folds in a spawn
+process pool, splitting the CPU cores between the workers (`torch.set_num_threads`); workers read the
+tokenized corpus from its memory-mapped Arrow cache and receive the weight snapshot through shared memory.
+"""
+
+import os
+import json
+import time
+import inspect
+import logging
+import dataclasses
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import torch
+import torch.multiprocessing as torch_mp
+from datasets import Dataset
+from transformers import AutoModelForSequenceClassification, TrainingArguments, Trainer
+from sklearn.metrics import precision_recall_fscore_support
+
+from token_batches import make_collator
+from multi_task import MultiTaskModel, multi_task_metrics
+from checkpoint_io import CheckpointIO, directory_bytes, BestWeightsCallback, CheckpointTimingCallback, CHECKPOINT_MODES
+
+logger = logging.getLogger('Violationresult')
+
+
+def snapshot_state(model):
+    """CPU copy of the model weights, taken once before the first fold"""
+    return {name: tensor.detach().cpu().clone() for name, tensor in model.state_dict().items()}
+
+
+def compute_metrics(eval_pred): # User's original compute_metrics
+    logits, labels = eval_pred
+    if np.isnan(labels).any() or np.isinf(labels).any():
+        print("Warning: Labels contain NaN or Inf values")
+        labels = np.nan_to_num(labels, nan=0.0, posinf=1.0, neginf=0.0)
+    preds = np.argmax(logits, axis=1)
+    print(f"Labels shape: {labels.shape}, Predictions shape: {preds.shape}")
+    print(f"Labels type: {type(labels)}, Predictions type: {type(preds)}")
+    print(f"Unique labels: {np.unique(labels)}")
+    print(f"Unique predictions: {np.unique(preds)}")
+    try:
+        precision, recall, f1, _ = precision_recall_fscore_support(
+            labels, preds, average='macro', zero_division=0
+        )
+        acc = (preds == labels).mean()
+        return {'accuracy': acc, 'f1': f1, 'precision': precision, 'recall': recall}
+    except Exception as e:
+        print(f"Error calculating metrics: {e}")
+        return {'accuracy': 0.0, 'f1': 0.0, 'precision': 0.0, 'recall': 0.0}
+
+
+_ARGUMENT_FIELDS = {field.name for field in dataclasses.fields(TrainingArguments)}
+_TRAINER_PARAMETERS = inspect.signature(Trainer.__init__).parameters
+
+
+def _version_arguments(group_by_length):
+    """
+    Evaluation schedule and length grouping under the names of the installed transformers
+
+    transformers >= 4.41 calls it eval_strategy (evaluation_strategy was later removed) and, from 5.0,
+    length grouping is train_sampling_strategy="group_by_length" instead of group_by_length=True.
+    """
+    kwargs = {"eval_strategy" if "eval_strategy" in _ARGUMENT_FIELDS else "evaluation_strategy": "epoch"}
+    if "train_sampling_strategy" in _ARGUMENT_FIELDS:
+        if group_by_length:
+            kwargs["train_sampling_strategy"] = "group_by_length"
+    else:
+        kwargs["group_by_length"] = group_by_length
+    return kwargs
+
+
+def training_arguments(fold_output_dir, epochs, batch_size, learning_rate, weight_decay, group_by_length=False,
+                       checkpoint_mode="trainer"):
+    """Per-fold TrainingArguments; outside "trainer" mode the Trainer writes no checkpoints (see checkpoint_io)"""
+    trainer_checkpoints = checkpoint_mode == "trainer"
+    optional = _version_arguments(group_by_length)
+    if "logging_dir" in _ARGUMENT_FIELDS:
+        optional["logging_dir"] = f"{fold_output_dir}/logs"
+    return TrainingArguments(
+        output_dir=fold_output_dir,
+        num_train_epochs=epochs,
+        per_device_train_batch_size=batch_size,
+        per_device_eval_batch_size=batch_size,
+        weight_decay=weight_decay,
+        learning_rate=learning_rate,
+        save_strategy="epoch" if trainer_checkpoints else "no",
+        load_best_model_at_end=trainer_checkpoints,
+        metric_for_best_model="f1",
+        greater_is_better=True,
+        length_column_name="length",
+        push_to_hub=False,
+        report_to="none",
+        **optional
+    )
+
+
+def prediction_arguments(output_dir, batch_size):
+    """Arguments for a trainer that only predicts (no evaluation schedule, nothing saved)"""
+    return TrainingArguments(output_dir=output_dir, per_device_eval_batch_size=batch_size, report_to="none")
+
+
+def make_trainer(model, tokenizer, args, train_dataset=None, eval_dataset=None, device=None, metrics=compute_metrics,
+                 callbacks=None):
+    # Trainer(tokenizer=) 在 transformers 4.46 改名为 processing_class，5.0 移除旧名
+    tokenizer_argument = "processing_class" if "processing_class" in _TRAINER_PARAMETERS else "tokenizer"
+    return Trainer(
+        model=model,
+        args=args,
+        train_dataset=train_dataset,
+        eval_dataset=eval_dataset,
+        compute_metrics=metrics,
+        data_collator=make_collator(tokenizer, device),
+        callbacks=callbacks,
+        **{tokenizer_argument: tokenizer}
+    )
+
+
+def train_fold(job, model, tokenizer, train_dataset, val_dataset, initial_state, device=None, io=None):
+    """
+    Train and evaluate one fold starting from initial_state
+
+    job: fold number, output_dir and the training hyper-parameters (see TransformerClassifier);
+    jobs of a multi-task model also carry task_num_labels (per-target metrics instead of compute_metrics),
+    checkpoint_mode / async_saves choose how checkpoints are written (see checkpoint_io)
+    io: CheckpointIO shared across folds; pending background saves are then left running and the
+    caller fills result['checkpoint_io'] after io.wait(). Without it the fold waits for its own saves.
+
+    Returns:
+        (fold result dict, trainer)
+    """
+    fold = job['fold']
+    fold_output_dir = job['output_dir']
+    best_model_dir = os.path.join(fold_output_dir, "best_model")
+    checkpoint_mode = job.get('checkpoint_mode', "trainer")
+    if checkpoint_mode not in CHECKPOINT_MODES:
+        raise ValueError(f"checkpoint_mode must be one of {CHECKPOINT_MODES}, got {checkpoint_mode!r}")
+    own_io = io is None
+    if own_io:
+        io = CheckpointIO(background=job.get('async_saves', True))
+    os.makedirs(fold_output_dir, exist_ok=True)
+    model.load_state_dict(initial_state)
+    args = training_arguments(fold_output_dir, job['epochs'], job['batch_size'], job['learning_rate'],
+                              job['weight_decay'], job.get('group_by_length', False), checkpoint_mode)
+    metrics = multi_task_metrics(list(job['task_num_labels'])) if job.get('task_num_labels') else compute_metrics
+    if checkpoint_mode == "trainer":
+        best_weights = None
+        callbacks = [CheckpointTimingCallback(io, fold)]
+    else:
+        best_weights = BestWeightsCallback(io, fold, best_model_dir, save_each_best=checkpoint_mode == "weights",
+                                           tokenizer=tokenizer)
+        callbacks = [best_weights]
+    trainer = make_trainer(model, tokenizer, args, train_dataset, val_dataset, device, metrics, callbacks)
+
+    start_time_fold = time.time()
+    trainer.train()
+    current_fold_train_time = time.time() - start_time_fold
+
+    eval_results = trainer.evaluate()
+    logger.info(f"Fold {fold} training time: {current_fold_train_time:.2f}s, Accuracy: {eval_results['eval_accuracy']:.4f}")
+
+    with open(os.path.join(fold_output_dir, 'eval_results.json'), 'w') as f:
+        json.dump(eval_results, f)
+    if best_weights is None:
+        start_time_save = time.perf_counter()
+        trainer.save_model(best_model_dir)
+        io.record(fold, "best_model", directory_bytes(best_model_dir), time.perf_counter() - start_time_save)
+    elif checkpoint_mode == "memory" and best_weights.best_state is not None:
+        # 最佳权重只在这里写一次（仅权重，safetensors）
+        io.save(fold, "best_model", model, best_weights.best_state, best_model_dir, tokenizer,
+                blocking=best_weights.copy_seconds)
+
+    result = {'fold': fold, 'eval_results': eval_results, 'training_time': current_fold_train_time}
+    if own_io:
+        io.close()
+        result['checkpoint_io'] = log_checkpoint_io(fold, io.report(fold))
+    return result, trainer
+
+
+def log_checkpoint_io(fold, report):
+    logger.info(f"Fold {fold} checkpoint I/O: {report['saves']} saves, {report['bytes_written'] / 2**20:.1f} MB written, "
+                f"{report['save_seconds']:.2f}s saving ({report['blocking_seconds']:.2f}s blocking training)")
+    return report
+
+
+def _worker_init(threads):
+    torch.set_num_threads(threads)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+
+def _run_fold_job(job, config, tokenizer, corpus_file, initial_state):
+    """Process-pool entry point: rebuild the model from config + snapshot and train one fold"""
+    if job.get('task_num_labels'):
+        model = MultiTaskModel.from_config(config, job['task_num_labels'], job.get('task_weights'))
+    else:
+        model = AutoModelForSequenceClassification.from_config(config)
+    corpus = Dataset.from_file(corpus_file)
+    result, _ = train_fold(job, model, tokenizer, corpus.select(job['train_idx']), corpus.select(job['val_idx']),
+                           initial_state, device="cpu")
+    return result
+
+
+def run_folds_parallel(jobs, config, tokenizer, corpus_file, initial_state, workers, threads_per_worker=None):
+    """
+    Train folds in a spawn process pool (CPU only)
+
+    threads_per_worker defaults to an even split of the cores, so `workers` folds together use the
+    machine once instead of each fold oversubscribing it.
+
+    Returns:
+        fold results ordered by fold number
+    """
+    threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    logger.info(f"Training {len(jobs)} folds in {workers} processes with {threads_per_worker} torch threads each")
+    for tensor in initial_state.values():
+        tensor.share_memory_()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=torch_mp.get_context("spawn"),
+                             initializer=_worker_init, initargs=(threads_per_worker,)) as pool:
+        futures = {pool.submit(_run_fold_job, job, config, tokenizer, corpus_file, initial_state): job['fold']
+                   for job in jobs}
+        for future in as_completed(futures):
+            results.append(future.result())
+            logger.info(f"Fold {futures[future]} finished ({len(results)}/{len(jobs)})")
+    return sorted(results, key=lambda result: result['fold'])
@@ -0,0 +1,249 @@
+"""Compiled gdpr_clause parser, sparse article matrix and inverted index.
+
+`parse_clause("Article 5(1)(a) and (f), Art. 6 para. 1 lit. f GDPR")` returns normalised references at
+every level: ['5', '5(1)', '5(1)(a)', '5(1)(f)', '6', '6(1)', '6(1)(f)']. Parenthesised, dotted
+("13.1.a"), "paragraph / no. / lit. / letter" and "Articles 5, 6 and 7" forms are understood; references
+to other laws ("Article 22.2 of the LSSI", "§ 24 DSG", "Article 5(3) of Directive 2002/58/EC") are skipped.
+
+`ArticleIndex` keeps the cases x references matrix as CSR (one row per case, for models) and CSC (one
+posting list per reference, the inverted index), so "Art. 6(1)(f) AND Art. 13" intersects two posting
+lists instead of scanning the table. It replaces the notebooks' `extract_articles` + MultiLabelBinarizer
+and is persisted next to the feature store.
+"""
+
+import os
+import re
+import json
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+MATRIX_FILE = "articles.npz"
+VOCAB_FILE = "articles_vocab.json"
+MAX_ARTICLE = 99
+
+ARTICLE = re.compile(r'\bArt(?:icles?|s?\.?)\s*(\d{1,3})(?![\d:/])', re.IGNORECASE)
+PAREN = re.compile(r'\s*\(\s*(\d{1,2}|[a-z]{1,4})\s*\)', re.IGNORECASE)
+DOTTED = re.compile(r'\.(\d{1,2})(?:\.?\(?([a-z])\)?)?(?![\d.]*\d)', re.IGNORECASE)
+PARAGRAPH = re.compile(r'\s*,?\s*(?:paragraph|para\.?|par\.|no\.?|nr\.?|n\.)\s*(\d{1,2})\b', re.IGNORECASE)
+SENTENCE = re.compile(r'\s*,?\s*(?:sentence|subparagraph)\s*\d+', re.IGNORECASE)
+POINT = re.compile(r'\s*,?\s*(?:lit\.?|letter|point|let\.)\s*\(?([a-z])\)?(?![a-z])', re.IGNORECASE)
+SIBLING = re.compile(r'\s*(?:and|or|&|-|–)\s*\(\s*(\d{1,2}|[a-z]{1,4})\s*\)', re.IGNORECASE)
+ENUMERATION = re.compile(r'\s*(?:,\s*(?:and\s+)?|and\s+|&\s*)(\d{1,2})\b(?!\s*[(.])', re.IGNORECASE)
+# 引用后面紧跟的其他法规名称（出现 GDPR 字样时仍按 GDPR 处理）
+OTHER_LAW = re.compile(r'\s*(?:of\b|Directive|Decree|Act\b|Law\b|Code\b|Constitution|LSSI|LOPD\w*|BDSG|DSG\b|'
+                       r'ZVOP\S*|PECR|TKG|TTDSG|UAVG|Dutch|Bulgarian|Polish|Spanish|Italian|Croatian)',
+                       re.IGNORECASE)
+GDPR_NAME = re.compile(r'GDPR|DSGVO|RGPD|AVG\b|2016/679', re.IGNORECASE)
+
+
+def _levels(article, parts):
+    """'6', ['1', 'f'] -> ['6', '6(1)', '6(1)(f)'] (article, paragraph, point; deeper levels dropped)"""
+    keys = [article]
+    for part in parts[:2]:
+        keys.append(f"{keys[-1]}({part.lower()})")
+    return keys
+
+
+def _parse_parts(text, pos):
+    """Sub-references after an article number: returns (list of part lists, end position)"""
+    parts = []
+    match = DOTTED.match(text, pos)
+    if match:
+        parts = [match.group(1)] + ([match.group(2)] if match.group(2) else [])
+        pos = match.end()
+    else:
+        while True:
+            match = PAREN.match(text, pos)
+            if not match:
+                break
+            parts.append(match.group(1))
+            pos = match.end()
+    for pattern in (PARAGRAPH, SENTENCE, POINT):
+        match = pattern.match(text, pos)
+        if match:
+            if pattern is not SENTENCE:
+                parts.append(match.group(1))
+            pos = match.end()
+            # "para. 1 sentence 2 lit. f"：句号之后可能还有 lit.
+            match = SENTENCE.match(text, pos) or match
+            pos = max(pos, match.end())
+    variants = [parts]
+    # "5(1)(d) and (f)" / "13(1)-(2)"：兄弟引用替换最后一级
+    while parts:
+        match = SIBLING.match(text, pos)
+        if not match:
+            break
+        variants.append(parts[:-1] + [match.group(1)])
+        pos = match.end()
+    return variants, pos
+
+
+@lru_cache(maxsize=65536)
+def parse_clause(text):
+    """Sorted, de-duplicated normalised GDPR references of one gdpr_clause value"""
+    if not isinstance(text, str):
+        return ()
+    references = set()
+    for match in ARTICLE.finditer(text):
+        article = int(match.group(1))
+        variants, pos = _parse_parts(text, match.end())
+        articles = [(str(article), variants)]
+        if match.group(0)[:8].lower() == 'articles':
+            # "Articles 5, 6 and 7"
+            while True:
+                enum = ENUMERATION.match(text, pos)
+                if not enum:
+                    break
+                articles.append((enum.group(1), [[]]))
+                pos = enum.end()
+        if OTHER_LAW.match(text, pos) and not GDPR_NAME.search(text[pos:].split(',')[0]):
+            continue
+        for number, number_variants in articles:
+            if not 1 <= int(number) <= MAX_ARTICLE:
+                continue
+            for parts in number_variants:
+                references.update(_levels(number, parts))
+    return tuple(sorted(references, key=reference_sort_key))
+
+
+def reference_sort_key(reference):
+    """Order '5' < '5(1)' < '5(1)(a)' < '5(2)' < '6' < '13'"""
+    head, _, rest = reference.partition('(')
+    parts = [p.rstrip(')') for p in rest.split('(')] if rest else []
+    return (int(head),) + tuple((0, int(p), '') if p.isdigit() else (1, 0, p) for p in parts)
+
+
+def normalize_reference(reference):
+    """User-facing reference ('Art. 6(1)(f)', 'Article 13', '6.1.f') -> index key ('6(1)(f)')"""
+    keys = parse_clause(reference if re.match(r'\s*art', reference, re.IGNORECASE) else f"Article {reference}")
+    if not keys:
+        raise ValueError(f"Not a GDPR article reference: {reference!r}")
+    return max(keys, key=len)
+
+
+class ArticleIndex:
+    """
+    案例 x 条款引用 的稀疏矩阵
+
+    matrix (CSR) 每行一个案例，供模型使用；postings (CSC) 每列是引用该条款的案例行号（倒排表）。
+    """
+
+    def __init__(self, matrix, vocabulary):
+        self.matrix = sparse.csr_matrix(matrix, dtype=np.int8)
+        self.vocabulary = list(vocabulary)
+        self.columns = {reference: i for i, reference in enumerate(self.vocabulary)}
+        self.postings = self.matrix.tocsc()
+        self.postings.sort_indices()
+
+    @classmethod
+    def from_clauses(cls, clauses):
+        parsed = [parse_clause(c if isinstance(c, str) else None) for c in clauses]
+        vocabulary = sorted({r for refs in parsed for r in refs}, key=reference_sort_key)
+        columns = {reference: i for i, reference in enumerate(vocabulary)}
+        indptr = np.zeros(len(parsed) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(refs) for refs in parsed])
+        indices = np.fromiter((columns[r] for refs in parsed for r in refs), dtype=np.int32, count=indptr[-1])
+        matrix = sparse.csr_matrix((np.ones(len(indices), dtype=np.int8), indices, indptr),
+                                   shape=(len(parsed), len(vocabulary)))
+        return cls(matrix, vocabulary)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def cases_citing(self, reference):
+        """Sorted row numbers of the cases citing reference (at that level or below it)"""
+        column = self.columns.get(normalize_reference(reference))
+        if column is None:
+            return np.zeros(0, dtype=np.int32)
+        return self.postings.indices[self.postings.indptr[column]:self.postings.indptr[column + 1]]
+
+    def query(self, expression):
+        """
+        Rows matching a boolean expression over references, e.g. "Art. 6(1)(f) AND Art. 13"
+
+        AND / OR / AND NOT are supported (AND binds tighter than OR); each term is answered from its
+        posting list, intersecting the shortest lists first.
+        """
+        result = np.zeros(0, dtype=np.int32)
+        for disjunct in re.split(r'\s+OR\s+', expression.strip()):
+            include, exclude = [], []
+            for term in re.split(r'\s+AND\s+', disjunct):
+                negated = re.match(r'NOT\s+(.*)', term)
+                (exclude if negated else include).append(self.cases_citing(negated.group(1) if negated else term))
+            if not include:
+                raise ValueError(f"Expression needs at least one positive term: {disjunct!r}")
+            rows = None
+            for postings in sorted(include, key=len):
+                rows = postings if rows is None else np.intersect1d(rows, postings, assume_unique=True)
+            for postings in exclude:
+                rows = np.setdiff1d(rows, postings, assume_unique=True)
+            result = np.union1d(result, rows)
+        return result
+
+    def counts(self, level=None):
+        """Number of citing cases per reference; level 0/1/2 = article / paragraph / point only"""
+        counts = pd.Series(np.diff(self.postings.indptr), index=self.vocabulary, name='cases')
+        if level is not None:
+            counts = counts[[reference.count('(') == level for reference in self.vocabulary]]
+        return counts.sort_values(ascending=False, kind='stable')
+
+    def to_frame(self, level=0, prefix='Art_', index=None):
+        """Sparse 0/1 DataFrame of one reference level (level=0 matches the notebooks' Art_<n> columns)"""
+        keep = [i for i, reference in enumerate(self.vocabulary) if level is None or reference.count('(') == level]
+        return pd.DataFrame.sparse.from_spmatrix(self.matrix[:, keep], index=index,
+                                                 columns=[f"{prefix}{self.vocabulary[i]}" for i in keep])
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        sparse.save_npz(os.path.join(directory, MATRIX_FILE), self.matrix)
+        with open(os.path.join(directory, VOCAB_FILE), 'w', encoding='utf-8') as f:
+            json.dump(self.vocabulary, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, VOCAB_FILE), 'r', encoding='utf-8') as f:
+            vocabulary = json.load(f)
+        return cls(sparse.load_npz(os.path.join(directory, MATRIX_FILE)), vocabulary)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    from feature_store import load_csv_frame, load_articles
+    parser = argparse.ArgumentParser(description="Parse gdpr_clause into a sparse article matrix and query it")
+    parser.add_argument("--data", default="../Dataset/FINAL_dataset.csv")
+    parser.add_argument("--query", default="Art. 6(1)(f) AND Art. 13")
+    parser.add_argument("--store", default="./feature_store", help="特征表目录（不写入数据集所在目录）")
+    args = parser.parse_args()
+
+    for text in ["Article 21(1) GDPR", "Art. 5(1)(a) and (f), Art 13 and Art. 14 GDPR", "Articles 5, 6, and 7 GDPR",
+                 "Article 13.1.e)", "Article 6 para. 1 lit. a", "Article 6(1) sentence 1 lit. c",
+                 "Article 13(1)-(2)", "Article 22.2 of the LSSI", "Article 23 of the GDPR", "§ 24(5) DSG"]:
+        print(f"{text!r:<50} -> {list(parse_clause(text))}")
+
+    data = load_csv_frame(args.data, args.store)
+    start = time.perf_counter()
+    articles = ArticleIndex.from_clauses(data['gdpr_clause'])
+    print(f"\n解析 {len(articles)} 个案例: {len(articles.vocabulary)} 个条款引用，"
+          f"{articles.matrix.nnz} 个非零项，耗时 {time.perf_counter() - start:.3f}秒")
+    parsed_rows = np.diff(articles.matrix.indptr) > 0
+    print(f"识别出 GDPR 条款的案例: {parsed_rows.sum()}/{len(articles)} ({parsed_rows.mean() * 100:.2f}%)")
+    print("最常见的条款:")
+    print(articles.counts(level=0).head(10).to_string())
+
+    start = time.perf_counter()
+    rows = articles.query(args.query)
+    elapsed = time.perf_counter() - start
+    terms = [t for t in re.split(r'\s+AND\s+', args.query)]
+    expected = np.flatnonzero(np.all([data['gdpr_clause'].map(lambda c, t=t: normalize_reference(t) in parse_clause(c))
+                                      for t in terms], axis=0))
+    assert np.array_equal(rows, expected), "inverted index result differs from a table scan"
+    print(f"\n{args.query}: {len(rows)} 个案例（{elapsed * 1000:.2f} ms，与全表扫描结果一致）")
+    print(data.iloc[rows[:5]][['country', 'Date', 'gdpr_clause']].to_string())
+
+    stored = load_articles(args.store)
+    assert stored.vocabulary == articles.vocabulary and (stored.matrix != articles.matrix).nnz == 0
+    print(f"\n特征表目录中的条款矩阵与重新解析结果一致: {args.store}")
@@ -0,0 +1,361 @@
+"""CPU inference export for the trained Legal-BERT classifiers (violation / fine / multi-task models).
+
+Three artefact formats, each a directory with `export.json`, the tokenizer files and the model:
+
+- "onnx":       fp32 ONNX graph (dynamic batch and sequence axes), run with ONNX Runtime
+- "onnx-int8":  the same graph with dynamic int8 weight quantisation (onnxruntime.quantization)
+- "torch-int8": PyTorch dynamic int8 quantisation of every nn.Linear (weights int8, activations
+                quantised on the fly); the int8 weights, their scales and the remaining fp32 tensors
+                are stored as safetensors (no pickle) and loaded into a model quantised from config
+
+`ExportedPredictor` loads any of them and exposes `predict_proba(texts)` (same contract as the SHAP
+script's function: str or list of str in, softmax probabilities out; a dict per target for multi-task
+models) and `predict(texts)`. `check_parity` compares a predictor with the fp32 PyTorch model and
+`benchmark` measures latency / throughput at batch sizes 1-256 on CPU.
+
+onnx / onnxruntime are only imported by the ONNX formats.
+"""
+
+import os
+import json
+import time
+import inspect
+import logging
+
+import numpy as np
+import torch
+from torch import nn
+from transformers import AutoConfig, AutoTokenizer, AutoModelForSequenceClassification
+
+logger = logging.getLogger('Violationresult')
+
+EXPORT_FORMATS = ("onnx", "onnx-int8", "torch-int8")
+BENCHMARK_BATCH_SIZES = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+MANIFEST = "export.json"
+
+
+def _task_names(model):
+    """Output names: one per target for MultiTaskModel, a single 'logits' otherwise"""
+    names = getattr(model, "task_names", None)
+    return [f"logits_{name}" for name in names] if names else ["logits"]
+
+
+def _logits(outputs):
+    logits = outputs["logits"] if isinstance(outputs, dict) else outputs.logits
+    return logits if isinstance(logits, tuple) else (logits,)
+
+
+class _LogitsOnly(nn.Module):
+    """Positional-input wrapper returning plain logits tensors (what the ONNX exporter traces)"""
+
+    def __init__(self, model, input_names):
+        super().__init__()
+        self.model = model
+        self.input_names = input_names
+
+    def forward(self, *inputs):
+        return _logits(self.model(**dict(zip(self.input_names, inputs))))
+
+
+def _input_names(tokenizer):
+    return [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in tokenizer.model_input_names]
+
+
+def _onnx_export(model, tokenizer, path, opset=17):
+    input_names = _input_names(tokenizer)
+    output_names = _task_names(model)
+    sample = tokenizer(["GDPR clauses are Article 6(1)(e)."] * 2, return_tensors="pt", padding=True)
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes.update({name: {0: "batch"} for name in output_names})
+    kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # 使用 TorchScript 导出器（dynamic_axes 写法在各 torch 版本通用）
+        kwargs["dynamo"] = False
+    torch.onnx.export(_LogitsOnly(model, input_names).eval(), tuple(sample[name] for name in input_names), path,
+                      input_names=input_names, output_names=output_names, dynamic_axes=dynamic_axes,
+                      opset_version=opset, do_constant_folding=True, **kwargs)
+    return input_names, output_names
+
+
+def quantize_torch_int8(model):
+    """Dynamic int8 quantisation of every nn.Linear (returns a quantised copy, the fp32 model is untouched)"""
+    import copy
+    return torch.ao.quantization.quantize_dynamic(copy.deepcopy(model).to("cpu").eval(), {nn.Linear}, dtype=torch.qint8)
+
+
+def _quantized_linears(qmodel):
+    return [(name, module) for name, module in qmodel.named_modules()
+            if isinstance(module, torch.ao.nn.quantized.dynamic.Linear)]
+
+
+def int8_state(qmodel):
+    """Plain tensors of a dynamically quantised model: int8 weight + scale / zero point per Linear"""
+    state = {name: tensor for name, tensor in qmodel.state_dict().items()
+             if torch.is_tensor(tensor) and not tensor.is_quantized and "_packed_params" not in name}
+    for name, module in _quantized_linears(qmodel):
+        weight, bias = module._weight_bias()
+        if weight.qscheme() not in (torch.per_tensor_affine, torch.per_tensor_symmetric):
+            raise ValueError(f"{name}: only per-tensor int8 weights are supported, got {weight.qscheme()}")
+        state[f"{name}.weight_int8"] = weight.int_repr().contiguous()
+        state[f"{name}.weight_scale"] = torch.tensor([weight.q_scale()], dtype=torch.float64)
+        state[f"{name}.weight_zero_point"] = torch.tensor([weight.q_zero_point()], dtype=torch.int64)
+        if bias is not None:
+            state[f"{name}.bias"] = bias.detach().contiguous()
+    return state
+
+
+def load_int8_state(qmodel, state):
+    """Inverse of int8_state: fill a model returned by quantize_torch_int8"""
+    linears = _quantized_linears(qmodel)
+    linear_keys = {f"{name}.{key}" for name, _ in linears for key in ("weight_int8", "weight_scale", "weight_zero_point", "bias")}
+    # 以模型自身的 state_dict 为底（保留 _metadata 版本信息与 packed params），覆盖保存的普通张量
+    full_state = qmodel.state_dict()
+    unexpected = [key for key in state if key not in linear_keys and key not in full_state]
+    missing = [key for key, value in full_state.items()
+               if torch.is_tensor(value) and not value.is_quantized and "_packed_params" not in key and key not in state]
+    if missing or unexpected:
+        raise ValueError(f"int8 state does not match the model: missing {missing[:5]}, unexpected {unexpected[:5]}")
+    full_state.update({key: value for key, value in state.items() if key not in linear_keys})
+    qmodel.load_state_dict(full_state)
+    for name, module in linears:
+        weight = torch._make_per_tensor_quantized_tensor(state[f"{name}.weight_int8"],
+                                                         float(state[f"{name}.weight_scale"][0]),
+                                                         int(state[f"{name}.weight_zero_point"][0]))
+        module.set_weight_bias(weight, state.get(f"{name}.bias"))
+    return qmodel
+
+
+def _file_mb(path):
+    return os.path.getsize(path) / 2**20
+
+
+def export_model(model, tokenizer, export_dir, fmt="onnx", max_length=256, label_names=None, task_config=None):
+    """
+    Export a trained classifier to export_dir in one of EXPORT_FORMATS
+
+    label_names: class names (single target) or {target: class names} (multi-task)
+    task_config: {'task_num_labels', 'task_weights'} for a MultiTaskModel
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"fmt must be one of {EXPORT_FORMATS}")
+    os.makedirs(export_dir, exist_ok=True)
+    model = model.to("cpu").eval()
+    start = time.perf_counter()
+    manifest = {"format": fmt, "max_length": max_length, "outputs": _task_names(model),
+                "architecture": "multi_task" if task_config else "sequence_classification",
+                "task_config": task_config, "label_names": label_names}
+
+    if fmt.startswith("onnx"):
+        fp32_path = os.path.join(export_dir, "model.onnx")
+        manifest["inputs"], _ = _onnx_export(model, tokenizer, fp32_path)
+        manifest["model_file"] = "model.onnx"
+        if fmt == "onnx-int8":
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            quantize_dynamic(fp32_path, os.path.join(export_dir, "model.int8.onnx"), weight_type=QuantType.QInt8)
+            os.remove(fp32_path)
+            manifest["model_file"] = "model.int8.onnx"
+    else:
+        manifest["inputs"] = _input_names(tokenizer)
+        from safetensors.torch import save_file
+        save_file(int8_state(quantize_torch_int8(model)), os.path.join(export_dir, "model.int8.safetensors"))
+        manifest["model_file"] = "model.int8.safetensors"
+
+    model.config.save_pretrained(export_dir)
+    tokenizer.save_pretrained(export_dir)
+    with open(os.path.join(export_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2, default=str)
+    logger.info(f"Exported {fmt} model to {export_dir} ({_file_mb(os.path.join(export_dir, manifest['model_file'])):.1f} MB) "
+                f"in {time.perf_counter() - start:.1f}s")
+    return export_dir
+
+
+class ExportedPredictor:
+    """
+    推理用预测器：加载 export_model 导出的目录（onnx / onnx-int8 / torch-int8）
+
+    predict_proba(texts) 与 SHAP 脚本中的 predict_proba 用法相同；多任务模型返回 {目标: 概率}。
+    """
+
+    def __init__(self, export_dir, threads=None):
+        with open(os.path.join(export_dir, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        self.format = self.manifest["format"]
+        self.max_length = self.manifest["max_length"]
+        self.input_names = self.manifest["inputs"]
+        self.output_names = self.manifest["outputs"]
+        self.label_names = self.manifest.get("label_names")
+        self.tokenizer = AutoTokenizer.from_pretrained(export_dir)
+        model_path = os.path.join(export_dir, self.manifest["model_file"])
+        if self.format.startswith("onnx"):
+            import onnxruntime as ort
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if threads:
+                options.intra_op_num_threads = threads
+            self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+            self.model = None
+        else:
+            if threads:
+                torch.set_num_threads(threads)
+            from safetensors.torch import load_file
+            self.model = load_int8_state(quantize_torch_int8(self._build_model(export_dir)), load_file(model_path))
+            self.session = None
+
+    def _build_model(self, export_dir):
+        config = AutoConfig.from_pretrained(export_dir)
+        if self.manifest["architecture"] == "multi_task":
+            from multi_task import MultiTaskModel
+            task_config = self.manifest["task_config"]
+            return MultiTaskModel.from_config(config, task_config["task_num_labels"], task_config.get("task_weights"))
+        return AutoModelForSequenceClassification.from_config(config)
+
+    def logits(self, texts):
+        """Raw logits of one batch, one array per output"""
+        encoded = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length,
+                                 return_tensors="np" if self.session is not None else "pt")
+        if self.session is not None:
+            return self.session.run(self.output_names, {name: encoded[name].astype(np.int64) for name in self.input_names})
+        with torch.no_grad():
+            outputs = self.model(**{name: encoded[name] for name in self.input_names})
+        return [logits.numpy() for logits in _logits(outputs)]
+
+    def predict_proba(self, texts, batch_size=64):
+        if not isinstance(texts, list):
+            texts = [str(texts)]
+        else:
+            texts = [str(t) for t in texts]
+        batches = [self.logits(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+        probs = [_softmax(np.concatenate([b[k] for b in batches])) for k in range(len(self.output_names))]
+        if len(probs) == 1:
+            return probs[0]
+        return {name[len("logits_"):]: p for name, p in zip(self.output_names, probs)}
+
+    def predict(self, texts, batch_size=64):
+        probs = self.predict_proba(texts, batch_size)
+        if isinstance(probs, dict):
+            return {name: p.argmax(axis=1) for name, p in probs.items()}
+        return probs.argmax(axis=1)
+
+
+def _softmax(logits):
+    shifted = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return shifted / shifted.sum(axis=1, keepdims=True)
+
+
+def fp32_predict_proba(model, tokenizer, max_length=256):
+    """Reference predict_proba: the raw fp32 forward pass (as in the SHAP script), in the predictor's output layout"""
+    model = model.to("cpu").eval()
+    names = _task_names(model)
+
+    def predict_proba(texts, batch_size=64):
+        texts = [str(texts)] if not isinstance(texts, list) else [str(t) for t in texts]
+        outputs = []
+        for i in range(0, len(texts), batch_size):
+            encoded = tokenizer(texts[i:i + batch_size], padding=True, truncation=True, max_length=max_length,
+                                return_tensors="pt")
+            with torch.no_grad():
+                outputs.append([logits.numpy() for logits in _logits(model(**encoded))])
+        probs = [_softmax(np.concatenate([o[k] for o in outputs])) for k in range(len(names))]
+        return probs[0] if len(probs) == 1 else {name[len("logits_"):]: p for name, p in zip(names, probs)}
+    return predict_proba
+
+
+def check_parity(reference, predictor, texts, max_abs_diff=None, min_agreement=None):
+    """
+    Compare predictor.predict_proba with the fp32 reference on texts
+
+    Returns {target: {'max_abs_diff', 'mean_abs_diff', 'agreement'}}; raises AssertionError when a
+    threshold is given and violated (defaults: 1e-4 / 100% for fp32 ONNX, 0.1 / 97% for int8).
+    """
+    fmt = predictor.format
+    max_abs_diff = max_abs_diff if max_abs_diff is not None else (1e-4 if fmt == "onnx" else 0.1)
+    min_agreement = min_agreement if min_agreement is not None else (1.0 if fmt == "onnx" else 0.97)
+    expected, got = reference(texts), predictor.predict_proba(texts)
+    if not isinstance(expected, dict):
+        expected, got = {"logits": expected}, {"logits": got}
+    report = {}
+    for name in expected:
+        diff = np.abs(expected[name] - got[name])
+        report[name] = {"max_abs_diff": float(diff.max()), "mean_abs_diff": float(diff.mean()),
+                        "agreement": float((expected[name].argmax(axis=1) == got[name].argmax(axis=1)).mean())}
+        print(f"[{fmt}] {name}: 概率最大差 {report[name]['max_abs_diff']:.2e}，平均差 {report[name]['mean_abs_diff']:.2e}，"
+              f"预测一致率 {report[name]['agreement'] * 100:.2f}%")
+        assert report[name]["max_abs_diff"] <= max_abs_diff, f"{fmt} {name}: max diff {report[name]['max_abs_diff']:.3g} > {max_abs_diff}"
+        assert report[name]["agreement"] >= min_agreement, f"{fmt} {name}: agreement {report[name]['agreement']:.4f} < {min_agreement}"
+    return report
+
+
+def benchmark(predictors, texts, batch_sizes=BENCHMARK_BATCH_SIZES, repeat=3, budget_seconds=5.0):
+    """
+    CPU latency (median ms per batch) and throughput (texts/s) of each predict_proba at every batch size
+
+    predictors: {name: predict_proba(texts, batch_size)}; each batch size runs `repeat` times (fewer once
+    a setting has used budget_seconds) after one warm-up call.
+    """
+    report = {}
+    for name, predict_proba in predictors.items():
+        report[name] = {}
+        for batch_size in batch_sizes:
+            batch = [texts[i % len(texts)] for i in range(batch_size)]
+            predict_proba(batch, batch_size=batch_size)
+            timings, spent = [], 0.0
+            while len(timings) < repeat and (not timings or spent < budget_seconds):
+                start = time.perf_counter()
+                predict_proba(batch, batch_size=batch_size)
+                timings.append(time.perf_counter() - start)
+                spent += timings[-1]
+            latency = float(np.median(timings))
+            report[name][batch_size] = {"latency_ms": round(latency * 1000, 2), "texts_per_sec": round(batch_size / latency, 1)}
+    print(f"\n{'batch':>6} " + " ".join(f"{name + ' ms':>16} {name + ' /s':>16}" for name in report))
+    for batch_size in batch_sizes:
+        print(f"{batch_size:>6} " + " ".join(f"{report[name][batch_size]['latency_ms']:>16.2f} "
+                                             f"{report[name][batch_size]['texts_per_sec']:>16.1f}" for name in report))
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    from feature_store import load_csv_frame
+    from feature_text import features_to_text
+    # onnxruntime 量化器会用根 logger 逐个张量输出 INFO，这里只保留本项目的 INFO 日志
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logger.setLevel(logging.INFO)
+    parser = argparse.ArgumentParser(description="Export a classifier to ONNX / int8, check parity and benchmark CPU inference")
+    parser.add_argument("--model", default="JQ1984/violation_result_GDPR_prediction",
+                        help="hub id or directory of a trained model (e.g. <output_dir>/fold_5/best_model)")
+    parser.add_argument("--data", default="../Dataset/FINAL_dataset.csv")
+    parser.add_argument("--store", default="./feature_store", help="特征表目录（不写入数据集所在目录）")
+    parser.add_argument("--export-dir", default="./inference_export")
+    parser.add_argument("--formats", nargs="+", default=list(EXPORT_FORMATS), choices=EXPORT_FORMATS)
+    parser.add_argument("--offline", action="store_true",
+                        help="use a bert-base-shaped model with a locally trained vocabulary (no hub access)")
+    parser.add_argument("--layers", type=int, default=12, help="encoder layers of the --offline model")
+    parser.add_argument("--parity-samples", type=int, default=512)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=list(BENCHMARK_BATCH_SIZES))
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    data = load_csv_frame(args.data, args.store)
+    features = data.drop(columns=['fine_amount', 'gdpr_clause', 'violation_result', 'case_group'] +
+                         [c for c in data.columns if c.startswith('violation_nature_')], errors='ignore')
+    all_texts = features_to_text(features)
+    if args.offline:
+        from token_batches import _offline_model
+        fp32_model, fp32_tokenizer = _offline_model(all_texts, layers=args.layers)
+    else:
+        fp32_tokenizer = AutoTokenizer.from_pretrained(args.model)
+        fp32_model = AutoModelForSequenceClassification.from_pretrained(args.model)
+    fp32_model.eval()
+    picked = np.random.RandomState(0).choice(len(all_texts), size=min(args.parity_samples, len(all_texts)), replace=False)
+    parity_texts = [all_texts[i] for i in picked]
+
+    reference = fp32_predict_proba(fp32_model, fp32_tokenizer)
+    candidates = {"fp32": reference}
+    for fmt in args.formats:
+        export_model(fp32_model, fp32_tokenizer, os.path.join(args.export_dir, fmt), fmt)
+        predictor = ExportedPredictor(os.path.join(args.export_dir, fmt), threads=args.threads)
+        check_parity(reference, predictor, parity_texts)
+        candidates[fmt] = predictor.predict_proba
+    benchmark(candidates, parity_texts, batch_sizes=args.batch_sizes)
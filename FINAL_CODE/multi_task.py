@@ -0,0 +1,158 @@
+"""Multi-task Legal-BERT: one shared encoder, one classification head per target.
+
+Instead of running the K-fold pipeline once per target (`violation_result`, the `violation_nature_*`
+flags, the fine bracket, ...), every batch goes through the encoder once and the per-target cross
+entropies are summed (optionally weighted) into one loss. `labels` is a (batch, n_targets) integer
+matrix in `target_columns` order; `MISSING_LABEL` (-100) marks a target that is unknown for a row
+and is ignored by that target's loss and metrics.
+
+The model returns `{"loss", "logits"}` with `logits` a tuple of per-target tensors, so the stock
+Trainer trains, evaluates and predicts it; `multi_task_metrics` turns a Trainer prediction into
+per-target metrics plus their means (`f1` drives `load_best_model_at_end`).
+"""
+
+import os
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+import torch
+from torch import nn
+from transformers import AutoConfig, AutoModel
+from sklearn.metrics import precision_recall_fscore_support, classification_report, confusion_matrix
+
+logger = logging.getLogger('Violationresult')
+
+MISSING_LABEL = -100
+FINE_BRACKET = "fine_bracket"
+# 罚款分档（欧元）：0 表示无罚款，之后按数量级分档
+FINE_BRACKET_EDGES = (0, 10_000, 100_000, 1_000_000)
+FINE_BRACKET_NAMES = ("none", "<=10k", "10k-100k", "100k-1M", ">1M")
+
+
+def fine_bracket(amounts):
+    """Bracket index of each fine amount (see FINE_BRACKET_EDGES); missing amounts count as no fine"""
+    amounts = pd.to_numeric(pd.Series(amounts), errors='coerce').fillna(0).to_numpy(dtype=float)
+    return np.searchsorted(FINE_BRACKET_EDGES, amounts, side='left').astype('int64')
+
+
+class MultiTaskModel(nn.Module):
+    """Shared transformer encoder + one linear head per target"""
+
+    def __init__(self, encoder, task_num_labels, task_weights=None, dropout=None):
+        super().__init__()
+        self.encoder = encoder
+        self.config = encoder.config
+        self.task_names = list(task_num_labels)
+        self.task_num_labels = dict(task_num_labels)
+        self.task_weights = dict(task_weights or {})
+        hidden_dropout = dropout if dropout is not None else getattr(self.config, "hidden_dropout_prob", 0.1)
+        self.dropout = nn.Dropout(hidden_dropout)
+        self.heads = nn.ModuleDict({name: nn.Linear(self.config.hidden_size, n) for name, n in self.task_num_labels.items()})
+        self.loss_fn = nn.CrossEntropyLoss(ignore_index=MISSING_LABEL)
+
+    @classmethod
+    def from_pretrained(cls, model_name, task_num_labels, task_weights=None):
+        return cls(AutoModel.from_pretrained(model_name), task_num_labels, task_weights)
+
+    @classmethod
+    def from_config(cls, config, task_num_labels, task_weights=None):
+        return cls(AutoModel.from_config(config), task_num_labels, task_weights)
+
+    def forward(self, input_ids=None, attention_mask=None, token_type_ids=None, labels=None):
+        outputs = self.encoder(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids)
+        # 与 *ForSequenceClassification 相同：有 pooler 用 pooler 输出，否则用 [CLS] 向量
+        pooled = getattr(outputs, "pooler_output", None)
+        if pooled is None:
+            pooled = outputs.last_hidden_state[:, 0]
+        pooled = self.dropout(pooled)
+        logits = tuple(self.heads[name](pooled) for name in self.task_names)
+        result = {"logits": logits}
+        if labels is not None:
+            loss = 0.0
+            for i, name in enumerate(self.task_names):
+                task_labels = labels[:, i].long()
+                if (task_labels != MISSING_LABEL).any():
+                    loss = loss + self.task_weights.get(name, 1.0) * self.loss_fn(logits[i], task_labels)
+            result = {"loss": loss if torch.is_tensor(loss) else logits[0].sum() * 0.0, "logits": logits}
+        return result
+
+
+def _task_metrics(logits, labels):
+    known = labels != MISSING_LABEL
+    labels, preds = labels[known], np.argmax(logits[known], axis=1)
+    if len(labels) == 0:
+        return {'accuracy': 0.0, 'f1': 0.0, 'precision': 0.0, 'recall': 0.0}
+    precision, recall, f1, _ = precision_recall_fscore_support(labels, preds, average='macro', zero_division=0)
+    return {'accuracy': float((preds == labels).mean()), 'f1': f1, 'precision': precision, 'recall': recall}
+
+
+def multi_task_metrics(task_names):
+    """compute_metrics for MultiTaskModel: '<metric>_<target>' per target and the unweighted means"""
+    def compute_metrics(eval_pred):
+        logits, labels = eval_pred
+        labels = np.asarray(labels).reshape(len(labels), -1)
+        results = {}
+        for i, name in enumerate(task_names):
+            for metric, value in _task_metrics(np.asarray(logits[i]), labels[:, i]).items():
+                results[f"{metric}_{name}"] = value
+        for metric in ('accuracy', 'f1', 'precision', 'recall'):
+            results[metric] = float(np.mean([results[f"{metric}_{name}"] for name in task_names]))
+        return results
+    return compute_metrics
+
+
+def task_reports(logits, labels, task_names, label_names=None, output_dir=None, prefix="external_test"):
+    """
+    Classification report and confusion matrix of every target
+
+    label_names: optional {target: class names}; reports are written to
+    output_dir/<prefix>_classification_report_<target>.csv when output_dir is given.
+    """
+    labels = np.asarray(labels).reshape(len(labels), -1)
+    reports = {}
+    for i, name in enumerate(task_names):
+        known = labels[:, i] != MISSING_LABEL
+        preds = np.argmax(np.asarray(logits[i]), axis=1)
+        if not known.any():
+            # 该目标在文件中没有标签，只输出预测
+            reports[name] = {'predictions': preds}
+            continue
+        names = (label_names or {}).get(name)
+        present = np.unique(np.concatenate([labels[known, i], preds[known]]))
+        report_df = pd.DataFrame(classification_report(
+            labels[known, i], preds[known], labels=present, output_dict=True, zero_division=0,
+            target_names=[str(names[k]) for k in present] if names is not None else None
+        )).transpose()
+        if output_dir:
+            report_df.to_csv(os.path.join(output_dir, f"{prefix}_classification_report_{name}.csv"))
+        print(f"\n{name} 分类报告:")
+        print(report_df)
+        reports[name] = {'confusion_matrix': confusion_matrix(labels[known, i], preds[known], labels=present),
+                         'classification_report': report_df, 'predictions': preds}
+    return reports
+
+
+def save_task_config(path, task_num_labels, task_weights=None, label_names=None):
+    with open(path, 'w') as f:
+        json.dump({'task_num_labels': task_num_labels, 'task_weights': task_weights or {},
+                   'label_names': {k: [str(v) for v in names] for k, names in (label_names or {}).items()}}, f, indent=2)
+
+
+def load_multi_task_model(directory, model_name_or_config, task_config_path):
+    """Rebuild a MultiTaskModel from a Trainer.save_model directory and its task config"""
+    with open(task_config_path) as f:
+        task_config = json.load(f)
+    config = model_name_or_config
+    if isinstance(config, str):
+        config = AutoConfig.from_pretrained(config)
+    model = MultiTaskModel.from_config(config, task_config['task_num_labels'], task_config['task_weights'])
+    weights = os.path.join(directory, "model.safetensors")
+    if os.path.exists(weights):
+        from safetensors.torch import load_file
+        state = load_file(weights)
+    else:
+        state = torch.load(os.path.join(directory, "pytorch_model.bin"), map_location="cpu")
+    model.load_state_dict(state)
+    return model
@@ -0,0 +1,367 @@
+"""Bit-packed precedent index: "show me the most similar past decisions" for a new case.
+
+Each case becomes one bitset packed into uint64 words:
+
+- the binary flags of FINAL_dataset.csv (exceptions, data_category_*, data_processing_basis_*,
+  violation_nature_*)
+- one-hot country and company_industry
+- the GDPR article numbers cited in gdpr_clause ("Article 5(1)(a), Art. 32" -> articles 5 and 32), as
+  parsed by gdpr_articles.parse_clause
+
+Words are stored column-wise with per-row bit counts precomputed, so a query only ANDs and popcounts
+the few words where it has bits set (Jaccard or weighted Hamming), after optional country / year
+filters, and takes the top k with argpartition.
+"""
+
+import os
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from gdpr_articles import MAX_ARTICLE, parse_clause
+
+FLAG_PREFIXES = ('data_category_', 'data_processing_basis_', 'violation_nature_')
+FLAG_COLUMNS = ['Criminal_investigation_exception', 'country_security_exception', 'free_speech_exception']
+
+# 加权汉明距离中各组特征的权重（不一致的代价）
+DEFAULT_WEIGHTS = {'flag': 1.0, 'country': 2.0, 'industry': 1.0, 'article': 0.5}
+
+INDEX_FILE = "precedent_index.npz"
+VOCAB_FILE = "precedent_vocab.json"
+
+if hasattr(np, "bitwise_count"):
+    def popcount(words):
+        """Set bits of every element of a uint64 array, as uint8"""
+        return np.bitwise_count(words)
+else:
+    _BYTE_COUNTS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount(words):
+        """Set bits of every element of a uint64 array, as uint8 (byte lookup table for NumPy < 2.0)"""
+        words = np.ascontiguousarray(words)
+        return _BYTE_COUNTS[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+
+def parse_articles(clause):
+    """Sorted GDPR article numbers cited in a gdpr_clause string (the article-level keys of parse_clause)"""
+    if not isinstance(clause, str):
+        return []
+    return sorted(int(reference) for reference in parse_clause(clause) if '(' not in reference)
+
+
+class PrecedentIndex:
+    """
+    判例相似度索引
+
+    每个案例打包为 n_words 个 uint64；vocab 记录每一位对应的特征，新案例用同一 vocab 编码。
+    """
+
+    def __init__(self, flag_columns, countries, industries, weights=None):
+        self.flag_columns = list(flag_columns)
+        self.countries = list(countries)
+        self.industries = list(industries)
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        # 位布局: [flags | country | industry | article 1..MAX_ARTICLE]
+        self.groups = {}
+        offset = 0
+        for group, size in (('flag', len(self.flag_columns)), ('country', len(self.countries)),
+                            ('industry', len(self.industries)), ('article', MAX_ARTICLE)):
+            self.groups[group] = (offset, offset + size)
+            offset += size
+        self.n_bits = offset
+        self.n_words = (offset + 63) // 64
+        self._country_code = {c: i for i, c in enumerate(self.countries)}
+        self._industry_code = {c: i for i, c in enumerate(self.industries)}
+        self._group_masks = {group: self._mask(start, stop) for group, (start, stop) in self.groups.items()}
+        self.bits = np.zeros((0, self.n_words), dtype=np.uint64)
+        self.country_codes = np.zeros(0, dtype=np.int16)
+        self.years = np.zeros(0, dtype=np.int16)
+
+    def _mask(self, start, stop):
+        mask = np.zeros(self.n_bits, dtype=bool)
+        mask[start:stop] = True
+        return self._pack(mask[None, :])[0]
+
+    def _pack(self, bool_matrix):
+        """(n, n_bits) bool -> (n, n_words) uint64, bit i of the case in word i // 64"""
+        n = len(bool_matrix)
+        padded = np.zeros((n, self.n_words * 64), dtype=bool)
+        padded[:, :bool_matrix.shape[1]] = bool_matrix
+        return np.packbits(padded, axis=1, bitorder='little').view('<u8').astype(np.uint64, copy=False)
+
+    @property
+    def bits(self):
+        """(n, n_words) packed bitsets"""
+        return self.words.T
+
+    @bits.setter
+    def bits(self, value):
+        # 按字存储为 (n_words, n) 的连续数组：查询时逐字做 AND + popcount，跳过查询中全零的字
+        self.words = np.ascontiguousarray(np.asarray(value, dtype=np.uint64).T)
+        self._refresh_counts()
+
+    def _refresh_counts(self):
+        """Per-row set-bit counts, overall and per feature group, so queries only need |A ∩ B|"""
+        self.counts = np.zeros(self.words.shape[1], dtype=np.int16)
+        self.group_counts = {}
+        for group, mask in self._group_masks.items():
+            counts = np.zeros(self.words.shape[1], dtype=np.int16)
+            for w in np.flatnonzero(mask):
+                counts += popcount(self.words[w] & mask[w])
+            self.group_counts[group] = counts
+            self.counts += counts
+        self._weighted_counts = sum(np.float32(self.weights.get(group) or 0) * counts
+                                    for group, counts in self.group_counts.items())
+
+    @classmethod
+    def from_frame(cls, df, weights=None):
+        """Build the vocabulary from a dataset frame and index every row"""
+        flags = [c for c in df.columns if c in FLAG_COLUMNS or c.startswith(FLAG_PREFIXES)]
+        countries = sorted(df['country'].dropna().astype(str).unique()) if 'country' in df else []
+        industries = sorted(df['company_industry'].dropna().astype(str).unique()) if 'company_industry' in df else []
+        index = cls(flags, countries, industries, weights)
+        index.add_frame(df)
+        return index
+
+    def encode_frame(self, df):
+        """Bitsets, country codes (-1 unknown) and years (-1 unknown) for the rows of df"""
+        n = len(df)
+        matrix = np.zeros((n, self.n_bits), dtype=bool)
+        start, _ = self.groups['flag']
+        for i, col in enumerate(self.flag_columns):
+            if col in df:
+                matrix[:, start + i] = pd.to_numeric(df[col], errors='coerce').fillna(0).to_numpy() == 1
+
+        country_codes = np.full(n, -1, dtype=np.int16)
+        for column, group, lookup, codes_out in (('country', 'country', self._country_code, country_codes),
+                                                 ('company_industry', 'industry', self._industry_code, None)):
+            if column not in df:
+                continue
+            codes = df[column].map(lookup).fillna(-1).to_numpy(dtype=np.int64)
+            known = codes >= 0
+            matrix[np.flatnonzero(known), self.groups[group][0] + codes[known]] = True
+            if codes_out is not None:
+                codes_out[:] = codes
+
+        if 'gdpr_clause' in df:
+            start, _ = self.groups['article']
+            for row, clause in enumerate(df['gdpr_clause'].tolist()):
+                for article in parse_articles(clause):
+                    matrix[row, start + article - 1] = True
+
+        years = np.full(n, -1, dtype=np.int16)
+        if 'Date' in df:
+            years[:] = pd.to_numeric(df['Date'], errors='coerce').fillna(-1).to_numpy(dtype=np.int64)
+        return self._pack(matrix), country_codes, years
+
+    def encode_case(self, case):
+        """Packed bitset, country code and year of one case dict (query path, no DataFrame overhead)"""
+        bits = np.zeros(self.n_words, dtype=np.uint64)
+
+        def set_bit(position):
+            bits[position // 64] |= np.uint64(1) << np.uint64(position % 64)
+
+        start, _ = self.groups['flag']
+        for i, col in enumerate(self.flag_columns):
+            if pd.to_numeric(case.get(col, 0), errors='coerce') == 1:
+                set_bit(start + i)
+        country_code = self._country_code.get(case.get('country'), -1)
+        if country_code >= 0:
+            set_bit(self.groups['country'][0] + country_code)
+        industry_code = self._industry_code.get(case.get('company_industry'), -1)
+        if industry_code >= 0:
+            set_bit(self.groups['industry'][0] + industry_code)
+        for article in parse_articles(case.get('gdpr_clause')):
+            set_bit(self.groups['article'][0] + article - 1)
+        year = pd.to_numeric(case.get('Date'), errors='coerce')
+        return bits, country_code, -1 if pd.isna(year) else int(year)
+
+    def add_frame(self, df):
+        bits, country_codes, years = self.encode_frame(df)
+        self.bits = np.concatenate([self.bits, bits])
+        self.country_codes = np.concatenate([self.country_codes, country_codes])
+        self.years = np.concatenate([self.years, years])
+
+    def __len__(self):
+        return self.words.shape[1]
+
+    def _candidates(self, country=None, years=None):
+        """Row indices passing the filters (None = all rows)"""
+        mask = None
+        if country is not None:
+            mask = self.country_codes == self._country_code.get(country, -2)
+        if years is not None:
+            low, high = years if isinstance(years, (tuple, list)) else (years, years)
+            year_mask = (self.years >= low) & (self.years <= high)
+            mask = year_mask if mask is None else mask & year_mask
+        return None if mask is None else np.flatnonzero(mask)
+
+    def _intersections(self, query_bits, rows, mask=None):
+        """|A ∩ B| per row, touching only the words where the (masked) query has bits set"""
+        total = np.zeros(len(self) if rows is None else len(rows), dtype=np.int16)
+        for w in np.flatnonzero(query_bits if mask is None else query_bits & mask):
+            word = query_bits[w] if mask is None else query_bits[w] & mask[w]
+            column = self.words[w] if rows is None else self.words[w, rows]
+            total += popcount(column & word)
+        return total
+
+    def scores(self, query_bits, rows=None, metric='jaccard'):
+        """
+        Similarity of one packed query to the indexed rows (all rows, or the given row indices)
+
+        jaccard: |A ∩ B| / |A ∪ B| with |A ∪ B| = |A| + |B| - |A ∩ B| from the precomputed row counts
+        hamming: 1 / (1 + weighted Hamming distance), per group |A_g| + |B_g| - 2|A_g ∩ B_g|
+                 (group weights are fixed when the index is built)
+        """
+        query_bits = np.asarray(query_bits, dtype=np.uint64)
+        if metric == 'jaccard':
+            counts = self.counts if rows is None else self.counts[rows]
+            intersection = self._intersections(query_bits, rows)
+            union = counts + int(popcount(query_bits).sum()) - intersection
+            return np.divide(intersection, union, out=np.ones(len(union), dtype=np.float32),
+                             where=union > 0, dtype=np.float32)
+        if metric == 'hamming':
+            # Σ w_g |B_g| 已预先按行算好，查询只需计算与查询位相交的部分
+            distance = self._weighted_counts.copy() if rows is None else self._weighted_counts[rows]
+            distance += np.float32(1.0)
+            for group, mask in self._group_masks.items():
+                weight = self.weights.get(group)
+                if not weight or not (query_bits & mask).any():
+                    continue
+                distance += np.float32(weight * int(popcount(query_bits & mask).sum()))
+                distance -= np.float32(2 * weight) * self._intersections(query_bits, rows, mask)
+            return np.reciprocal(distance, out=distance)
+        raise ValueError(f"Unknown metric: {metric}")
+
+    def query(self, case, k=10, metric='jaccard', same_country=False, years=None, exclude=None):
+        """
+        Top-k most similar indexed cases for one case
+
+        Args:
+            case: dict or DataFrame (first row) with the dataset columns (missing columns count as 0)
+            same_country: only cases from the query's country
+            years: year or (first, last) inclusive range of the decision Date
+            exclude: row index to leave out (e.g. the query itself when it is indexed)
+
+        Returns:
+            (row indices, similarities), best first
+        """
+        if isinstance(case, pd.DataFrame):
+            case = case.iloc[0].to_dict()
+        query_bits, _, _ = self.encode_case(case)
+        rows = self._candidates(case.get('country') if same_country else None, years)
+        scores = self.scores(query_bits, rows, metric)
+        if exclude is not None:
+            positions = np.flatnonzero((rows if rows is not None else np.arange(len(self))) == exclude)
+            scores[positions] = -np.inf
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        top = np.argpartition(scores, len(scores) - k)[len(scores) - k:]
+        # 与第 k 名同分时取行号较小的案例，结果可复现
+        kth = scores[top].min()
+        top = np.concatenate([np.flatnonzero(scores > kth), np.flatnonzero(scores == kth)[:k]])[:k]
+        top = top[np.lexsort((top, -scores[top]))]
+        top = top[np.isfinite(scores[top])]
+        result_rows = top if rows is None else rows[top]
+        return result_rows, scores[top]
+
+    def similar_cases(self, df, case, k=10, **kwargs):
+        """Rows of df (the indexed frame) most similar to case, with a similarity column"""
+        rows, scores = self.query(case, k, **kwargs)
+        result = df.iloc[rows].copy()
+        result.insert(0, 'similarity', scores)
+        return result
+
+    def save(self, index_dir):
+        os.makedirs(index_dir, exist_ok=True)
+        np.savez(os.path.join(index_dir, INDEX_FILE), bits=self.bits, country_codes=self.country_codes,
+                 years=self.years)
+        with open(os.path.join(index_dir, VOCAB_FILE), 'w', encoding='utf-8') as f:
+            json.dump({"flag_columns": self.flag_columns, "countries": self.countries,
+                       "industries": self.industries, "weights": self.weights}, f, ensure_ascii=False, indent=1)
+        print(f"判例索引已保存至 {index_dir}（{len(self)} 个案例，每个 {self.n_words} 个 64 位字）")
+
+    @classmethod
+    def load(cls, index_dir):
+        with open(os.path.join(index_dir, VOCAB_FILE), 'r', encoding='utf-8') as f:
+            vocab = json.load(f)
+        index = cls(vocab["flag_columns"], vocab["countries"], vocab["industries"], vocab["weights"])
+        arrays = np.load(os.path.join(index_dir, INDEX_FILE))
+        index.bits = arrays["bits"]
+        index.country_codes = arrays["country_codes"]
+        index.years = arrays["years"]
+        return index
+
+
+def check_against_sets(index, df, samples=20, seed=0):
+    """Compare packed Jaccard / weighted Hamming scores with a plain Python set computation on a few query rows"""
+
+    def feature_set(row):
+        features = {('flag', c) for c in index.flag_columns if row.get(c) == 1}
+        if row.get('country') in index._country_code:
+            features.add(('country', row['country']))
+        if row.get('company_industry') in index._industry_code:
+            features.add(('industry', row['company_industry']))
+        return features | {('article', a) for a in parse_articles(row.get('gdpr_clause'))}
+
+    records = df.to_dict('records')
+    sets = [feature_set(r) for r in records]
+    rng = np.random.RandomState(seed)
+    for q in rng.choice(len(records), size=min(samples, len(records)), replace=False):
+        expected = np.array([len(sets[q] & s) / len(sets[q] | s) if sets[q] | s else 1.0 for s in sets])
+        bits, _, _ = index.encode_case(records[q])
+        assert np.array_equal(bits, index.encode_frame(df.iloc[[q]])[0][0]), f"row {q}: encode_case differs"
+        assert np.allclose(index.scores(bits), expected), f"row {q}: packed Jaccard differs from set Jaccard"
+        distance = np.array([sum(index.weights[g] for g, _ in sets[q] ^ s) for s in sets])
+        assert np.allclose(index.scores(bits, metric='hamming'), 1 / (1 + distance)), \
+            f"row {q}: packed weighted Hamming differs from set computation"
+    return True
+
+
+def benchmark(index, df, n_cases=1_000_000, queries=20, k=10, seed=0):
+    """Query latency on an index grown to n_cases by resampling the indexed rows"""
+    rng = np.random.RandomState(seed)
+    rows = rng.randint(0, len(index), size=n_cases)
+    big = PrecedentIndex(index.flag_columns, index.countries, index.industries, index.weights)
+    big.bits, big.country_codes, big.years = index.bits[rows], index.country_codes[rows], index.years[rows]
+    print(f"基准索引: {len(big)} 个案例，{big.words.nbytes / 1e6:.1f} MB")
+    cases = df.iloc[rng.randint(0, len(df), size=queries)].to_dict('records')
+    report = {}
+    for label, kwargs in (("jaccard", {}), ("weighted hamming", {"metric": "hamming"}),
+                          ("jaccard, same country", {"same_country": True}),
+                          ("jaccard, 2020-2022", {"years": (2020, 2022)})):
+        start = time.perf_counter()
+        for case in cases:
+            big.query(case, k, **kwargs)
+        report[label] = (time.perf_counter() - start) / queries * 1000
+        print(f"{label:>22}: {report[label]:.2f} ms/查询")
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    from feature_store import load_csv_frame
+    parser = argparse.ArgumentParser(description="Build the precedent index, check it and benchmark queries")
+    parser.add_argument("--data", default="../Dataset/FINAL_dataset.csv")
+    parser.add_argument("--store", default="./feature_store", help="特征表目录（不写入数据集所在目录）")
+    parser.add_argument("--output", default="./precedent_index")
+    parser.add_argument("--cases", type=int, default=1_000_000)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    data = load_csv_frame(args.data, args.store)
+    start = time.perf_counter()
+    precedents = PrecedentIndex.from_frame(data)
+    print(f"索引构建: {len(precedents)} 个案例，{precedents.n_bits} 位，耗时 {time.perf_counter() - start:.2f}秒")
+    check_against_sets(precedents, data)
+    print("打包 Jaccard / 加权汉明与集合计算一致")
+    precedents.save(args.output)
+
+    example = data.iloc[0].to_dict()
+    print(f"\n与第 0 个案例最相似的 {args.k} 个判例（同国家）:")
+    print(precedents.similar_cases(data, example, args.k, same_country=True, exclude=0)
+          [['similarity', 'country', 'Date', 'gdpr_clause', 'violation_result', 'fine_amount']])
+    benchmark(precedents, data, n_cases=args.cases)
@@ -0,0 +1,239 @@
+"""Dynamic padding helpers for the Legal-BERT classifiers.
+
+The templated feature sentences are far shorter than the old fixed `max_length=256`, so padding every
+example to 256 spends most of the forward/backward pass on pad tokens. Here examples are tokenized
+without padding (truncation only) and padded per batch by `DataCollatorWithPadding`; optionally the
+Trainer groups examples of similar length (`group_by_length`) so each batch pads to its own maximum.
+
+`tokenize_cached` tokenizes a whole corpus once into an Arrow file keyed by tokenizer, template version,
+settings and content; folds are then `Dataset.select` index views over it.
+
+`token_length_histogram` is logged by `prepare_data`; `benchmark_padding` measures train-step and
+predict throughput of fixed vs dynamic padding on the current device.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+from transformers import DataCollatorWithPadding
+from transformers.trainer_pt_utils import LengthGroupedSampler
+
+from feature_text import TEMPLATE_VERSION
+
+logger = logging.getLogger('Violationresult')
+
+HISTOGRAM_BINS = (16, 32, 48, 64, 96, 128, 192, 256, 384, 512)
+
+
+def make_collator(tokenizer, device=None):
+    """Per-batch padding collator (multiples of 8 on GPU so tensor cores stay aligned)"""
+    on_gpu = device is not None and torch.device(device).type == "cuda"
+    return DataCollatorWithPadding(tokenizer, pad_to_multiple_of=8 if on_gpu else None)
+
+
+def token_lengths(tokenizer, texts, max_length=None):
+    """Token count of each text (special tokens included, truncated at max_length when given)"""
+    encoded = tokenizer(list(texts), truncation=max_length is not None, max_length=max_length,
+                        add_special_tokens=True, return_length=True)
+    return np.asarray(encoded["length"])
+
+
+def token_length_histogram(tokenizer, texts, max_length=256, bins=HISTOGRAM_BINS):
+    """
+    Log the token-length distribution and how much of a fixed-length batch would be padding
+
+    Returns:
+        dict with percentiles, histogram counts and the padding share at max_length
+    """
+    lengths = token_lengths(tokenizer, texts)
+    edges = [0] + [b for b in bins if b < lengths.max()] + [int(lengths.max())]
+    counts, _ = np.histogram(lengths, bins=edges)
+    truncated = int((lengths > max_length).sum())
+    stats = {
+        "count": int(len(lengths)),
+        "min": int(lengths.min()),
+        "p50": float(np.percentile(lengths, 50)),
+        "p90": float(np.percentile(lengths, 90)),
+        "p99": float(np.percentile(lengths, 99)),
+        "max": int(lengths.max()),
+        "histogram": {f"{low + 1}-{high}": int(c) for low, high, c in zip(edges[:-1], edges[1:], counts)},
+        "truncated": truncated,
+        "pad_share_fixed": float(1 - np.minimum(lengths, max_length).sum() / (max_length * len(lengths))),
+    }
+    logger.info(f"Token lengths: min {stats['min']}, p50 {stats['p50']:.0f}, p90 {stats['p90']:.0f}, "
+                f"p99 {stats['p99']:.0f}, max {stats['max']}; {truncated} texts longer than {max_length}")
+    logger.info(f"Token length histogram: {stats['histogram']}")
+    logger.info(f"Padding to max_length={max_length} would make {stats['pad_share_fixed'] * 100:.1f}% of tokens padding")
+    return stats
+
+
+def tokenizer_fingerprint(tokenizer):
+    """Hash of everything that changes token ids: the serialized fast tokenizer, or name + vocabulary"""
+    h = hashlib.sha1()
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        # truncation / padding 是调用时的状态（每次分词都会改写），不影响词表与切分规则
+        state = json.loads(backend.to_str())
+        state.pop("truncation", None)
+        state.pop("padding", None)
+        h.update(json.dumps(state, sort_keys=True).encode("utf-8"))
+    else:
+        h.update(str(getattr(tokenizer, "name_or_path", "")).encode("utf-8"))
+        h.update(json.dumps(sorted(tokenizer.get_vocab().items())).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def dataset_fingerprint(dataset):
+    """Content hash of a small in-memory Dataset (every column, in order)"""
+    h = hashlib.sha1()
+    for column in dataset.column_names:
+        h.update(column.encode("utf-8"))
+        h.update(json.dumps(dataset[column], default=str).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def tokenize_cached(dataset, tokenizer, cache_dir, max_length=256, padding=False, return_length=False, tag="corpus"):
+    """
+    Tokenize dataset['text'] once and keep the result as a memory-mapped Arrow file
+
+    The file name encodes tokenizer, feature-template version, tokenization settings and dataset
+    content, so a changed tokenizer, template or dataset gets a fresh cache and an unchanged one is
+    reloaded without tokenizing. Slice the result with `Dataset.select(indices)` for folds.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    settings = f"{max_length}-{padding or 'nopad'}-{int(return_length)}"
+    key = hashlib.sha1(f"{tokenizer_fingerprint(tokenizer)}|t{TEMPLATE_VERSION}|{settings}|"
+                       f"{dataset_fingerprint(dataset)}".encode("utf-8")).hexdigest()[:16]
+    cache_file = os.path.join(cache_dir, f"{tag}_{key}.arrow")
+    cached = os.path.exists(cache_file)
+    start = time.perf_counter()
+
+    def tokenize_function(examples):
+        return tokenizer(examples['text'], padding=padding, truncation=True, max_length=max_length,
+                         return_length=return_length)
+
+    tokenized = dataset.map(tokenize_function, batched=True, cache_file_name=cache_file, load_from_cache_file=True,
+                            desc=f"Tokenizing {tag}")
+    logger.info(f"{'Loaded cached' if cached else 'Tokenized and cached'} {tag} ({len(tokenized)} examples) "
+                f"in {time.perf_counter() - start:.2f}s: {cache_file}")
+    return tokenized
+
+
+def _batches(tokenizer, texts, labels, batch_size, max_length, mode, seed=42):
+    """DataLoader over tokenized examples; mode is 'fixed', 'dynamic' or 'grouped'"""
+    padding = "max_length" if mode == "fixed" else False
+    encoded = tokenizer(list(texts), padding=padding, truncation=True, max_length=max_length)
+    features = [{key: encoded[key][i] for key in encoded} | {"labels": int(labels[i])} for i in range(len(texts))]
+    sampler = None
+    if mode == "grouped":
+        sampler = LengthGroupedSampler(batch_size, lengths=[len(f["input_ids"]) for f in features],
+                                       generator=torch.Generator().manual_seed(seed))
+    return DataLoader(features, batch_size=batch_size, sampler=sampler, shuffle=sampler is None,
+                      collate_fn=make_collator(tokenizer), generator=torch.Generator().manual_seed(seed))
+
+
+def benchmark_padding(model, tokenizer, texts, labels, batch_size=16, max_length=256, train_steps=10,
+                      device="cpu", modes=("fixed", "dynamic", "grouped")):
+    """
+    Throughput (examples/second) of training steps and prediction for each padding mode
+
+    Training runs `train_steps` optimizer steps (the weights are restored afterwards); prediction
+    covers every text once, as trainer.predict does on the validation / external test set.
+    """
+    model.to(device)
+    initial_state = {k: v.detach().clone() for k, v in model.state_dict().items()}
+    report = {}
+    for mode in modes:
+        loader = _batches(tokenizer, texts, labels, batch_size, max_length, mode)
+        optimizer = torch.optim.AdamW(model.parameters(), lr=3e-5)
+        model.train()
+        seen, tokens, start = 0, 0, time.perf_counter()
+        for step, batch in enumerate(loader):
+            if step >= train_steps:
+                break
+            batch = {k: v.to(device) for k, v in batch.items()}
+            loss = model(**batch).loss
+            loss.backward()
+            optimizer.step()
+            optimizer.zero_grad()
+            seen += len(batch["labels"])
+            tokens += batch["input_ids"].numel()
+        train_rate = seen / (time.perf_counter() - start)
+        train_padded = tokens / seen
+
+        model.eval()
+        start = time.perf_counter()
+        with torch.no_grad():
+            for batch in _batches(tokenizer, texts, labels, batch_size * 2, max_length,
+                                  "fixed" if mode == "fixed" else "dynamic"):
+                batch.pop("labels")
+                model(**{k: v.to(device) for k, v in batch.items()})
+        predict_rate = len(texts) / (time.perf_counter() - start)
+        model.load_state_dict(initial_state)
+
+        report[mode] = {"train_examples_per_sec": round(train_rate, 2), "predict_examples_per_sec": round(predict_rate, 2),
+                        "train_tokens_per_example": round(train_padded, 1)}
+        print(f"{mode:>8}: 训练 {train_rate:.2f} 样本/秒（平均 {train_padded:.0f} token/样本），预测 {predict_rate:.2f} 样本/秒")
+    if "fixed" in report:
+        for mode in report:
+            if mode != "fixed":
+                print(f"{mode} 相对 fixed: 训练 {report[mode]['train_examples_per_sec'] / report['fixed']['train_examples_per_sec']:.1f}x，"
+                      f"预测 {report[mode]['predict_examples_per_sec'] / report['fixed']['predict_examples_per_sec']:.1f}x")
+    return report
+
+
+def _offline_model(texts, num_labels=2, layers=12):
+    """bert-base-shaped model (layers deep) with a WordPiece vocabulary trained on texts (no hub access needed)"""
+    from tokenizers import BertWordPieceTokenizer
+    from transformers import BertConfig, BertForSequenceClassification, BertTokenizerFast
+    import tempfile
+    wordpiece = BertWordPieceTokenizer(lowercase=True)
+    wordpiece.train_from_iterator(texts, vocab_size=8000, min_frequency=1)
+    directory = tempfile.mkdtemp()
+    wordpiece.save_model(directory)
+    tokenizer = BertTokenizerFast.from_pretrained(directory)
+    config = BertConfig(vocab_size=tokenizer.vocab_size, num_labels=num_labels, num_hidden_layers=layers)
+    return BertForSequenceClassification(config), tokenizer
+
+
+if __name__ == "__main__":
+    import argparse
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+    from feature_store import load_csv_frame
+    from feature_text import features_to_text
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Token-length histogram and fixed vs dynamic padding throughput")
+    parser.add_argument("--data", default="../Dataset/FINAL_dataset.csv")
+    parser.add_argument("--store", default="./feature_store", help="特征表目录（不写入数据集所在目录）")
+    parser.add_argument("--model", default="JQ1984/legalbert_gdpr_pretrained")
+    parser.add_argument("--offline", action="store_true",
+                        help="use a bert-base-shaped model with a locally trained vocabulary")
+    parser.add_argument("--layers", type=int, default=12, help="encoder layers of the --offline model")
+    parser.add_argument("--samples", type=int, default=256)
+    parser.add_argument("--train-steps", type=int, default=6)
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    data = load_csv_frame(args.data, args.store)
+    # 与 prepare_data 相同的列排除
+    features = data.drop(columns=['fine_amount', 'gdpr_clause', 'violation_result', 'case_group'] +
+                         [c for c in data.columns if c.startswith('violation_nature_')], errors='ignore')
+    all_texts = features_to_text(features)
+    all_labels = data['violation_result'].to_numpy()
+    if args.offline:
+        bench_model, bench_tokenizer = _offline_model(all_texts, layers=args.layers)
+    else:
+        bench_tokenizer = AutoTokenizer.from_pretrained(args.model)
+        bench_model = AutoModelForSequenceClassification.from_pretrained(args.model, num_labels=2)
+    token_length_histogram(bench_tokenizer, all_texts)
+    torch.manual_seed(0)
+    picked = np.random.RandomState(0).choice(len(all_texts), size=min(args.samples, len(all_texts)), replace=False)
+    benchmark_padding(bench_model, bench_tokenizer, [all_texts[i] for i in picked], all_labels[picked],
+                      batch_size=args.batch_size, train_steps=args.train_steps,
+                      device="cuda" if torch.cuda.is_available() else "cpu")
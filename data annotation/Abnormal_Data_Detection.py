@@ -1,5 +1,7 @@
 import os
 
+from Corpus_Auditor import scan_tree
+
 def find_small_files(directory_path, max_size_bytes=100):
     """
     遍历指定目录，找出所有小于指定大小的文件
@@ -13,24 +15,16 @@ def find_small_files(directory_path, max_size_bytes=100):
     """
     small_files = []
     
-    # 遍历目录
-    for root, dirs, files in os.walk(directory_path):
-        for file in files:
-            file_path = os.path.join(root, file)
-            
-            # 检查文件大小
-            try:
-                file_size = os.path.getsize(file_path)
-                if file_size < max_size_bytes:
-                    # 文件大小小于指定值，添加到列表
-                    relative_path = os.path.relpath(file_path, directory_path)
-                    small_files.append({
-                        "文件路径": relative_path,
-                        "绝对路径": file_path,
-                        "文件大小": f"{file_size} bytes"
-                    })
-            except Exception as e:
-                print(f"无法获取文件 {file_path} 的大小: {e}")
+    # 单次 scandir 遍历，复用目录项的 stat 结果（见 Corpus_Auditor）
+    for file_path, stat in scan_tree(directory_path):
+        if stat.st_size < max_size_bytes:
+            # 文件大小小于指定值，添加到列表
+            relative_path = os.path.relpath(file_path, directory_path)
+            small_files.append({
+                "文件路径": relative_path,
+                "绝对路径": file_path,
+                "文件大小": f"{stat.st_size} bytes"
+            })
     
     return small_files
 
@@ -0,0 +1,226 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+
+from LLM_Assisted_Dataset_Annotations import (
+    PROMPT_TEMPLATE, MAX_TOKENS, MODEL_NAME,
+    annotate_text, list_case_files, save_annotation, open_cache
+)
+from Annotation_Cache import output_is_valid
+from Annotation_Schema import parse_annotation
+
+# 与 Training/Fine_tune_LLM/Fine_tune_code.py 的训练格式一致
+FINE_TUNE_PROMPT = "###GDPR related case\n{text}\n###Judgement\n"
+LOCAL_MODEL_PATH = "./fine_tuned_model_prompt"
+
+
+class AnnotationBackend:
+    """标注后端接口：annotate_batch(texts) -> 与 texts 等长的标注结果列表"""
+
+    name = "base"
+    batch_size = 1
+    model_name = None  # 参与缓存键，不同模型的结果互不覆盖
+
+    def annotate(self, text):
+        return self.annotate_batch([text])[0]
+
+    def annotate_batch(self, texts):
+        raise NotImplementedError
+
+    def close(self):
+        """Release the backend's resources (thread pools, models)"""
+
+
+class RemoteApiBackend(AnnotationBackend):
+    """Chat-completions API backend (DeepSeek by default); a batch is sent as parallel requests"""
+
+    name = "remote"
+
+    def __init__(self, api_url=None, batch_size=8):
+        self.api_url = api_url
+        self.batch_size = batch_size
+        self.model_name = MODEL_NAME
+        self._executor = ThreadPoolExecutor(max_workers=batch_size)
+
+    def annotate_batch(self, texts):
+        return list(self._executor.map(lambda text: annotate_text(text, self.api_url), texts))
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+class LocalHFBackend(AnnotationBackend):
+    """
+    本地 Hugging Face 因果语言模型后端（默认加载微调后的 ./fine_tuned_model_prompt）
+
+    一次前向批量生成多个案例的标注，无网络延迟和限流。使用左侧填充与贪心解码，
+    结果可复现；输出同样经过 parse_annotation 的 schema 校验。LoRA 适配器目录
+    需要安装 peft 才能由 transformers 直接加载。
+    """
+
+    name = "local"
+
+    def __init__(self, model_path=LOCAL_MODEL_PATH, batch_size=4, max_new_tokens=MAX_TOKENS,
+                 max_input_tokens=4096, prompt_format=FINE_TUNE_PROMPT, use_instructions=True,
+                 device="cpu", num_threads=None):
+        import torch
+        from transformers import AutoTokenizer, AutoModelForCausalLM
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.torch = torch
+        self.batch_size = batch_size
+        self.max_new_tokens = max_new_tokens
+        self.max_input_tokens = max_input_tokens
+        self.prompt_format = prompt_format
+        self.use_instructions = use_instructions
+        self.device = device
+        self.model_name = f"local:{os.path.abspath(model_path)}"
+
+        print(f"加载本地模型: {model_path}")
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        # 批量生成必须左填充，否则短样本的新token会接在pad后面
+        self.tokenizer.padding_side = "left"
+        # fit_text 已按长度截断案例；万一仍超长，从左侧截断，保留结尾的 ###Judgement 标记
+        self.tokenizer.truncation_side = "left"
+        self.model = AutoModelForCausalLM.from_pretrained(model_path).eval().to(device)
+
+    def build_prompt(self, text):
+        if self.use_instructions:
+            text = PROMPT_TEMPLATE.format(text=text)
+        return self.prompt_format.format(text=text)
+
+    def _prompt_tokens(self, prompt):
+        return len(self.tokenizer(prompt)["input_ids"])
+
+    def fit_text(self, text):
+        """
+        Cut the case text so its prompt fits in max_input_tokens
+
+        The end of the case is dropped rather than the end of the prompt, so the JSON instructions and
+        the ###Judgement marker that generation continues from are always kept.
+        """
+        excess = self._prompt_tokens(self.build_prompt(text)) - self.max_input_tokens
+        if excess <= 0:
+            return text
+        budget = self.max_input_tokens - self._prompt_tokens(self.build_prompt(""))
+        if budget <= 0:
+            raise ValueError(f"max_input_tokens={self.max_input_tokens} is too small for the prompt template")
+        ids = self.tokenizer(text, add_special_tokens=False)["input_ids"]
+        while budget > 0:
+            # 按 token 截断后再检查整体长度（截断处的分词可能与原文略有不同）
+            fitted = self.tokenizer.decode(ids[:budget], skip_special_tokens=True)
+            excess = self._prompt_tokens(self.build_prompt(fitted)) - self.max_input_tokens
+            if excess <= 0:
+                print(f"案例过长，截断为 {budget}/{len(ids)} 个token")
+                return fitted
+            budget -= excess
+        return ""
+
+    def generate(self, prompts):
+        """Greedy batched generation; returns only the newly generated text per prompt"""
+        encodings = self.tokenizer(
+            prompts, return_tensors="pt", padding=True, truncation=True, max_length=self.max_input_tokens
+        ).to(self.device)
+        with self.torch.no_grad():
+            output_ids = self.model.generate(
+                **encodings,
+                max_new_tokens=self.max_new_tokens,
+                do_sample=False,
+                pad_token_id=self.tokenizer.pad_token_id
+            )
+        new_tokens = output_ids[:, encodings["input_ids"].shape[1]:]
+        return self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+
+    def annotate_batch(self, texts):
+        start_time = time.time()
+        outputs = self.generate([self.build_prompt(self.fit_text(text)) for text in texts])
+        print(f"本地模型批量生成 {len(texts)} 个案例，耗时: {time.time() - start_time:.2f}秒")
+        results = []
+        for output in outputs:
+            result = parse_annotation(output)
+            if "error" in result:
+                result["raw_output"] = output
+            results.append(result)
+        return results
+
+
+def get_backend(kind="remote", **kwargs):
+    """Backend factory: 'remote' or 'local'"""
+    backends = {"remote": RemoteApiBackend, "local": LocalHFBackend}
+    if kind not in backends:
+        raise ValueError(f"Unknown annotation backend '{kind}', choose from {sorted(backends)}")
+    return backends[kind](**kwargs)
+
+
+def process_cases_with_backend(input_dir, backend, cache_dir=None, resume=False, sink=None):
+    """
+    用任意后端批量标注目录中的案例
+
+    按 backend.batch_size 分批；缓存、resume 与输出写入方式与 process_cases 一致，
+    缓存键使用 backend.model_name，本地模型与远程API的结果互不混用。
+    """
+    if not os.path.isdir(input_dir):
+        print("Error: Input path is not a directory or does not exist.")
+        return
+
+    files = list_case_files(input_dir)
+    cache = open_cache(cache_dir, backend.model_name) if cache_dir else None
+    write = sink.write if sink else save_annotation
+    skipped = 0
+
+    progress = tqdm(total=len(files), desc=f"Processing files ({backend.name})")
+    for start in range(0, len(files), backend.batch_size):
+        batch = []
+        for file_path in files[start:start + backend.batch_size]:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            cached = cache.get(content) if cache else None
+            if cached is not None:
+                if resume and (sink.has_valid(file_path) if sink else output_is_valid(file_path)):
+                    skipped += 1
+                else:
+                    write(file_path, content, cached)
+                continue
+            batch.append((file_path, content))
+
+        if batch:
+            try:
+                results = backend.annotate_batch([content for _, content in batch])
+            except Exception as e:
+                print(f"批量标注失败: {e}")
+                results = [{"error": f"Unexpected error: {e}", "raw_output": ""} for _ in batch]
+            for (file_path, content), annotations in zip(batch, results):
+                if cache:
+                    cache.put(content, annotations)
+                output_file = write(file_path, content, annotations)
+                print(f"Processed: {file_path} -> {output_file}")
+        progress.update(len(files[start:start + backend.batch_size]))
+    progress.close()
+
+    if cache:
+        print(f"缓存命中: {cache.hits}，未命中: {cache.misses}，跳过: {skipped}")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Annotate GDPR cases with a remote or local backend")
+    parser.add_argument("input_dir")
+    parser.add_argument("--backend", choices=["remote", "local"], default="remote")
+    parser.add_argument("--model-path", default=LOCAL_MODEL_PATH, help="本地模型目录（--backend local）")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--cache-dir", default=None)
+    parser.add_argument("--resume", action="store_true")
+    args = parser.parse_args()
+
+    if args.backend == "local":
+        backend = get_backend("local", model_path=args.model_path, batch_size=args.batch_size)
+    else:
+        backend = get_backend("remote", batch_size=args.batch_size)
+    try:
+        process_cases_with_backend(args.input_dir, backend, cache_dir=args.cache_dir, resume=args.resume)
+    finally:
+        backend.close()
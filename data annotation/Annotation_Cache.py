@@ -0,0 +1,97 @@
+import os
+import json
+import hashlib
+
+from Annotation_Schema import validate_annotation
+
+# 这些错误标记表示标注失败，缓存命中时视为未命中以便重新排队
+ERROR_MARKERS = ("Max retries exceeded", "JSON decode error")
+
+
+def is_valid_annotation(annotations):
+    """Return True if an annotation result is usable (not an error, failed parse or schema violation)"""
+    if not isinstance(annotations, dict) or not annotations:
+        return False
+    if "error" in annotations:
+        return False
+    serialized = json.dumps(annotations, ensure_ascii=False)
+    if any(marker in serialized for marker in ERROR_MARKERS):
+        return False
+    _, errors = validate_annotation(annotations)
+    return not errors
+
+
+class AnnotationCache:
+    """
+    基于内容寻址的持久化标注缓存
+
+    缓存键 = sha256(案例文本 + PROMPT_TEMPLATE + 模型名 + temperature)，
+    因此修改prompt或模型参数后旧缓存自动失效。每个条目存为
+    <cache_dir>/<key[:2]>/<key>.json
+    """
+
+    def __init__(self, cache_dir, prompt_template, model_name, temperature):
+        self.cache_dir = cache_dir
+        self.prompt_template = prompt_template
+        self.model_name = model_name
+        self.temperature = temperature
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, text):
+        """Content hash identifying one (text, prompt, model, temperature) combination"""
+        h = hashlib.sha256()
+        for part in (self.prompt_template, self.model_name, repr(self.temperature), text):
+            h.update(part.encode("utf-8"))
+            h.update(b"\x00")
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, text):
+        """Return the cached annotations for text, or None on a miss or invalid entry"""
+        path = self._path(self.key(text))
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+        annotations = entry.get("annotations")
+        if not is_valid_annotation(annotations):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return annotations
+
+    def put(self, text, annotations):
+        """Store annotations for text; failed annotations are not cached"""
+        if not is_valid_annotation(annotations):
+            return False
+        key = self.key(text)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {
+            "key": key,
+            "model": self.model_name,
+            "temperature": self.temperature,
+            "annotations": annotations
+        }
+        # 先写临时文件再原子替换，进程中断不会留下半个条目
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return True
+
+
+def output_is_valid(file_path):
+    """Check whether the <case>.json next to file_path already holds a valid annotation"""
+    output_file = f"{os.path.splitext(file_path)[0]}.json"
+    try:
+        with open(output_file, 'r', encoding='utf-8') as f:
+            return is_valid_annotation(json.load(f).get("annotations"))
+    except (OSError, json.JSONDecodeError, AttributeError):
+        return False
@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import numpy as np
+
+from Annotation_Cache import is_valid_annotation
+from Annotation_Schema import validate_annotation
+from Annotation_Sink import iter_records
+from Annotation_Telemetry import get_telemetry
+
+# 排序所用的目标：与 FINAL_CODE 中模型预测的任务一致（fine_amount 按是否有罚款二值化）
+SCHEDULE_TARGETS = ["violation_result", "fine_amount"]
+MIN_LABELED = 20          # 已标注样本少于该数量时模型不可靠，保持原有顺序
+MAX_FEATURES = 20000
+MAX_CHARS = 20000         # 每个案例只取前若干字符做特征，控制打分耗时
+
+
+def load_annotated(files, jsonl_path=None):
+    """Collect valid existing annotations for files, from a JsonlSink file or the <case>.json outputs"""
+    annotated = {}
+    if jsonl_path and os.path.exists(jsonl_path):
+        wanted = {os.path.abspath(f): f for f in files}
+        for record in iter_records(jsonl_path):
+            file_path = wanted.get(record.get("source_path"))
+            if file_path and is_valid_annotation(record.get("annotations")):
+                annotated[file_path] = record["annotations"]
+        return annotated
+    for file_path in files:
+        output_file = f"{os.path.splitext(file_path)[0]}.json"
+        try:
+            with open(output_file, 'r', encoding='utf-8') as f:
+                annotations = json.load(f).get("annotations")
+        except (OSError, json.JSONDecodeError, AttributeError):
+            continue
+        if is_valid_annotation(annotations):
+            annotated[file_path] = annotations
+    return annotated
+
+
+def label_value(annotations, field):
+    """Binary training label for one scheduling target (annotations normalised by validate_annotation)"""
+    value = annotations.get(field)
+    if field == "fine_amount":
+        return int(isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0)
+    return 1 if str(value).strip().lower() in ("1", "yes", "true") else 0
+
+
+def _read_head(file_path, max_chars=MAX_CHARS):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return f.read(max_chars)
+
+
+def _entropy(p):
+    p = np.clip(p, 1e-9, 1 - 1e-9)
+    return -(p * np.log2(p) + (1 - p) * np.log2(1 - p))
+
+
+def score_uncertainty(labeled_texts, labels, unlabeled_texts, targets=SCHEDULE_TARGETS, seed=42):
+    """
+    用廉价模型委员会给未标注案例打分，分数越高越值得优先标注
+
+    对每个目标训练 TF-IDF + LogisticRegression（与 final_legalbert_code.py 的基线相同）
+    和 TF-IDF + 决策树（与 Final_DecisionTree.ipynb 同类模型），
+    分数 = 两个模型平均概率的二值熵 + 两个模型概率之差（分歧），再对各目标取平均。
+    只有一个类别的目标无法判断不确定性，跳过。
+    """
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.tree import DecisionTreeClassifier
+
+    vectorizer = TfidfVectorizer(max_features=MAX_FEATURES, sublinear_tf=True, stop_words="english")
+    X_labeled = vectorizer.fit_transform(labeled_texts)
+    X_unlabeled = vectorizer.transform(unlabeled_texts)
+
+    scores = np.zeros(len(unlabeled_texts))
+    used = 0
+    for target in targets:
+        y = np.array([row[target] for row in labels])
+        if len(set(y)) < 2:
+            continue
+        lr = LogisticRegression(max_iter=1000, class_weight="balanced").fit(X_labeled, y)
+        tree = DecisionTreeClassifier(max_depth=8, min_samples_leaf=3, random_state=seed).fit(X_labeled, y)
+        p_lr = lr.predict_proba(X_unlabeled)[:, 1]
+        p_tree = tree.predict_proba(X_unlabeled)[:, 1]
+        scores += _entropy((p_lr + p_tree) / 2) + np.abs(p_lr - p_tree)
+        used += 1
+    return scores / used if used else None
+
+
+def schedule_files(files, annotated=None, jsonl_path=None, targets=SCHEDULE_TARGETS, min_labeled=MIN_LABELED):
+    """
+    按不确定性重新排列待标注案例
+
+    Returns:
+        (排序后的待标注文件列表, {文件: 分数})；已有有效标注的案例不在列表中。
+        已标注样本不足或没有可用目标时保持原顺序，分数为空。
+    """
+    annotated = load_annotated(files, jsonl_path) if annotated is None else annotated
+    pending = [f for f in files if f not in annotated]
+    if len(annotated) < min_labeled or not pending:
+        print(f"已标注 {len(annotated)} 个案例（少于 {min_labeled} 个或无待标注案例），保持原有顺序")
+        return pending, {}
+
+    start_time = time.time()
+    labeled_files = list(annotated)
+    # 旧记录可能是原始输出（如 "200,000" 字符串罚款），先按 schema 规范化再取标签
+    normalised = [validate_annotation(annotated[f])[0] or {} for f in labeled_files]
+    labels = [{t: label_value(record, t) for t in targets} for record in normalised]
+    scores = score_uncertainty([_read_head(f) for f in labeled_files], labels,
+                               [_read_head(f) for f in pending], targets)
+    if scores is None:
+        print("各目标在已标注数据中只有一个类别，保持原有顺序")
+        return pending, {}
+    # 稳定排序：分数相同时保持文件编号顺序
+    order = sorted(range(len(pending)), key=lambda i: -scores[i])
+    print(f"不确定性排序完成: {len(pending)} 个待标注案例，基于 {len(labeled_files)} 个已标注案例，"
+          f"耗时 {time.time() - start_time:.2f}秒")
+    return [pending[i] for i in order], {pending[i]: float(scores[i]) for i in order}
+
+
+class AnnotationBudget:
+    """
+    标注预算：案例数、估算花费（美元，来自 RunTelemetry）或运行时间，任一达到即停止派发新请求
+
+    案例数是硬上限，派发的案例不会超过 max_cases；已在途的请求会正常完成，所以花费和时间可能略超预算。
+    """
+
+    def __init__(self, max_cases=None, max_usd=None, max_seconds=None):
+        self.max_cases = max_cases
+        self.max_usd = max_usd
+        self.max_seconds = max_seconds
+        self.started_at = time.time()
+        self.dispatched = 0
+        self.reason = None
+
+    def _limit_reached(self, include_cases=True):
+        if include_cases and self.max_cases is not None and self.dispatched >= self.max_cases:
+            return f"案例数达到 {self.max_cases}"
+        if self.max_seconds is not None and time.time() - self.started_at >= self.max_seconds:
+            return f"运行时间达到 {self.max_seconds}秒"
+        if self.max_usd is not None:
+            telemetry = get_telemetry()
+            if telemetry and telemetry.cost_usd() >= self.max_usd:
+                return f"估算花费达到 ${self.max_usd}"
+        return None
+
+    def exhausted(self, reserved=False):
+        """
+        True once a limit is reached
+
+        reserved: the caller's cases are already counted (packed fallback requests), so only the
+        cost and time limits apply to them
+        """
+        reason = self._limit_reached(include_cases=not reserved)
+        if reason and not self.reason:
+            self.reason = reason
+            print(f"预算用尽（{self.reason}），停止派发新的标注请求")
+        return reason is not None
+
+    def remaining(self):
+        """Cases that may still be dispatched (None without a case limit)"""
+        return None if self.max_cases is None else max(0, self.max_cases - self.dispatched)
+
+    def take(self, count=1):
+        """Reserve `count` cases; returns False when the budget is exhausted or `count` would exceed max_cases"""
+        if self.exhausted():
+            return False
+        if self.max_cases is not None and self.dispatched + count > self.max_cases:
+            return False
+        self.dispatched += count
+        return True
@@ -0,0 +1,341 @@
+import re
+import json
+import time
+
+# 26 个输出字段的类型定义（顺序与 Dataset/FINAL_dataset.csv 一致）
+FLAG_FIELDS = [
+    "Criminal_investigation_exception", "country_security_exception",
+    "data_category_Basic_personal_data", "data_category_Children_data", "data_category_Criminal_data",
+    "data_category_Financial_location_data", "data_category_Special_category_data",
+    "data_processing_basis_Consent", "data_processing_basis_Legal_obligation",
+    "data_processing_basis_Legitimate_interest", "data_processing_basis_Performance_of_public_task",
+    "data_processing_basis_Protection_of_vital_interests", "data_processing_basis_contract_performance",
+    "free_speech_exception", "violation_nature_Breach_of_Data_processing_principle",
+    "violation_nature_Breach_of_data_security", "violation_nature_Violation_of_Data_processing_obligation",
+    "violation_nature_Violation_of_data_subject_rights", "violation_result"
+]
+FIELD_SCHEMA = {field: "flag" for field in FLAG_FIELDS}
+FIELD_SCHEMA.update({
+    "Affected_data_volume": "volume",
+    "Date": "year",
+    "company_industry": "industry",
+    "country": "text",
+    "fine_amount": "amount",
+    "gdpr_clause": "clauses",
+    "gdpr_conflict": "conflict",
+})
+
+INDUSTRIES = [
+    "Public sector", "Marketing", "Education", "Medical", "Retail", "Human resources",
+    "Security Service", "Leisure", "Social Media", "Individual", "Insurance", "Finance"
+]
+INDUSTRY_ALIASES = {
+    "eduction": "Education", "financial": "Finance", "hr": "Human resources",
+    "security services": "Security Service", "public": "Public sector", "healthcare": "Medical",
+}
+UNSPECIFIED = {"", "unspecific", "unspecified", "not specified", "unknown", "unclear", "n/a", "na", "none", "null"}
+FLAG_VALUES = {"1": 1, "0": 0, "true": 1, "false": 0, "yes": 1, "no": 0}
+
+AMOUNT_PATTERN = re.compile(r'(\d[\d,.\s\']*\d|\d)\s*(million|mio|m|thousand|k|billion|bn)?\b', re.IGNORECASE)
+AMOUNT_UNITS = {"million": 1e6, "mio": 1e6, "m": 1e6, "thousand": 1e3, "k": 1e3, "billion": 1e9, "bn": 1e9}
+YEAR_PATTERN = re.compile(r'\b(19|20)\d{2}\b')
+STRUCTURAL_CHARS = re.compile(r'[{}"\\]')
+
+
+class SchemaError(ValueError):
+    """Raised by a field coercer when a value cannot be normalised"""
+
+
+def parse_amount(value):
+    """Parse a fine/volume value such as "200,000", "EUR 1.5 million" or 9000 into a float, or None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    match = AMOUNT_PATTERN.search(value)
+    if not match:
+        return None
+    number, unit = match.group(1), (match.group(2) or "").lower()
+    number = re.sub(r"[\s']", "", number)
+    if "," in number and "." in number:
+        # 1,000.50 / 1.000,50：两种分隔符同时出现时最后一个是小数点，另一种是千分位
+        decimal = "." if number.rfind(".") > number.rfind(",") else ","
+        number = number.replace("," if decimal == "." else ".", "").replace(decimal, ".")
+    # 1.234.567 / 1,234,567 视为千分位；单个分隔符且后面不是3位时视为小数点
+    elif number.count(",") + number.count(".") > 1 or re.search(r'[.,]\d{3}$', number) and not unit:
+        number = number.replace(",", "").replace(".", "")
+    else:
+        number = number.replace(",", ".")
+    try:
+        amount = float(number)
+    except ValueError:
+        return None
+    return amount * AMOUNT_UNITS.get(unit, 1)
+
+
+def extract_json_object(response):
+    """
+    单遍、括号配平的 JSON 对象提取
+
+    从左到右扫描，跟踪字符串/转义状态和花括号深度；每当一个顶层对象闭合就尝试解析，
+    成功即返回；解析失败或一直未闭合（如前导说明文字里的 '{'）时从下一个 '{' 继续。
+    返回 (dict, None) 或 (None, 错误信息)。
+    """
+    if not isinstance(response, str):
+        return None, "Response is not a string"
+    last_error = "No valid JSON found"
+    pos = response.find('{')
+    while pos >= 0:
+        depth = 0
+        in_string = False
+        skip_until = -1
+        end = -1
+        # 只在结构字符之间跳跃，长字符串值不逐字符扫描
+        for match in STRUCTURAL_CHARS.finditer(response, pos):
+            i = match.start()
+            if i < skip_until:
+                continue
+            ch = response[i]
+            if in_string:
+                if ch == '\\':
+                    skip_until = i + 2
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch == '{':
+                depth += 1
+            elif ch == '}':
+                depth -= 1
+                if depth == 0:
+                    end = i + 1
+                    break
+        if end < 0:
+            # 未闭合：输出被截断，或这个 '{' 只是说明文字的一部分，后面可能还有完整对象
+            if last_error == "No valid JSON found":
+                last_error = "Unterminated JSON object"
+            pos = response.find('{', pos + 1)
+            continue
+        try:
+            obj = json.loads(response[pos:end])
+            if isinstance(obj, dict):
+                return obj, None
+        except json.JSONDecodeError as e:
+            last_error = f"JSON decode error: {e}"
+        pos = response.find('{', pos + 1)
+    return None, last_error
+
+
+def _scalar(value, reduce):
+    """Collapse an array where a scalar is expected"""
+    if isinstance(value, list):
+        values = [v for v in value if v not in (None, "")]
+        if not values:
+            return ""
+        return reduce(values)
+    return value
+
+
+def _coerce_flag(value):
+    if isinstance(value, list):
+        return max((_coerce_flag(v) for v in value), default=0)
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)) and value in (0, 1):
+        return int(value)
+    if isinstance(value, str) and value.strip().lower() in FLAG_VALUES:
+        return FLAG_VALUES[value.strip().lower()]
+    raise SchemaError(f"expected 0/1, got {value!r}")
+
+
+def _coerce_amount(value):
+    amounts = []
+    for item in value if isinstance(value, list) else [value]:
+        if isinstance(item, str) and item.strip().lower() in UNSPECIFIED:
+            continue
+        amount = parse_amount(item)
+        if amount is None:
+            raise SchemaError(f"unparseable amount {item!r}")
+        amounts.append(amount)
+    return int(max(amounts)) if amounts else "Not specified"
+
+
+def _coerce_volume(value):
+    amounts = []
+    for item in value if isinstance(value, list) else [value]:
+        if item is None or isinstance(item, str) and item.strip().lower() in UNSPECIFIED:
+            continue
+        amount = parse_amount(item)
+        # 定性描述（如 "thousands of customers"）无法量化，按 unspecific 处理
+        if amount is not None:
+            amounts.append(amount)
+    return int(max(amounts)) if amounts else "unspecific"
+
+
+def _coerce_year(value):
+    years = [int(m.group()) for v in (value if isinstance(value, list) else [value])
+             for m in [YEAR_PATTERN.search(str(v))] if m]
+    if not years:
+        raise SchemaError(f"no year in {value!r}")
+    return max(years)
+
+
+def _coerce_text(value):
+    value = _scalar(value, lambda values: values[0])
+    if not isinstance(value, str) or not value.strip():
+        raise SchemaError(f"expected non-empty string, got {value!r}")
+    return value.strip()
+
+
+_INDUSTRY_LOOKUP = {name.lower(): name for name in INDUSTRIES}
+_INDUSTRY_LOOKUP.update(INDUSTRY_ALIASES)
+
+
+def _coerce_industry(value):
+    value = _coerce_text(value)
+    key = value.lower()
+    if key in _INDUSTRY_LOOKUP:
+        return _INDUSTRY_LOOKUP[key]
+    # "Medical (hospital)" 这类带说明的输出取括号前的部分
+    key = key.split("(")[0].strip()
+    if key in _INDUSTRY_LOOKUP:
+        return _INDUSTRY_LOOKUP[key]
+    raise SchemaError(f"unknown industry {value!r}")
+
+
+def _coerce_clauses(value):
+    items = value if isinstance(value, list) else [value]
+    clauses = []
+    for item in items:
+        if item is None:
+            continue
+        for clause in str(item).split(","):
+            clause = clause.strip()
+            if clause and clause not in clauses:
+                clauses.append(clause)
+    return ", ".join(clauses)
+
+
+def _coerce_conflict(value):
+    value = _scalar(value, lambda values: "yes" if any(str(v).strip().lower() == "yes" for v in values) else values[0])
+    return "yes" if str(value).strip().lower() in ("yes", "1", "true") else "No conflict"
+
+
+COERCERS = {
+    "flag": _coerce_flag,
+    "amount": _coerce_amount,
+    "volume": _coerce_volume,
+    "year": _coerce_year,
+    "text": _coerce_text,
+    "industry": _coerce_industry,
+    "clauses": _coerce_clauses,
+    "conflict": _coerce_conflict,
+}
+
+
+def compile_schema(schema=FIELD_SCHEMA):
+    """
+    把字段类型表编译成 (字段, 转换函数) 列表，返回一个校验/规范化函数
+
+    返回的函数 validate(obj) -> (record, errors)：record 只包含 schema 中的字段，
+    errors 为空表示有效。
+    """
+    plan = tuple((field, COERCERS[kind]) for field, kind in schema.items())
+
+    def validate(obj):
+        if not isinstance(obj, dict):
+            return None, ["not a JSON object"]
+        record = {}
+        errors = []
+        for field, coerce in plan:
+            if field not in obj:
+                errors.append(f"{field}: missing")
+                continue
+            try:
+                record[field] = coerce(obj[field])
+            except SchemaError as e:
+                errors.append(f"{field}: {e}")
+        return record, errors
+
+    return validate
+
+
+validate_annotation = compile_schema()
+
+
+def parse_annotation(response):
+    """Extract, validate and normalise one annotation from a raw model response"""
+    obj, error = extract_json_object(response)
+    if error:
+        return {"error": error}
+    record, errors = validate_annotation(obj)
+    if errors:
+        return {"error": f"Schema validation failed: {'; '.join(errors[:5])}"}
+    return record
+
+
+def _legacy_extract(response):
+    """The original greedy regex extractor, kept for benchmarking"""
+    try:
+        json_match = re.search(r'\{.*\}', response, re.DOTALL)
+        if json_match:
+            return json.loads(json_match.group())
+        return {"error": "No valid JSON found"}
+    except json.JSONDecodeError as e:
+        return {"error": f"JSON decode error: {e}"}
+
+
+def load_raw_responses(path):
+    """Load recorded raw responses: JSONL lines with a "raw_output"/"raw" field, or plain text per line"""
+    responses = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                responses.append(line)
+                continue
+            if isinstance(record, dict) and ("raw_output" in record or "raw" in record):
+                responses.append(record.get("raw_output") or record.get("raw") or "")
+            else:
+                responses.append(line)
+    return responses
+
+
+def benchmark_extraction(responses, repeat=5):
+    """
+    在记录的原始响应上比较旧提取器与新提取+校验的耗时和通过率
+
+    Returns:
+        {"legacy": {...}, "schema": {...}}，包含每秒处理条数与通过/拒绝数
+    """
+    report = {}
+    for name, func in (("legacy", _legacy_extract), ("schema", parse_annotation)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            results = [func(r) for r in responses]
+        elapsed = (time.perf_counter() - start) / repeat
+        accepted = sum(1 for r in results if "error" not in r)
+        report[name] = {
+            "responses": len(responses),
+            "seconds": elapsed,
+            "per_second": len(responses) / elapsed if elapsed else float("inf"),
+            "accepted": accepted,
+            "rejected": len(responses) - accepted
+        }
+        print(f"{name:>7}: {report[name]['per_second']:.0f} 条/秒，通过 {accepted}，拒绝 {len(responses) - accepted}")
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark JSON extraction on recorded raw responses")
+    parser.add_argument("responses", help="记录的原始响应（JSONL，含 raw_output 字段）")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    benchmark_extraction(load_raw_responses(args.responses), repeat=args.repeat)
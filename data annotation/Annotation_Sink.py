@@ -0,0 +1,202 @@
+import os
+import csv
+import json
+import time
+import threading
+
+from Annotation_Cache import is_valid_annotation
+from Annotation_Schema import validate_annotation
+from Near_Duplicate_Detection import load_groups
+
+# Dataset/FINAL_dataset.csv 的列顺序
+DATASET_COLUMNS = [
+    "Affected_data_volume", "Criminal_investigation_exception", "Date", "company_industry", "country",
+    "country_security_exception", "data_category_Basic_personal_data", "data_category_Children_data",
+    "data_category_Criminal_data", "data_category_Financial_location_data",
+    "data_category_Special_category_data", "data_processing_basis_Consent",
+    "data_processing_basis_Legal_obligation", "data_processing_basis_Legitimate_interest",
+    "data_processing_basis_Performance_of_public_task", "data_processing_basis_Protection_of_vital_interests",
+    "data_processing_basis_contract_performance", "fine_amount", "free_speech_exception", "gdpr_clause",
+    "gdpr_conflict", "violation_nature_Breach_of_Data_processing_principle",
+    "violation_nature_Breach_of_data_security", "violation_nature_Violation_of_Data_processing_obligation",
+    "violation_nature_Violation_of_data_subject_rights", "violation_result"
+]
+
+
+class JsonlSink:
+    """
+    追加写入的单一 JSONL 标注文件，代替每个案例一个 JSON 文件
+
+    行缓冲 + 线程锁，每完成一个案例立即落盘一行；打开时读取已有记录，
+    供 resume 判断哪些案例已有有效结果。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._valid = set()
+        if os.path.exists(path):
+            for record in iter_records(path):
+                if is_valid_annotation(record.get("annotations")):
+                    self._valid.add(record.get("source_path"))
+        self._file = open(path, 'a', encoding='utf-8', buffering=1)
+
+    def has_valid(self, file_path):
+        return os.path.abspath(file_path) in self._valid
+
+    def write(self, file_path, content, annotations):
+        """Append one annotation record; same signature as save_annotation"""
+        record = {
+            "source_file": os.path.basename(file_path),
+            "source_path": os.path.abspath(file_path),
+            "text_length": len(content),
+            "annotated_at": time.time(),
+            "annotations": annotations
+        }
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            if is_valid_annotation(annotations):
+                self._valid.add(record["source_path"])
+        return self.path
+
+    def close(self):
+        self._file.close()
+
+
+def iter_records(path, offset=0):
+    """Yield records from a JSONL file starting at a byte offset; a trailing partial line is ignored"""
+    for record, _ in _iter_lines(path, offset):
+        yield record
+
+
+def _iter_lines(path, offset):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                # 写入中的半行，留到下次导出
+                break
+            offset += len(raw)
+            try:
+                yield json.loads(raw), offset
+            except json.JSONDecodeError:
+                yield {}, offset
+
+
+def normalise_row(annotations):
+    """Flatten one annotation dict into a FINAL_dataset.csv row (None if it fails the schema)"""
+    record, errors = validate_annotation(annotations)
+    if errors:
+        return None
+    row = {column: record[column] for column in DATASET_COLUMNS}
+    # 训练表中罚款为整数；"Not specified" 记为 NaN（未知），不与"无罚款"(0) 混淆
+    if not isinstance(row["fine_amount"], int):
+        row["fine_amount"] = float("nan")
+    row["Affected_data_volume"] = str(row["Affected_data_volume"])
+    return row
+
+
+def _load_state(state_path):
+    if os.path.exists(state_path):
+        with open(state_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {"jsonl_offset": 0, "exported": [], "parquet_parts": 0}
+
+
+def _save_state(state_path, state):
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path)
+
+
+def export_dataset(jsonl_path, csv_path, parquet_dir=None, state_path=None, rebuild=False, groups_file=None):
+    """
+    增量导出：把 JSONL 中新增的有效标注规范化后追加到训练表
+
+    Args:
+        jsonl_path: JsonlSink 写入的标注文件
+        csv_path: 目标 CSV（列与 FINAL_dataset.csv 一致），不存在时自动写表头
+        parquet_dir: 可选，Parquet 数据集目录；每次导出追加一个 part 文件
+        state_path: 导出进度文件，默认 <csv_path>.state.json
+        rebuild: 为True时忽略进度，从头重建
+        groups_file: 可选，Near_Duplicate_Detection.save_groups 导出的分组键；提供时追加
+            case_group 列（同一张表应始终带或始终不带该列）
+
+    同一案例有多条记录时以最后一条为准：已导出的案例被重新标注时，表格按整个 JSONL 重建
+    （行的位置保持该案例第一次出现的位置）。
+
+    Returns:
+        本次追加（重建时为写入）的行数
+    """
+    state_path = state_path or f"{csv_path}.state.json"
+    if rebuild:
+        state = {"jsonl_offset": 0, "exported": [], "parquet_parts": 0}
+        if os.path.exists(csv_path):
+            os.remove(csv_path)
+        if parquet_dir and os.path.isdir(parquet_dir):
+            for name in os.listdir(parquet_dir):
+                if name.startswith("part-") and name.endswith(".parquet"):
+                    os.remove(os.path.join(parquet_dir, name))
+    else:
+        state = _load_state(state_path)
+    exported = set(state["exported"])
+    groups = load_groups(groups_file) if groups_file else None
+    columns = DATASET_COLUMNS + ["case_group"] if groups is not None else DATASET_COLUMNS
+
+    rows = []
+    offset = state["jsonl_offset"]
+    latest = {}
+    for record, offset in _iter_lines(jsonl_path, offset):
+        annotations = record.get("annotations")
+        source = record.get("source_path") or record.get("source_file")
+        if not is_valid_annotation(annotations):
+            continue
+        # 重复标注的案例以最后一次为准
+        latest[source] = annotations
+    updated = exported.intersection(latest)
+    if updated:
+        # 追加写入无法替换已导出的行，按整个 JSONL 重建
+        print(f"{len(updated)} 个已导出案例被重新标注，重建训练表")
+        return export_dataset(jsonl_path, csv_path, parquet_dir, state_path, rebuild=True, groups_file=groups_file)
+    for source, annotations in latest.items():
+        row = normalise_row(annotations)
+        if row is not None:
+            if groups is not None:
+                row["case_group"] = groups.get(source, os.path.basename(source))
+            rows.append(row)
+            exported.add(source)
+
+    if rows:
+        write_header = not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0
+        with open(csv_path, 'a', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            if write_header:
+                writer.writeheader()
+            writer.writerows(rows)
+
+        if parquet_dir:
+            import pandas as pd
+            os.makedirs(parquet_dir, exist_ok=True)
+            state["parquet_parts"] += 1
+            part = os.path.join(parquet_dir, f"part-{state['parquet_parts']:05d}.parquet")
+            pd.DataFrame(rows, columns=columns).to_parquet(part, index=False)
+
+    state["jsonl_offset"] = offset
+    state["exported"] = sorted(exported)
+    _save_state(state_path, state)
+    print(f"导出完成: 新增 {len(rows)} 行 -> {csv_path}")
+    return len(rows)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Incrementally export JSONL annotations to the training table")
+    parser.add_argument("jsonl_path")
+    parser.add_argument("csv_path")
+    parser.add_argument("--parquet-dir", default=None)
+    parser.add_argument("--rebuild", action="store_true")
+    parser.add_argument("--groups", default=None, help="近重复分组键 CSV，追加 case_group 列")
+    args = parser.parse_args()
+    export_dataset(args.jsonl_path, args.csv_path, args.parquet_dir, rebuild=args.rebuild, groups_file=args.groups)
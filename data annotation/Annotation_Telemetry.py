@@ -0,0 +1,182 @@
+import json
+import math
+import time
+import threading
+from collections import Counter
+
+# deepseek-chat 标准价（美元 / 百万 token），用于成本估算，价格变动时修改
+PRICE_PER_M_INPUT = 0.27
+PRICE_PER_M_OUTPUT = 1.10
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+
+
+def set_telemetry(telemetry):
+    """Install the process-wide recorder used by annotate_text (None disables recording)"""
+    global _telemetry
+    with _telemetry_lock:
+        _telemetry = telemetry
+
+
+def get_telemetry():
+    return _telemetry
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers (None if empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    # 先乘后除：q / 100 * n 的浮点误差会让 ceil 多进一位（如 7 / 100 * 100 = 7.000000000000001）
+    rank = max(1, math.ceil(q * len(ordered) / 100.0))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class RunTelemetry:
+    """
+    标注运行的结构化指标
+
+    每次 HTTP 尝试记一条 "request"（延迟、状态码、usage token、重试序号、解析结果），
+    每次 annotate_text 调用结束记一条 "call"（最终结果、重试次数、总耗时）。
+    记录逐行写入 metrics_path（JSONL），summary() 汇总延迟分位数、吞吐、成本、
+    失败分类和预计剩余时间。
+    """
+
+    def __init__(self, metrics_path=None, price_input=PRICE_PER_M_INPUT, price_output=PRICE_PER_M_OUTPUT):
+        self.metrics_path = metrics_path
+        self.price_input = price_input
+        self.price_output = price_output
+        self.requests = []
+        self.calls = []
+        self.limiter_wait = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._file = open(metrics_path, 'a', encoding='utf-8', buffering=1) if metrics_path else None
+
+    def _write(self, record):
+        if self._file:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def record_request(self, latency, status, outcome, attempt, usage=None, text_chars=0):
+        """One HTTP attempt; outcome is ok / parse_error / rate_limited / server_error / http_error / ..."""
+        usage = usage or {}
+        record = {
+            "kind": "request",
+            "ts": time.time(),
+            "attempt": attempt,
+            "status": status,
+            "latency": round(latency, 4),
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+            "outcome": outcome,
+            "text_chars": text_chars
+        }
+        with self._lock:
+            self.requests.append(record)
+            self.prompt_tokens += record["prompt_tokens"]
+            self.completion_tokens += record["completion_tokens"]
+            self._write(record)
+
+    def record_call(self, outcome, retries, latency, text_chars=0):
+        """Final result of one annotate_text call"""
+        record = {
+            "kind": "call",
+            "ts": time.time(),
+            "outcome": outcome,
+            "retries": retries,
+            "latency": round(latency, 4),
+            "text_chars": text_chars
+        }
+        with self._lock:
+            self.calls.append(record)
+            self._write(record)
+
+    def cost_usd(self):
+        """Estimated spend so far (running total, cheap enough to poll per request)"""
+        return self.prompt_tokens / 1e6 * self.price_input + self.completion_tokens / 1e6 * self.price_output
+
+    def record_limiter_wait(self, seconds):
+        with self._lock:
+            self.limiter_wait += seconds
+
+    def summary(self, done_cases=None, total_cases=None, corpus_cases=None):
+        """
+        汇总本次运行
+
+        Args:
+            done_cases: 本次已完成的案例数（默认按 call 数计）
+            total_cases: 本次计划处理的案例数，用于计算剩余时间
+            corpus_cases: 可选，整个语料的案例数，按当前吞吐与单案例成本外推
+        """
+        with self._lock:
+            requests_ = list(self.requests)
+            calls = list(self.calls)
+            limiter_wait = self.limiter_wait
+        wall = max(time.time() - self.started_at, 1e-9)
+        latencies = [r["latency"] for r in requests_]
+        prompt_tokens = sum(r["prompt_tokens"] for r in requests_)
+        completion_tokens = sum(r["completion_tokens"] for r in requests_)
+        cost = prompt_tokens / 1e6 * self.price_input + completion_tokens / 1e6 * self.price_output
+        done_cases = len(calls) if done_cases is None else done_cases
+        cases_per_sec = done_cases / wall
+
+        summary = {
+            "wall_seconds": round(wall, 2),
+            "requests": len(requests_),
+            "calls": len(calls),
+            "retries": sum(c["retries"] for c in calls),
+            "latency_p50": percentile(latencies, 50),
+            "latency_p95": percentile(latencies, 95),
+            "latency_p99": percentile(latencies, 99),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "tokens_per_sec": round((prompt_tokens + completion_tokens) / wall, 1),
+            "requests_per_min": round(len(requests_) / wall * 60, 1),
+            "limiter_wait_seconds": round(limiter_wait, 2),
+            "cost_usd": round(cost, 4),
+            "request_outcomes": dict(Counter(r["outcome"] for r in requests_)),
+            "call_failures": dict(Counter(c["outcome"] for c in calls if c["outcome"] != "ok")),
+            "done_cases": done_cases,
+            "cases_per_sec": round(cases_per_sec, 3)
+        }
+        if total_cases is not None and cases_per_sec > 0:
+            summary["eta_seconds"] = round(max(total_cases - done_cases, 0) / cases_per_sec, 1)
+        if corpus_cases and done_cases:
+            summary["corpus_cases"] = corpus_cases
+            summary["corpus_seconds"] = round(corpus_cases / cases_per_sec, 1) if cases_per_sec else None
+            summary["corpus_cost_usd"] = round(cost / done_cases * corpus_cases, 2)
+        return summary
+
+    def report(self, done_cases=None, total_cases=None, corpus_cases=None):
+        """Print the end-of-run summary and append it to the metrics file"""
+        summary = self.summary(done_cases, total_cases, corpus_cases)
+
+        def fmt(value):
+            return "-" if value is None else f"{value:.2f}s"
+
+        print("===== 标注运行统计 =====")
+        print(f"请求: {summary['requests']}，调用: {summary['calls']}，重试: {summary['retries']}，"
+              f"总耗时: {summary['wall_seconds']:.1f}秒")
+        print(f"延迟 p50/p95/p99: {fmt(summary['latency_p50'])} / {fmt(summary['latency_p95'])} / "
+              f"{fmt(summary['latency_p99'])}")
+        print(f"token: 输入 {summary['prompt_tokens']}，输出 {summary['completion_tokens']}，"
+              f"{summary['tokens_per_sec']} tokens/秒，{summary['requests_per_min']} 请求/分钟")
+        print(f"限流等待: {summary['limiter_wait_seconds']}秒，估算成本: ${summary['cost_usd']}")
+        print(f"请求结果: {summary['request_outcomes']}")
+        if summary["call_failures"]:
+            print(f"失败分类: {summary['call_failures']}")
+        if "eta_seconds" in summary:
+            print(f"剩余 {max(total_cases - summary['done_cases'], 0)} 个案例，预计还需 {summary['eta_seconds']:.0f}秒")
+        if "corpus_cost_usd" in summary:
+            print(f"外推到 {corpus_cases} 个案例: 约 {summary['corpus_seconds']}秒，${summary['corpus_cost_usd']}")
+        with self._lock:
+            self._write(dict(summary, kind="summary", ts=time.time()))
+        return summary
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,115 @@
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 需要重试的状态码：限流与服务端临时错误
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# 表示服务商已饱和的状态码，会计入熔断器
+SATURATION_STATUS_CODES = {429, 503}
+
+MAX_BACKOFF = 60          # 秒，单次退避上限
+DEFAULT_POOL_SIZE = 16    # 长连接池大小
+
+_session = None
+_session_pool_size = 0
+_session_lock = threading.Lock()
+
+
+def get_session(pool_size=None):
+    """
+    返回进程内共享的 keep-alive Session
+
+    Args:
+        pool_size: 连接池大小；大于当前池时会重建 Session（例如并发数调大后）
+    """
+    global _session, _session_pool_size
+    pool_size = pool_size or DEFAULT_POOL_SIZE
+    with _session_lock:
+        if _session is None or pool_size > _session_pool_size:
+            if _session is not None:
+                _session.close()
+            session = requests.Session()
+            # 重试由调用方控制（需要区分Retry-After和熔断），这里不让urllib3自动重试
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+            _session_pool_size = pool_size
+        return _session
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header (delta-seconds or HTTP date) into seconds, or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def compute_backoff(retry_count, base_delay, retry_after=None, max_backoff=MAX_BACKOFF):
+    """
+    计算重试等待时间
+
+    服务端给出 Retry-After 时以其为准（再加少量抖动避免同时醒来）；
+    否则使用 full-jitter 指数退避: uniform(0, min(max_backoff, base_delay * 2**retry_count))
+    """
+    if retry_after is not None:
+        return min(retry_after, max_backoff) + random.uniform(0, 1)
+    return random.uniform(0, min(max_backoff, base_delay * (2 ** retry_count)))
+
+
+class CircuitBreaker:
+    """
+    服务商饱和时暂停整个运行的熔断器
+
+    连续 threshold 次饱和信号（429/503/超时）后打开 cooldown 秒，期间所有线程
+    在发送请求前阻塞；服务端返回 Retry-After 时也会让所有线程一起等待。
+    任意一次成功都会清零失败计数。
+    """
+
+    def __init__(self, threshold=5, cooldown=30):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.trips = 0
+        self._failures = 0
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block while the breaker is open"""
+        while True:
+            with self._lock:
+                remaining = self._open_until - time.monotonic()
+            if remaining <= 0:
+                return
+            print(f"熔断器开启，暂停 {remaining:.1f} 秒...")
+            time.sleep(remaining)
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+
+    def record_failure(self, retry_after=None):
+        """Count one saturation signal, opening the breaker if needed"""
+        with self._lock:
+            now = time.monotonic()
+            self._failures += 1
+            pause = retry_after or 0.0
+            if self._failures >= self.threshold:
+                pause = max(pause, self.cooldown)
+                self._failures = 0
+                self.trips += 1
+                print(f"连续 {self.threshold} 次饱和信号，熔断 {pause:.1f} 秒")
+            if pause:
+                self._open_until = max(self._open_until, now + pause)
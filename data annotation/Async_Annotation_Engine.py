@@ -0,0 +1,402 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+
+from LLM_Assisted_Dataset_Annotations import (
+    PROMPT_TEMPLATE, MAX_TOKENS,
+    annotate_text, list_case_files, save_annotation, open_cache
+)
+from Annotation_Cache import output_is_valid
+from Api_Client import get_session
+from Chunked_Annotation import split_into_sections, merge_chunk_results
+from Relevance_Filter import DEFAULT_KEEP_RATIO, RelevanceFilter, agreement_check
+from Packed_Annotation import pack_files, packed_request_tokens, request_packed
+from Annotation_Sink import JsonlSink, export_dataset
+from Annotation_Telemetry import RunTelemetry, get_telemetry, set_telemetry
+from Near_Duplicate_Detection import find_duplicate_groups, save_groups, propagate_annotations
+from Annotation_Scheduler import AnnotationBudget, schedule_files
+
+# 并发与限流默认配置
+DEFAULT_CONCURRENCY = 8
+DEFAULT_RPM = 60         # 每分钟请求数
+DEFAULT_TPM = 300000     # 每分钟token数
+
+
+def estimate_tokens(text):
+    """Rough token estimate (about 4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+class AsyncRateLimiter:
+    """Global token-bucket limiter for requests-per-minute and tokens-per-minute"""
+
+    def __init__(self, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm) if rpm else 0.0
+        self._tokens = float(tpm) if tpm else 0.0
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last
+        self._last = now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60.0)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60.0)
+
+    async def acquire(self, tokens=0):
+        """Wait until one request and `tokens` tokens fit in the budget"""
+        if self.tpm:
+            # 单个请求超过整个TPM预算时按预算上限计，避免永远等待
+            tokens = min(tokens, self.tpm)
+        # 持锁等待，保证先到先得
+        async with self._lock:
+            while True:
+                self._refill()
+                wait = 0.0
+                if self.rpm and self._requests < 1:
+                    wait = max(wait, (1 - self._requests) * 60.0 / self.rpm)
+                if self.tpm and self._tokens < tokens:
+                    wait = max(wait, (tokens - self._tokens) * 60.0 / self.tpm)
+                if wait <= 0:
+                    if self.rpm:
+                        self._requests -= 1
+                    if self.tpm:
+                        self._tokens -= tokens
+                    return
+                await asyncio.sleep(wait)
+
+
+class AsyncAnnotationEngine:
+    """Keep up to `concurrency` annotation requests in flight and save results as they finish"""
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM,
+                 api_url=None, annotate_fn=annotate_text, cache=None, resume=False, chunk_chars=None,
+                 relevance_filter=None, pack_budget=None, sink=None, budget=None):
+        self.concurrency = concurrency
+        self.rpm = rpm
+        self.tpm = tpm
+        self.api_url = api_url
+        self.annotate_fn = annotate_fn
+        self.cache = cache
+        self.resume = resume
+        self.chunk_chars = chunk_chars
+        self.relevance_filter = relevance_filter
+        self.pack_budget = pack_budget  # 打包模式下每个请求的案例token预算
+        self.sink = sink                # 可选 JsonlSink；为空时逐案例写 <case>.json
+        self.budget = budget            # 可选 AnnotationBudget；用尽后不再派发新案例
+        self.skipped = 0
+        self.over_budget = 0
+        # annotate_text 是阻塞调用，放到专用线程池里执行
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        # 连接池至少容纳所有在途请求，避免连接被丢弃后重新握手
+        get_session(pool_size=concurrency)
+
+    def request_tokens(self, text):
+        """Token budget charged to the limiter for one request (prompt + completion)"""
+        return estimate_tokens(PROMPT_TEMPLATE) + estimate_tokens(text) + MAX_TOKENS
+
+    async def _run_blocking(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def _annotate_request(self, text):
+        async with self._semaphore:
+            await self._acquire(self.request_tokens(text))
+            return await self._run_blocking(self.annotate_fn, text, self.api_url)
+
+    async def _acquire(self, tokens):
+        """Wait for the rate limiter, recording the wait time when telemetry is active"""
+        start = time.monotonic()
+        await self._limiter.acquire(tokens)
+        telemetry = get_telemetry()
+        if telemetry:
+            telemetry.record_limiter_wait(time.monotonic() - start)
+
+    async def annotate(self, text):
+        """Annotate one text under the concurrency and rate limits"""
+        if not self.chunk_chars or len(text) <= self.chunk_chars:
+            return await self._annotate_request(text)
+        # 长案例：每个分块作为独立请求进入并发/限流队列，全部完成后合并
+        chunks = split_into_sections(text, self.chunk_chars)
+        results = await asyncio.gather(*(self._annotate_request(chunk) for chunk in chunks))
+        return merge_chunk_results(list(results))
+
+    async def _annotate_within_budget(self, text, cases=1, reserved=False):
+        """
+        Annotate one case (or pack) unless the budget is exhausted; returns None when skipped
+
+        reserved: 案例已计入预算（打包请求及其回退的单案例请求），只检查花费/时间预算是否用尽
+        """
+        if not self.budget:
+            return await self.annotate(text)
+        # 案例级闸门：在真正开始请求前才检查预算，使花费/时间预算按完成情况生效
+        async with self._gate:
+            if self.budget.exhausted(reserved=True) if reserved else not self.budget.take(cases):
+                self.over_budget += cases
+                return None
+            return await self.annotate(text)
+
+    async def _load(self, file_path):
+        """Read one case, apply the relevance filter and look it up in the cache"""
+        content = await self._run_blocking(_read_text, file_path)
+        text = content
+        if self.relevance_filter:
+            text = await self._run_blocking(self.relevance_filter.filter, content, file_path)
+        cached = None
+        if self.cache:
+            cached = await self._run_blocking(self.cache.get, text)
+        return content, text, cached
+
+    async def _finish(self, file_path, content, text, annotations, from_cache=False):
+        if from_cache and self.resume:
+            done = self.sink.has_valid(file_path) if self.sink else output_is_valid(file_path)
+            if done:
+                self.skipped += 1
+                return file_path, None, annotations
+        if self.cache and not from_cache:
+            await self._run_blocking(self.cache.put, text, annotations)
+        write = self.sink.write if self.sink else save_annotation
+        output_file = await self._run_blocking(write, file_path, content, annotations)
+        return file_path, output_file, annotations
+
+    async def _process_file(self, file_path):
+        content, text, cached = await self._load(file_path)
+        if cached is not None:
+            return [await self._finish(file_path, content, text, cached, from_cache=True)]
+        annotations = await self._annotate_within_budget(text)
+        if annotations is None:
+            return [(file_path, None, None)]
+        return [await self._finish(file_path, content, text, annotations)]
+
+    async def _process_pack(self, file_paths):
+        """Annotate several short cases with one packed request, falling back to single requests"""
+        loaded = await asyncio.gather(*(self._load(f) for f in file_paths))
+        results = []
+        pending = []
+        for file_path, (content, text, cached) in zip(file_paths, loaded):
+            if cached is not None:
+                results.append(await self._finish(file_path, content, text, cached, from_cache=True))
+            else:
+                pending.append((file_path, content, text))
+        if self.budget:
+            async with self._gate:
+                allowed = 0 if self.budget.exhausted() else self.budget.remaining()
+                if allowed is not None and allowed < len(pending):
+                    # 只派发剩余案例额度内的部分，其余留待下次运行
+                    self.over_budget += len(pending) - allowed
+                    results += [(file_path, None, None) for file_path, _, _ in pending[allowed:]]
+                    pending = pending[:allowed]
+                if pending:
+                    self.budget.take(len(pending))
+        if not pending:
+            return results
+        if len(pending) == 1:
+            file_path, content, text = pending[0]
+            annotations = await self._annotate_within_budget(text, reserved=True)
+            if annotations is None:
+                return results + [(file_path, None, None)]
+            results.append(await self._finish(file_path, content, text, annotations))
+            return results
+
+        # 包内用序号作为 case_id，避免文件名冲突
+        items = [(str(i + 1), text) for i, (_, _, text) in enumerate(pending)]
+        async with self._semaphore:
+            await self._acquire(packed_request_tokens(items))
+            fanned = await self._run_blocking(request_packed, items, self.api_url, self.annotate_fn)
+
+        missing = [i for i, (case_id, _) in enumerate(items) if fanned[case_id] is None]
+        if missing:
+            print(f"打包结果中 {len(missing)}/{len(items)} 个案例无效，回退为单案例请求")
+            # 回退请求同样受预算约束：打包请求之后花费/时间预算可能已经用尽
+            retried = await asyncio.gather(*(self._annotate_within_budget(pending[i][2], reserved=True)
+                                             for i in missing))
+            for i, annotations in zip(missing, retried):
+                fanned[items[i][0]] = annotations
+
+        for (case_id, _), (file_path, content, text) in zip(items, pending):
+            if fanned[case_id] is None:
+                results.append((file_path, None, None))
+                continue
+            results.append(await self._finish(file_path, content, text, fanned[case_id]))
+        return results
+
+    async def run(self, files):
+        """Annotate all files; returns a list of (file_path, output_file, annotations)"""
+        # 信号量和限流器需在事件循环内创建
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._limiter = AsyncRateLimiter(self.rpm, self.tpm)
+        self._gate = asyncio.Semaphore(self.concurrency)
+
+        if self.pack_budget:
+            batches = pack_files(files, token_budget=self.pack_budget)
+            tasks = [asyncio.ensure_future(self._process_pack(batch) if len(batch) > 1
+                                           else self._process_file(batch[0])) for batch in batches]
+        else:
+            tasks = [asyncio.ensure_future(self._process_file(f)) for f in files]
+
+        results = []
+        progress = tqdm(total=len(files), desc="Processing files")
+        try:
+            for future in asyncio.as_completed(tasks):
+                try:
+                    batch_results = await future
+                except Exception as e:
+                    print(f"Error processing file: {e}")
+                    continue
+                for file_path, output_file, annotations in batch_results:
+                    results.append((file_path, output_file, annotations))
+                    if output_file:
+                        print(f"Processed: {file_path} -> {output_file}")
+                progress.update(len(batch_results))
+        finally:
+            progress.close()
+            for task in tasks:
+                task.cancel()
+        return results
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+def _read_text(file_path):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def process_cases_async(input_dir, concurrency=DEFAULT_CONCURRENCY, rpm=DEFAULT_RPM,
+                        tpm=DEFAULT_TPM, api_url=None, cache_dir=None, resume=False, chunk_chars=None,
+                        relevance_filter=None, filter_stats_file=None, pack_budget=None, jsonl_path=None,
+                        metrics_path=None, corpus_cases=None, dedupe_threshold=None, groups_file=None,
+                        schedule=False, budget_cases=None, budget_usd=None, budget_seconds=None):
+    """
+    Concurrent counterpart of process_cases
+
+    metrics_path: 可选，逐请求指标（JSONL）输出文件；结束时打印并追加运行汇总
+    corpus_cases: 可选，整个语料的案例数，用于外推总耗时和成本
+    dedupe_threshold: 可选，MinHash 相似度阈值；近重复案例只标注组代表，结果复制给组内其他案例
+    groups_file: 可选，导出分组键 CSV（用于按组交叉验证）
+    schedule: 为True时只处理尚无有效标注的案例，并按廉价模型的不确定性/分歧从高到低排序
+    budget_cases / budget_usd / budget_seconds: 可选预算，任一达到即停止派发新案例
+    """
+    if not os.path.isdir(input_dir):
+        print("Error: Input path is not a directory or does not exist.")
+        return []
+
+    files = list_case_files(input_dir)
+    groups = None
+    if dedupe_threshold:
+        groups = find_duplicate_groups(files, threshold=dedupe_threshold)
+        if groups_file:
+            save_groups(groups, groups_file)
+        all_files = files
+        files = [f for f in files if groups[f] == f]
+    if schedule:
+        files, _ = schedule_files(files, jsonl_path=jsonl_path)
+    budget = None
+    if budget_cases is not None or budget_usd is not None or budget_seconds is not None:
+        budget = AnnotationBudget(budget_cases, budget_usd, budget_seconds)
+    cache = open_cache(cache_dir) if cache_dir else None
+    sink = JsonlSink(jsonl_path) if jsonl_path else None
+    engine = AsyncAnnotationEngine(concurrency=concurrency, rpm=rpm, tpm=tpm, api_url=api_url,
+                                   cache=cache, resume=resume, chunk_chars=chunk_chars,
+                                   relevance_filter=relevance_filter, pack_budget=pack_budget, sink=sink,
+                                   budget=budget)
+    # 花费预算需要 token 统计，即使不写指标文件也要记录
+    telemetry = RunTelemetry(metrics_path) if metrics_path or budget_usd is not None else None
+    set_telemetry(telemetry)
+    start_time = time.time()
+    results = []
+    try:
+        results = asyncio.run(engine.run(files))
+        if groups:
+            # resume 跳过的代表（output_file 为 None）上次已复制过
+            written = {file_path: annotations for file_path, output_file, annotations in results if output_file}
+            propagate_annotations(groups, written, sink.write if sink else save_annotation)
+    finally:
+        engine.close()
+        if sink:
+            sink.close()
+        if telemetry:
+            telemetry.report(done_cases=len(results) - engine.over_budget, total_cases=len(files),
+                             corpus_cases=corpus_cases)
+            telemetry.close()
+            set_telemetry(None)
+    print(f"完成 {len(results) - engine.over_budget}/{len(files)} 个文件，总耗时: {time.time() - start_time:.2f}秒")
+    if groups:
+        print(f"近重复去重: 实际标注 {len(files)}/{len(all_files)} 个案例")
+    if budget and engine.over_budget:
+        print(f"预算用尽（{budget.reason}），{engine.over_budget} 个案例未标注，留待下次运行")
+    if cache:
+        print(f"缓存命中: {cache.hits}，未命中: {cache.misses}，跳过: {engine.skipped}")
+    if relevance_filter:
+        relevance_filter.report(filter_stats_file)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent GDPR case annotation")
+    parser.add_argument("input_dir", help="目录，包含待标注的 .txt 案例")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--rpm", type=int, default=DEFAULT_RPM)
+    parser.add_argument("--tpm", type=int, default=DEFAULT_TPM)
+    parser.add_argument("--api-url", default=None, help="覆盖 DEEPSEEK_API_URL")
+    parser.add_argument("--cache-dir", default=None, help="持久化标注缓存目录")
+    parser.add_argument("--resume", action="store_true", help="跳过已有有效缓存的案例")
+    parser.add_argument("--chunk-chars", type=int, default=None, help="超过该长度的案例切分后并行标注")
+    parser.add_argument("--prefilter", action="store_true", help="只把相关段落送入prompt")
+    parser.add_argument("--keep-ratio", type=float, default=DEFAULT_KEEP_RATIO, help="过滤后保留的字符比例")
+    parser.add_argument("--filter-stats", default=None, help="逐案例token缩减统计输出（JSONL）")
+    parser.add_argument("--agreement-sample", type=int, default=0,
+                        help="在N个抽样案例上比较全文与过滤后标注的一致性后退出")
+    parser.add_argument("--pack-budget", type=int, default=None,
+                        help="把多个短案例打包进一个请求，每个请求的案例token预算（如12000）")
+    parser.add_argument("--jsonl", default=None, help="把结果追加到单一JSONL文件，而不是逐案例写JSON")
+    parser.add_argument("--export-csv", default=None, help="运行结束后把JSONL中的新结果增量追加到该CSV")
+    parser.add_argument("--export-parquet", default=None, help="同时追加到该Parquet数据集目录")
+    parser.add_argument("--metrics", default=None, help="逐请求指标输出文件（JSONL），结束时打印运行汇总")
+    parser.add_argument("--corpus-cases", type=int, default=None, help="按本次吞吐和成本外推到该案例数")
+    parser.add_argument("--dedupe", type=float, default=None, metavar="THRESHOLD",
+                        help="近重复案例只标注一个代表（MinHash 相似度阈值，如0.8）")
+    parser.add_argument("--groups-out", default=None, help="导出近重复分组键 CSV")
+    parser.add_argument("--schedule", action="store_true", help="按模型不确定性排序，只标注尚无有效结果的案例")
+    parser.add_argument("--budget-cases", type=int, default=None, help="本次最多标注的案例数")
+    parser.add_argument("--budget-usd", type=float, default=None, help="估算花费达到该金额后停止")
+    parser.add_argument("--budget-seconds", type=float, default=None, help="运行时间达到该秒数后停止")
+    parser.add_argument("--stub", action="store_true", help="使用本地桩服务器代替真实API")
+    args = parser.parse_args()
+
+    print("Python版本:", sys.version)
+    server = None
+    if args.stub:
+        from Stub_Chat_Server import start_stub_server
+        server, args.api_url = start_stub_server(delay=0.5)
+        print(f"使用本地桩服务器: {args.api_url}")
+
+    relevance_filter = RelevanceFilter(PROMPT_TEMPLATE, keep_ratio=args.keep_ratio) if args.prefilter else None
+    try:
+        if args.agreement_sample:
+            agreement_check(list_case_files(args.input_dir),
+                            relevance_filter or RelevanceFilter(PROMPT_TEMPLATE, keep_ratio=args.keep_ratio),
+                            lambda text: annotate_text(text, args.api_url), sample_size=args.agreement_sample)
+        else:
+            process_cases_async(args.input_dir, args.concurrency, args.rpm, args.tpm, args.api_url,
+                                cache_dir=args.cache_dir, resume=args.resume, chunk_chars=args.chunk_chars,
+                                relevance_filter=relevance_filter, filter_stats_file=args.filter_stats,
+                                pack_budget=args.pack_budget, jsonl_path=args.jsonl,
+                                metrics_path=args.metrics, corpus_cases=args.corpus_cases,
+                                dedupe_threshold=args.dedupe, groups_file=args.groups_out,
+                                schedule=args.schedule, budget_cases=args.budget_cases,
+                                budget_usd=args.budget_usd, budget_seconds=args.budget_seconds)
+            if args.jsonl and args.export_csv:
+                export_dataset(args.jsonl, args.export_csv, args.export_parquet, groups_file=args.groups_out)
+    finally:
+        if server:
+            server.shutdown()
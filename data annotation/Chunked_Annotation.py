@@ -0,0 +1,207 @@
+import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from Annotation_Schema import parse_amount, YEAR_PATTERN
+
+# 超过该长度（字符）的案例按章节切分后分别标注，约等于10k tokens
+CHUNK_CHAR_LIMIT = 40000
+CHUNK_WORKERS = 4
+
+# 各字段的合并规则
+BINARY_FIELD_PREFIXES = ("data_category_", "data_processing_basis_", "violation_nature_")
+BINARY_FIELDS = {
+    "free_speech_exception", "country_security_exception",
+    "Criminal_investigation_exception", "violation_result"
+}
+
+# 章节标题：编号（1. / 1.2 / IV. / (a)）、Article/Section/§、全大写标题行
+SECTION_HEADING = re.compile(
+    r'^\s*(?:'
+    r'(?:\d+(?:\.\d+)*|[IVXLC]+)[.)]\s'
+    r'|\([a-z0-9]+\)\s'
+    r'|(?:Article|Art\.|Section|Chapter|Part)\s+\d'
+    r'|§\s*\d'
+    r'|[A-Z][A-Z \-]{3,}$'
+    r')'
+)
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+def _split_long_paragraph(paragraph, max_chars):
+    """Split an oversized paragraph on sentence boundaries, hard-cutting only as a last resort"""
+    pieces = []
+    current = ""
+    for sentence in SENTENCE_END.split(paragraph):
+        while len(sentence) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if current and len(current) + len(sentence) + 1 > max_chars:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_into_sections(text, max_chars=CHUNK_CHAR_LIMIT):
+    """
+    按章节边界将长文本切分为不超过 max_chars 的块
+
+    以空行分段后贪心装箱；当前块已过半且下一段是章节标题时提前断开，
+    尽量让每块从一个完整章节开始。
+    """
+    if len(text) <= max_chars:
+        return [text]
+
+    paragraphs = []
+    for paragraph in re.split(r'\n\s*\n', text):
+        if not paragraph.strip():
+            continue
+        if len(paragraph) > max_chars:
+            paragraphs.extend(_split_long_paragraph(paragraph, max_chars))
+        else:
+            paragraphs.append(paragraph)
+
+    chunks = []
+    current = []
+    current_len = 0
+    for paragraph in paragraphs:
+        added = len(paragraph) + (2 if current else 0)
+        at_heading = SECTION_HEADING.match(paragraph) is not None
+        if current and (current_len + added > max_chars or (at_heading and current_len > max_chars // 2)):
+            chunks.append("\n\n".join(current))
+            current = []
+            current_len = 0
+            added = len(paragraph)
+        current.append(paragraph)
+        current_len += added
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def _is_binary_field(field):
+    return field in BINARY_FIELDS or field.startswith(BINARY_FIELD_PREFIXES)
+
+
+def _as_list(value):
+    if isinstance(value, list):
+        return value
+    if value in (None, ""):
+        return []
+    return [value]
+
+
+def _flag(value):
+    if isinstance(value, list):
+        return max((_flag(v) for v in value), default=0)
+    if isinstance(value, str):
+        return 1 if value.strip().lower() in ("1", "yes", "true") else 0
+    return 1 if value else 0
+
+
+def _vote(values):
+    """Most common non-empty value; ties go to the earliest chunk"""
+    values = [v for v in values if v not in (None, "", [])]
+    values = [v if not isinstance(v, list) else v[0] for v in values]
+    if not values:
+        return None
+    counts = Counter(str(v) for v in values)
+    best = max(counts.values())
+    return next(v for v in values if counts[str(v)] == best)
+
+
+def _merge_amount(values, no_value, unspecified):
+    """Largest specific amount wins (original string kept); otherwise unspecified/no_value"""
+    best, best_amount = None, None
+    saw_unspecified = False
+    for value in values:
+        for item in _as_list(value):
+            amount = parse_amount(item)
+            if amount is None:
+                saw_unspecified = True
+            elif amount > 0 and (best_amount is None or amount > best_amount):
+                best, best_amount = item, amount
+    if best is not None:
+        return best
+    return unspecified if saw_unspecified else no_value
+
+
+def merge_annotations(results):
+    """
+    将各分块的标注结果确定性地合并为一条记录
+
+    - 二值字段（data_category_* / data_processing_basis_* / violation_nature_* / 例外 / violation_result）: 逻辑或
+    - gdpr_clause: 按出现顺序取并集（逗号分隔）
+    - fine_amount / Affected_data_volume: 取最大的具体数值，否则 "Not specified" / "unspecific"，否则 0
+    - gdpr_conflict: 任一块为 yes 则 yes
+    - Date: 取最大年份（裁决年份通常是文中最晚的年份）
+    - country / company_industry 及其他字段: 多数投票，平局取靠前的块
+    """
+    fields = []
+    for result in results:
+        for field in result:
+            if field not in fields:
+                fields.append(field)
+
+    merged = {}
+    for field in fields:
+        values = [r[field] for r in results if field in r]
+        if _is_binary_field(field):
+            merged[field] = max(_flag(v) for v in values)
+        elif field == "gdpr_clause":
+            clauses = []
+            for value in values:
+                for item in _as_list(value):
+                    for clause in str(item).split(","):
+                        clause = clause.strip()
+                        if clause and clause not in clauses:
+                            clauses.append(clause)
+            merged[field] = ", ".join(clauses)
+        elif field == "fine_amount":
+            merged[field] = _merge_amount(values, 0, "Not specified")
+        elif field == "Affected_data_volume":
+            merged[field] = _merge_amount(values, "unspecific", "unspecific")
+        elif field == "gdpr_conflict":
+            is_yes = any(str(v).strip().lower() == "yes" for value in values for v in _as_list(value))
+            merged[field] = "yes" if is_yes else _vote(values) or "No conflict"
+        elif field == "Date":
+            years = [int(m.group()) for value in values for v in _as_list(value)
+                     for m in [YEAR_PATTERN.search(str(v))] if m]
+            merged[field] = max(years) if years else _vote(values)
+        else:
+            merged[field] = _vote(values)
+    return merged
+
+
+def merge_chunk_results(results):
+    """Merge per-chunk results; any failed chunk fails the whole case so it gets re-queued"""
+    for result in results:
+        if not isinstance(result, dict) or "error" in result:
+            error = result.get("error") if isinstance(result, dict) else str(result)
+            return {"error": f"Chunk annotation failed: {error}",
+                    "raw_output": result.get("raw_output", "") if isinstance(result, dict) else ""}
+    if len(results) == 1:
+        return results[0]
+    return merge_annotations(results)
+
+
+def annotate_long_text(text, annotate_fn, api_url=None, max_chars=CHUNK_CHAR_LIMIT, max_workers=CHUNK_WORKERS):
+    """
+    Map-reduce annotation: short texts go straight to annotate_fn, long texts are
+    split on section boundaries, annotated in parallel and merged
+    """
+    chunks = split_into_sections(text, max_chars)
+    if len(chunks) == 1:
+        return annotate_fn(text, api_url)
+
+    print(f"文本长度 {len(text)} 超过 {max_chars}，切分为 {len(chunks)} 块并行标注")
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+        results = list(executor.map(lambda chunk: annotate_fn(chunk, api_url), chunks))
+    return merge_chunk_results(results)
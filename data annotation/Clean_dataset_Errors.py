@@ -1,7 +1,8 @@
-import json
 import os
 
-def extract_error_files(folder_path, error_message, output_file):
+from Corpus_Auditor import audit_corpus
+
+def extract_error_files(folder_path, error_message, output_file, manifest_path=None, recursive=False):
     """
     扫描指定文件夹中的所有JSON文件，提取包含特定错误信息的文件
     
@@ -9,35 +10,18 @@ def extract_error_files(folder_path, error_message, output_file):
     folder_path (str): JSON文件所在的文件夹路径
     error_message (str): 要查找的错误信息
     output_file (str): 输出结果的TXT文件路径
+    manifest_path (str): 可选，审计清单路径；只重新扫描上次之后新增或修改的文件
+    recursive (bool): 默认只扫描文件夹顶层并输出文件名；为True时也扫描子文件夹，输出相对路径
     """
-    # 创建一个列表来存储匹配的文件名
-    matching_files = []
-    
-    # 获取文件夹中的所有文件
-    all_files = os.listdir(folder_path)
-    json_files = [f for f in all_files if f.endswith('.json')]
-    
     print(f"开始扫描文件夹: {folder_path}")
-    print(f"找到 {len(json_files)} 个JSON文件")
     
-    # 处理每个JSON文件
-    for index, json_file in enumerate(json_files):
-        file_path = os.path.join(folder_path, json_file)
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                # 读取文件内容
-                content = f.read()
-                
-                # 检查是否包含指定的错误信息字符串
-                if error_message in content:
-                    matching_files.append(json_file)
-                    print(f"找到匹配文件: {json_file}")
-        except Exception as e:
-            print(f"无法处理文件 {json_file}: {str(e)}")
-        
-        # 显示进度
-        if (index + 1) % 20 == 0 or index + 1 == len(json_files):
-            print(f"已处理 {index + 1}/{len(json_files)} 个文件...")
+    # 单次遍历 + 线程池 mmap 扫描（见 Corpus_Auditor），不再把每个JSON完整读入内存
+    report = audit_corpus(folder_path, markers=(error_message,), content_suffixes=('.json',),
+                          manifest_path=manifest_path, recursive=recursive)
+    matching_files = sorted(report["error_files"])
+    print(f"扫描了 {report['scanned']} 个JSON文件，耗时 {report['seconds']}秒")
+    for path in report["unreadable"]:
+        print(f"无法处理文件 {path['path']}: {path['error']}")
     
     # 将匹配的文件名写入输出文件
     with open(output_file, 'w', encoding='utf-8') as f:
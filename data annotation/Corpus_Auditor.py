@@ -0,0 +1,288 @@
+import os
+import re
+import json
+import mmap
+import time
+import hashlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from Annotation_Cache import ERROR_MARKERS
+
+# 标注失败时写进输出文件的错误信息，一次扫描同时匹配
+DEFAULT_MARKERS = ERROR_MARKERS + (
+    "No valid JSON found", "Unterminated JSON object", "Schema validation failed",
+    "Chunk annotation failed", "Empty text in API response", "Incorrect response format from API",
+    "API request failed with status code", "Unexpected error"
+)
+SMALL_FILE_BYTES = 100
+CONTENT_SUFFIXES = (".json", ".jsonl")
+AUDIT_WORKERS = 8
+SCAN_BATCH = 256              # 每个线程任务扫描的文件数，摊薄线程池调度开销
+MMAP_MIN_BYTES = 64 * 1024    # 小文件一次 read 比 mmap 的建立/解除映射更快
+MANIFEST_VERSION = 1
+
+
+def scan_tree(root, recursive=True):
+    """
+    单次 os.scandir 遍历，产出 (路径, stat)
+
+    DirEntry.stat() 在大多数平台上复用目录读取时拿到的信息，不再对每个文件单独 stat。
+    recursive=False 时只列出 root 顶层的文件。
+    """
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive:
+                                stack.append(entry.path)
+                        elif entry.is_file():
+                            yield entry.path, entry.stat()
+                    except OSError as e:
+                        print(f"无法读取 {entry.path}: {e}")
+        except OSError as e:
+            print(f"无法遍历目录 {directory}: {e}")
+
+
+def compile_markers(markers=DEFAULT_MARKERS):
+    """One alternation regex over the byte-encoded markers, so each file is scanned once"""
+    return re.compile(b"|".join(re.escape(m.encode("utf-8")) for m in markers))
+
+
+def _scan_buffer(buffer, pattern):
+    return {m.group().decode("utf-8") for m in pattern.finditer(buffer)}, hashlib.sha256(buffer).hexdigest()
+
+
+def match_markers(path, pattern, size):
+    """
+    Return (markers found, sha256 of the content) for one file
+
+    Large files are scanned through mmap instead of being read into memory.
+    """
+    if size == 0:
+        return set(), hashlib.sha256(b"").hexdigest()
+    # 直接用文件描述符，省掉 open() 构造缓冲读取器的开销
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if size < MMAP_MIN_BYTES:
+            return _scan_buffer(os.read(fd, size + 1), pattern)
+        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mapped:
+            return _scan_buffer(mapped, pattern)
+    finally:
+        os.close(fd)
+
+
+def load_manifest(manifest_path, markers, small_bytes):
+    """
+    读取审计清单；错误标记列表变化时丢弃旧的内容扫描结果
+
+    清单结构: {"version", "markers", "small_bytes", "files": {相对路径: {"size", "mtime_ns", "hash", "markers"}}}
+    """
+    empty = {"version": MANIFEST_VERSION, "markers": list(markers), "small_bytes": small_bytes, "files": {}}
+    if not manifest_path or not os.path.exists(manifest_path):
+        return empty
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"审计清单无法读取，重新全量扫描: {e}")
+        return empty
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("markers") != list(markers):
+        print("错误标记或清单版本已变化，重新全量扫描")
+        return empty
+    manifest["small_bytes"] = small_bytes
+    return manifest
+
+
+def save_manifest(manifest_path, manifest):
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        # json.dumps 整体走 C 编码器，比 json.dump 的流式编码快得多
+        f.write(json.dumps(manifest, ensure_ascii=False))
+    os.replace(tmp_path, manifest_path)
+
+
+def audit_corpus(root, markers=DEFAULT_MARKERS, small_bytes=SMALL_FILE_BYTES,
+                 content_suffixes=CONTENT_SUFFIXES, max_workers=AUDIT_WORKERS, manifest_path=None, recursive=True):
+    """
+    一次遍历完成小文件检测与错误标记扫描
+
+    Args:
+        root: 要审计的目录
+        markers: 要查找的错误信息（任一出现即记为错误文件）
+        small_bytes: 小于该字节数的文件记为小文件（可能是空标注或截断）
+        content_suffixes: 只扫描这些后缀的文件内容
+        max_workers: 内容扫描线程数
+        manifest_path: 可选，持久化审计清单；大小和 mtime 都未变化的文件直接复用上次结果，
+            只重新扫描新增或修改的文件，已删除的文件从清单中移除
+        recursive: 为False时只审计 root 顶层的文件，不进入子目录
+
+    Returns:
+        报告字典：files / bytes / small_files / error_files / marker_counts / seconds，
+        使用清单时另有 new / changed / unchanged / deleted 计数
+    """
+    start = time.perf_counter()
+    pattern = compile_markers(markers)
+    manifest = load_manifest(manifest_path, markers, small_bytes)
+    previous = manifest["files"]
+    current = {}
+    small_files = []
+    total_files = 0
+    total_bytes = 0
+    scanned = 0
+    changes = Counter()
+    seen = set()
+    error_files = {}
+    unreadable = []
+    # scan_tree 产出的路径都以 root 开头，直接切片比 os.path.relpath 快
+    prefix_len = len(os.path.join(root, ""))
+
+    def scan(batch):
+        results = []
+        for path, size in batch:
+            try:
+                results.append((path, match_markers(path, pattern, size), None))
+            except (OSError, ValueError) as e:
+                results.append((path, None, str(e)))
+        return results
+
+    # 遍历的同时按批提交内容扫描，目录读取与文件读取重叠进行
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        batch = []
+        for path, stat in scan_tree(root, recursive):
+            total_files += 1
+            total_bytes += stat.st_size
+            relative_path = path[prefix_len:]
+            if stat.st_size < small_bytes:
+                small_files.append({"path": relative_path, "size": stat.st_size})
+            entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+            old = previous.get(relative_path)
+            is_content = path.endswith(content_suffixes)
+            seen.add(relative_path)
+            if old is None:
+                changes["new"] += 1
+            elif (old["size"] != stat.st_size or old["mtime_ns"] != stat.st_mtime_ns
+                  or is_content and "hash" not in old):
+                changes["changed"] += 1
+            else:
+                changes["unchanged"] += 1
+                current[relative_path] = old
+                if old.get("markers"):
+                    error_files[relative_path] = old["markers"]
+                continue
+            current[relative_path] = entry
+            if is_content:
+                batch.append((path, stat.st_size))
+                if len(batch) >= SCAN_BATCH:
+                    futures.append(executor.submit(scan, batch))
+                    scanned += len(batch)
+                    batch = []
+        if batch:
+            futures.append(executor.submit(scan, batch))
+            scanned += len(batch)
+
+        for future in futures:
+            for path, scan_result, error in future.result():
+                relative_path = path[prefix_len:]
+                if error:
+                    unreadable.append({"path": relative_path, "error": error})
+                    # 不记录结果，下次运行重新扫描
+                    current.pop(relative_path, None)
+                    continue
+                found, digest = scan_result
+                current[relative_path]["hash"] = digest
+                current[relative_path]["markers"] = sorted(found)
+                if found:
+                    error_files[relative_path] = sorted(found)
+
+    changes["deleted"] = sum(1 for path in previous if path not in seen)
+    if manifest_path and (changes["new"] or changes["changed"] or changes["deleted"] or unreadable
+                          or not os.path.exists(manifest_path)):
+        manifest["files"] = current
+        save_manifest(manifest_path, manifest)
+
+    small_files.sort(key=lambda item: (item["size"], item["path"]))
+    return {
+        "root": os.path.abspath(root),
+        "files": total_files,
+        "bytes": total_bytes,
+        "scanned": scanned,
+        "small_bytes": small_bytes,
+        "small_files": small_files,
+        "error_files": dict(sorted(error_files.items())),
+        "marker_counts": dict(Counter(m for found in error_files.values() for m in found)),
+        "unreadable": unreadable,
+        "new": changes["new"],
+        "changed": changes["changed"],
+        "unchanged": changes["unchanged"],
+        "deleted": changes["deleted"],
+        "seconds": round(time.perf_counter() - start, 4)
+    }
+
+
+def save_report(report, output_file):
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"审计报告已保存至 {output_file}")
+
+
+def _legacy_audit(root, markers=DEFAULT_MARKERS, small_bytes=SMALL_FILE_BYTES):
+    """The original two-pass approach (os.walk + getsize, then full reads), kept for benchmarking"""
+    small_files = []
+    for directory, _, files in os.walk(root):
+        for file in files:
+            path = os.path.join(directory, file)
+            if os.path.getsize(path) < small_bytes:
+                small_files.append(path)
+    error_files = []
+    for directory, _, files in os.walk(root):
+        for file in files:
+            if not file.endswith(CONTENT_SUFFIXES):
+                continue
+            with open(os.path.join(directory, file), 'r', encoding='utf-8') as f:
+                content = f.read()
+            if any(marker in content for marker in markers):
+                error_files.append(file)
+    return small_files, error_files
+
+
+def benchmark_audit(root, repeat=3):
+    """Compare the legacy two-pass scan with audit_corpus on the same tree"""
+    report = {}
+    for name, func in (("legacy", _legacy_audit), ("auditor", audit_corpus)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func(root)
+        report[name] = (time.perf_counter() - start) / repeat
+        print(f"{name:>7}: {report[name]:.3f}秒")
+    print(f"加速: {report['legacy'] / report['auditor']:.1f}x")
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Audit an annotation folder for small files and error markers")
+    parser.add_argument("root")
+    parser.add_argument("--output", default="audit_report.json")
+    parser.add_argument("--small-bytes", type=int, default=SMALL_FILE_BYTES)
+    parser.add_argument("--marker", action="append", default=None, help="自定义错误信息，可重复；默认使用内置列表")
+    parser.add_argument("--workers", type=int, default=AUDIT_WORKERS)
+    parser.add_argument("--manifest", default=None, help="持久化审计清单，只重新扫描新增或修改的文件")
+    parser.add_argument("--benchmark", action="store_true", help="与旧的两遍扫描比较耗时")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark_audit(args.root)
+    else:
+        report = audit_corpus(args.root, markers=tuple(args.marker) if args.marker else DEFAULT_MARKERS,
+                              small_bytes=args.small_bytes, max_workers=args.workers, manifest_path=args.manifest)
+        print(f"文件 {report['files']} 个，小文件 {len(report['small_files'])} 个，"
+              f"错误文件 {len(report['error_files'])} 个，耗时 {report['seconds']}秒")
+        if args.manifest:
+            print(f"新增 {report['new']}，修改 {report['changed']}，未变 {report['unchanged']}，删除 {report['deleted']}")
+        save_report(report, args.output)
@@ -6,6 +6,16 @@ import time
 import sys
 from tqdm import tqdm
 
+from Annotation_Cache import AnnotationCache, output_is_valid
+from Chunked_Annotation import CHUNK_CHAR_LIMIT, annotate_long_text
+from Annotation_Schema import extract_json_object, parse_annotation
+from Api_Client import (
+    RETRY_STATUS_CODES, SATURATION_STATUS_CODES, CircuitBreaker,
+    get_session, parse_retry_after, compute_backoff
+)
+from Annotation_Telemetry import get_telemetry
+from Near_Duplicate_Detection import find_duplicate_groups, save_groups, propagate_annotations
+
 # 配置信息
 MAX_RETRIES = 3
 RETRY_DELAY = 5  # 秒
@@ -13,6 +23,12 @@ RETRY_DELAY = 5  # 秒
 # 设置DeepSeek API Key
 DEEPSEEK_API_KEY = ""  # 请替换为你的DeepSeek API密钥
 DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
+MODEL_NAME = "deepseek-chat"
+TEMPERATURE = 0.3
+MAX_TOKENS = 1024
+
+# 全局熔断器：所有线程共享，服务商饱和时整体暂停
+CIRCUIT_BREAKER = CircuitBreaker(threshold=5, cooldown=30)
 
 # 定义标注的 Prompt 模板
 PROMPT_TEMPLATE = """
@@ -94,26 +110,57 @@ Return valid JSON in this structure:
 """
 
 def extract_json_from_response(response):
-    """Extract JSON content from model response"""
-    try:
-        json_match = re.search(r'\{.*\}', response, re.DOTALL)
-        if json_match:
-            return json.loads(json_match.group())
-        return {"error": "No valid JSON found"}
-    except json.JSONDecodeError as e:
-        return {"error": f"JSON decode error: {e}"}
-
-def annotate_text(text):
-    """Call DeepSeek API for GDPR data annotation with retry mechanism"""
+    """Extract JSON content from model response (brace-balanced, no schema validation)"""
+    obj, error = extract_json_object(response)
+    if error:
+        return {"error": error}
+    return obj
+
+def build_payload(text, prompt_template=PROMPT_TEMPLATE, max_tokens=MAX_TOKENS):
+    """Build the chat-completions request body for one case text"""
+    return {
+        "model": MODEL_NAME,
+        "messages": [
+            {"role": "system", "content": "You are a GDPR compliance analyst."},
+            {"role": "user", "content": prompt_template.format(text=text)}
+        ],
+        "temperature": TEMPERATURE,
+        "max_tokens": max_tokens
+    }
+
+def annotate_text(text, api_url=None, payload_fn=build_payload, parse_fn=parse_annotation, retry_invalid=True):
+    """
+    Call DeepSeek API for GDPR data annotation with retry mechanism
+
+    默认用 parse_annotation 提取并按 schema 校验/规范化结果，校验失败的输出会重新请求。
+    payload_fn / parse_fn 可替换请求构造与响应解析（例如多案例打包请求）
+    retry_invalid=False 时解析失败直接返回错误（限流、超时等仍会重试），由调用方自行回退
+    安装了 RunTelemetry（set_telemetry）时，每次尝试和最终结果都会记录指标
+    """
     raw_output = ""
     retry_count = 0
+    api_url = api_url or DEEPSEEK_API_URL
+    telemetry = get_telemetry()
+    call_start = start_time = time.time()
+
+    def note(outcome, status=None, usage=None):
+        if telemetry:
+            telemetry.record_request(time.time() - start_time, status, outcome, retry_count + 1, usage, len(text))
+
+    def finish(outcome, result):
+        if telemetry:
+            telemetry.record_call(outcome, retry_count, time.time() - call_start, len(text))
+        return result
     
     headers = {
         "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
         "Content-Type": "application/json"
     }
     
+    session = get_session()
+    
     while retry_count < MAX_RETRIES:
+        CIRCUIT_BREAKER.wait()
         try:
             print(f"准备调用DeepSeek API...（尝试 {retry_count+1}/{MAX_RETRIES}）")
             print(f"文本长度: {len(text)} 字符")
@@ -122,18 +169,10 @@ def annotate_text(text):
             start_time = time.time()
             
             # 构造API请求数据
-            payload = {
-                "model": "deepseek-chat",
-                "messages": [
-                    {"role": "system", "content": "You are a GDPR compliance analyst."},
-                    {"role": "user", "content": PROMPT_TEMPLATE.format(text=text)}
-                ],
-                "temperature": 0.3,
-                "max_tokens": 1024
-            }
+            payload = payload_fn(text)
             
             print("发送请求到DeepSeek API...")
-            response = requests.post(DEEPSEEK_API_URL, headers=headers, json=payload, timeout=120)
+            response = session.post(api_url, headers=headers, json=payload, timeout=120)
             
             # 记录结束时间
             elapsed_time = time.time() - start_time
@@ -141,41 +180,74 @@ def annotate_text(text):
 
             # 检查API响应
             if response.status_code == 200:
+                CIRCUIT_BREAKER.record_success()
                 response_data = response.json()
+                usage = response_data.get("usage") if isinstance(response_data, dict) else None
                 if "choices" in response_data and len(response_data["choices"]) > 0:
                     raw_output = response_data["choices"][0]["message"]["content"]
                     print(f"提取到文本响应，长度: {len(raw_output)}")
                     
                     if raw_output:
-                        result = extract_json_from_response(raw_output)
+                        result = parse_fn(raw_output)
                         print(f"JSON提取结果: {'成功' if 'error' not in result else '失败: ' + result.get('error', '')}")
-                        return result
+                        if "error" in result:
+                            # 解析或校验失败：重新请求，不让坏数据进入数据集
+                            note("parse_error", 200, usage)
+                            if not retry_invalid:
+                                return finish("parse_error", dict(result, raw_output=raw_output))
+                            retry_count += 1
+                            continue
+                        note("ok", 200, usage)
+                        return finish("ok", result)
                     else:
                         print("警告: API返回了空响应")
-                        return {"error": "Empty text in API response", "raw_output": ""}
+                        note("empty_response", 200, usage)
+                        return finish("empty_response", {"error": "Empty text in API response", "raw_output": ""})
                 else:
                     print("API响应格式不正确")
                     print(f"响应内容: {response_data}")
-                    return {"error": "Incorrect response format from API", "raw_output": str(response_data)}
+                    note("bad_format", 200, usage)
+                    return finish("bad_format", {"error": "Incorrect response format from API",
+                                                 "raw_output": str(response_data)})
+            elif response.status_code in RETRY_STATUS_CODES:
+                # 限流/服务端临时错误：按 Retry-After 或抖动退避后重试
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                print(f"API请求被限流或服务端繁忙，状态码: {response.status_code}")
+                raw_output = response.text
+                note("rate_limited" if response.status_code == 429 else "server_error", response.status_code)
+                if response.status_code in SATURATION_STATUS_CODES:
+                    CIRCUIT_BREAKER.record_failure(retry_after)
+                retry_count += 1
+                if retry_count < MAX_RETRIES:
+                    wait_time = compute_backoff(retry_count, RETRY_DELAY, retry_after)
+                    print(f"等待 {wait_time:.1f} 秒后重试...")
+                    time.sleep(wait_time)
+                continue
             else:
                 print(f"API请求失败，状态码: {response.status_code}")
                 print(f"响应内容: {response.text}")
-                return {"error": f"API request failed with status code {response.status_code}", "raw_output": response.text}
+                note("http_error", response.status_code)
+                return finish("http_error", {"error": f"API request failed with status code {response.status_code}",
+                                             "raw_output": response.text})
                 
         except requests.exceptions.Timeout:
             print("API请求超时")
+            note("timeout")
+            CIRCUIT_BREAKER.record_failure()
             retry_count += 1
             if retry_count < MAX_RETRIES:
-                print(f"等待 {RETRY_DELAY} 秒后重试...")
-                time.sleep(RETRY_DELAY)
+                wait_time = compute_backoff(retry_count, RETRY_DELAY)
+                print(f"等待 {wait_time:.1f} 秒后重试...")
+                time.sleep(wait_time)
             continue
                 
         except requests.exceptions.RequestException as e:
             print(f"API请求错误: {e}")
+            note("network_error")
             retry_count += 1
-            wait_time = min(RETRY_DELAY * (2 ** retry_count), 60)  # 指数退避策略，最长等待60秒
             if retry_count < MAX_RETRIES:
-                print(f"等待 {wait_time} 秒后重试...")
+                wait_time = compute_backoff(retry_count, RETRY_DELAY)  # 抖动指数退避，最长等待60秒
+                print(f"等待 {wait_time:.1f} 秒后重试...")
                 time.sleep(wait_time)
             continue
                 
@@ -183,10 +255,11 @@ def annotate_text(text):
             print(f"调用API时发生未预期的错误: {e}")
             import traceback
             traceback.print_exc()
-            return {"error": f"Unexpected error: {str(e)}", "raw_output": ""}
+            note("exception")
+            return finish("exception", {"error": f"Unexpected error: {str(e)}", "raw_output": ""})
             
     # 所有重试都失败后的返回
-    return {"error": "Max retries exceeded", "raw_output": raw_output}
+    return finish("max_retries", {"error": "Max retries exceeded", "raw_output": raw_output})
 
 def extract_number_from_filename(filename):
     """从文件名中提取数字编号"""
@@ -195,12 +268,8 @@ def extract_number_from_filename(filename):
         return int(match.group(1))
     return 0  # 如果没有找到数字，返回0作为默认值
 
-def process_cases(input_dir):
-    """Process all GDPR case files in a directory"""
-    if not os.path.isdir(input_dir):
-        print("Error: Input path is not a directory or does not exist.")
-        return
-
+def list_case_files(input_dir):
+    """Collect all .txt case files under input_dir, sorted by the number in the filename"""
     # 获取所有txt文件
     files = []
     for root, _, filenames in os.walk(input_dir):
@@ -210,6 +279,55 @@ def process_cases(input_dir):
     
     # 根据文件名中的数字编号进行排序
     files.sort(key=lambda x: extract_number_from_filename(os.path.basename(x)))
+    return files
+
+def save_annotation(file_path, content, annotations):
+    """Write the annotation result next to the case file and return the output path"""
+    output_file = f"{os.path.splitext(file_path)[0]}.json"
+    result = {
+        "metadata": {
+            "source_file": os.path.basename(file_path),
+            "text_length": len(content)
+        },
+        "annotations": annotations
+    }
+    
+    # Save annotation results to JSON file
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    return output_file
+
+def open_cache(cache_dir, model_name=MODEL_NAME):
+    """Annotation cache keyed on case text plus the current prompt, model and temperature"""
+    return AnnotationCache(cache_dir, PROMPT_TEMPLATE, model_name, TEMPERATURE)
+
+def process_cases(input_dir, cache_dir=None, resume=False, chunked=False, chunk_chars=CHUNK_CHAR_LIMIT,
+                  relevance_filter=None, sink=None, dedupe_threshold=None, groups_file=None):
+    """
+    Process all GDPR case files in a directory
+
+    cache_dir: 可选，持久化标注缓存目录；命中缓存的案例不再调用API
+    resume: 为True时跳过已有有效缓存且输出文件有效的案例（不重写 <case>.json）
+    chunked: 为True时超过 chunk_chars 的长案例按章节切分、并行标注后合并
+    relevance_filter: 可选 RelevanceFilter，只把相关段落送入prompt（缓存键基于过滤后的文本）
+    sink: 可选 JsonlSink，结果追加到单一JSONL文件而不是逐案例写 <case>.json
+    dedupe_threshold: 可选，MinHash 相似度阈值；近重复案例只标注组代表，结果复制给组内其他案例
+    groups_file: 可选，导出近重复分组键 CSV（用于按组交叉验证）
+    """
+    if not os.path.isdir(input_dir):
+        print("Error: Input path is not a directory or does not exist.")
+        return
+
+    files = list_case_files(input_dir)
+    groups = None
+    if dedupe_threshold:
+        groups = find_duplicate_groups(files, threshold=dedupe_threshold)
+        if groups_file:
+            save_groups(groups, groups_file)
+        files = [f for f in files if groups[f] == f]
+    cache = open_cache(cache_dir) if cache_dir else None
+    skipped = 0
+    written = {}
     
     # 处理排序后的文件
     for file_path in tqdm(files, desc="Processing files"):
@@ -217,25 +335,33 @@ def process_cases(input_dir):
             with open(file_path, 'r', encoding='utf-8') as f:
                 content = f.read()
             
-            annotations = annotate_text(content)
-            
-            output_file = f"{os.path.splitext(file_path)[0]}.json"
-            result = {
-                "metadata": {
-                    "source_file": os.path.basename(file_path),
-                    "text_length": len(content)
-                },
-                "annotations": annotations
-            }
-            
-            # Save annotation results to JSON file
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(result, f, ensure_ascii=False, indent=2)
+            text = relevance_filter.filter(content, case_id=file_path) if relevance_filter else content
+            annotations = cache.get(text) if cache else None
+            if annotations is not None:
+                if resume and (sink.has_valid(file_path) if sink else output_is_valid(file_path)):
+                    skipped += 1
+                    continue
+            else:
+                if chunked:
+                    annotations = annotate_long_text(text, annotate_text, max_chars=chunk_chars)
+                else:
+                    annotations = annotate_text(text)
+                if cache:
+                    cache.put(text, annotations)
+            output_file = (sink.write if sink else save_annotation)(file_path, content, annotations)
+            written[file_path] = annotations
             
             print(f"Processed: {file_path} -> {output_file}")
         except Exception as e:
             print(f"Error processing {file_path}: {e}")
 
+    if groups:
+        propagate_annotations(groups, written, sink.write if sink else save_annotation)
+    if cache:
+        print(f"缓存命中: {cache.hits}，未命中: {cache.misses}，跳过: {skipped}")
+    if relevance_filter:
+        relevance_filter.report()
+
 def test_api_connection():
     """测试API连接是否正常工作"""
     print("测试DeepSeek API连接...")
@@ -246,14 +372,14 @@ def test_api_connection():
         }
         
         payload = {
-            "model": "deepseek-chat",
+            "model": MODEL_NAME,
             "messages": [
                 {"role": "user", "content": "Hello, are you working?"}
             ],
             "max_tokens": 10
         }
         
-        response = requests.post(DEEPSEEK_API_URL, headers=headers, json=payload, timeout=30)
+        response = get_session().post(DEEPSEEK_API_URL, headers=headers, json=payload, timeout=30)
         
         if response.status_code == 200:
             print("API连接测试成功!")
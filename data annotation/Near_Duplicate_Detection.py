@@ -0,0 +1,192 @@
+import os
+import re
+import csv
+import zlib
+import numpy as np
+
+from Annotation_Cache import is_valid_annotation
+
+# MinHash 参数：128 个哈希函数分成 16 个 band（每个 8 行），
+# 相似度约 0.7 以上的文本对大概率落入同一个桶，再用签名估计的 Jaccard 精确确认
+NUM_PERM = 128
+NUM_BANDS = 16
+SIMILARITY_THRESHOLD = 0.8
+SHINGLE_WORDS = 5
+EMPTY_HASH = np.uint64(0xFFFFFFFF)
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def shingle_hashes(text, size=SHINGLE_WORDS):
+    """32-bit hashes of the word n-gram shingles of a text (lower-cased, punctuation ignored)"""
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < size:
+        shingles = {" ".join(words)} if words else set()
+    else:
+        shingles = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    return np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+
+class MinHashLSH:
+    """
+    流式 MinHash + LSH 近重复索引
+
+    add() 逐个加入文本：计算签名，只与共享至少一个 band 桶的已有文本比较，
+    整体为近线性复杂度而不是两两比较。估计 Jaccard 不低于 threshold 的文本
+    用并查集归为一组，组代表是组内最早加入的文本。
+    """
+
+    def __init__(self, num_perm=NUM_PERM, num_bands=NUM_BANDS, threshold=SIMILARITY_THRESHOLD,
+                 shingle_size=SHINGLE_WORDS, seed=42):
+        if num_perm % num_bands:
+            raise ValueError("num_perm must be divisible by num_bands")
+        rng = np.random.RandomState(seed)
+        # multiply-shift 哈希族: h(x) = ((a*x + b) mod 2^64) >> 32，a 为奇数；
+        # uint64 溢出回绕即取模，不需要逐元素的 % 运算
+        self._a = rng.randint(0, 1 << 63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._b = rng.randint(0, 1 << 63, size=num_perm, dtype=np.uint64) * np.uint64(2)
+        self.num_perm = num_perm
+        self.num_bands = num_bands
+        self.rows = num_perm // num_bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.keys = []
+        self.signatures = []
+        self._index = {}
+        self._buckets = [{} for _ in range(num_bands)]
+        self._parent = []
+
+    def signature(self, text):
+        hashes = shingle_hashes(text, self.shingle_size)
+        if not len(hashes):
+            return np.full(self.num_perm, EMPTY_HASH, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            return ((np.outer(hashes, self._a) + self._b) >> np.uint64(32)).min(axis=0)
+
+    def _find(self, i):
+        while self._parent[i] != i:
+            self._parent[i] = self._parent[self._parent[i]]
+            i = self._parent[i]
+        return i
+
+    def _union(self, i, j):
+        root_i, root_j = self._find(i), self._find(j)
+        if root_i != root_j:
+            # 保留更早加入的文本作为代表
+            self._parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    def similarity(self, key_a, key_b):
+        """Estimated Jaccard similarity of two indexed texts"""
+        a, b = self.signatures[self._index[key_a]], self.signatures[self._index[key_b]]
+        return float(np.mean(a == b))
+
+    def add(self, key, text):
+        """Index one text; returns the keys of already-indexed near-duplicates"""
+        signature = self.signature(text)
+        i = len(self.keys)
+        self.keys.append(key)
+        self.signatures.append(signature)
+        self._index[key] = i
+        self._parent.append(i)
+
+        candidates = set()
+        for band, buckets in enumerate(self._buckets):
+            band_key = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            bucket = buckets.setdefault(band_key, [])
+            candidates.update(bucket)
+            bucket.append(i)
+
+        duplicates = []
+        for j in sorted(candidates):
+            if np.mean(self.signatures[j] == signature) >= self.threshold:
+                self._union(i, j)
+                duplicates.append(self.keys[j])
+        return duplicates
+
+    def groups(self):
+        """Map each key to its group representative (the earliest-added member)"""
+        return {key: self.keys[self._find(i)] for i, key in enumerate(self.keys)}
+
+
+def find_duplicate_groups(files, threshold=SIMILARITY_THRESHOLD, **kwargs):
+    """
+    对案例文件做近重复聚类
+
+    Returns:
+        {文件路径: 代表文件路径}；不重复的文件代表就是自己
+    """
+    index = MinHashLSH(threshold=threshold, **kwargs)
+    for file_path in files:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            index.add(file_path, f.read())
+    groups = index.groups()
+    duplicates = sum(1 for file_path, representative in groups.items() if file_path != representative)
+    print(f"近重复检测: {len(files)} 个案例，{len(set(groups.values()))} 个组，{duplicates} 个重复案例")
+    return groups
+
+
+def save_groups(groups, output_file):
+    """
+    导出分组键（用于 GroupKFold 等按组交叉验证）
+
+    每行: source_file, source_path, case_group；case_group 为组代表的文件名，
+    同组案例不应被分到不同的折里。
+    """
+    with open(output_file, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["source_file", "source_path", "case_group"])
+        for file_path, representative in groups.items():
+            writer.writerow([os.path.basename(file_path), os.path.abspath(file_path),
+                             os.path.basename(representative)])
+    print(f"分组键已保存至 {output_file}")
+
+
+def propagate_annotations(groups, annotations_by_representative, write):
+    """
+    把代表案例的标注写给同组的其他案例
+
+    代表的标注失败（错误或未通过 schema 校验）时不复制，同组案例留待代表重新标注后再写出。
+
+    Args:
+        groups: find_duplicate_groups 的结果
+        annotations_by_representative: {代表文件路径: 标注结果}，只包含本次实际写出的代表
+        write: save_annotation 或 JsonlSink.write
+
+    Returns:
+        写出的重复案例数
+    """
+    propagated = 0
+    invalid = set()
+    for file_path, representative in groups.items():
+        if file_path == representative or representative not in annotations_by_representative:
+            continue
+        annotations = annotations_by_representative[representative]
+        if not is_valid_annotation(annotations):
+            invalid.add(representative)
+            continue
+        with open(file_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        write(file_path, content, annotations)
+        propagated += 1
+    if propagated:
+        print(f"已将代表案例的标注复制给 {propagated} 个近重复案例")
+    if invalid:
+        print(f"{len(invalid)} 个代表案例标注无效，未复制给其近重复案例")
+    return propagated
+
+
+def load_groups(group_file):
+    """Read a save_groups CSV back into {source_path: case_group}"""
+    with open(group_file, 'r', encoding='utf-8', newline='') as f:
+        return {row["source_path"]: row["case_group"] for row in csv.DictReader(f)}
+
+
+if __name__ == "__main__":
+    import argparse
+    from LLM_Assisted_Dataset_Annotations import list_case_files
+    parser = argparse.ArgumentParser(description="Cluster near-duplicate GDPR cases with MinHash/LSH")
+    parser.add_argument("input_dir")
+    parser.add_argument("--threshold", type=float, default=SIMILARITY_THRESHOLD)
+    parser.add_argument("--output", default="case_groups.csv")
+    args = parser.parse_args()
+    save_groups(find_duplicate_groups(list_case_files(args.input_dir), threshold=args.threshold), args.output)
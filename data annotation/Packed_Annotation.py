@@ -0,0 +1,152 @@
+import os
+import json
+
+from LLM_Assisted_Dataset_Annotations import PROMPT_TEMPLATE, annotate_text, build_payload
+from Annotation_Schema import validate_annotation
+
+# 打包配置
+PACK_TOKEN_BUDGET = 12000        # 单个打包请求中案例文本的token预算
+SHORT_CASE_TOKENS = 2000         # 只有短于该长度的案例才参与打包
+MAX_CASES_PER_PACK = 8
+COMPLETION_TOKENS_PER_CASE = 450
+
+CASE_START = "<<<CASE {case_id}>>>"
+CASE_END = "<<<END CASE {case_id}>>>"
+
+# 复用单案例的12条要求，只替换开头的"一个文件一个案例"说明和结尾的输出格式
+PACKED_PROMPT_TEMPLATE = (
+    "The text below contains several independent GDPR cases. Each case starts with "
+    "<<<CASE id>>> and ends with <<<END CASE id>>>. Annotate every case separately, "
+    "using only that case's text.\n"
+    + PROMPT_TEMPLATE.replace(
+        "Return valid JSON in this structure:",
+        "Return one JSON array on a single line with exactly one object per case, in the same order "
+        "as the cases. Each object must contain \"case_id\" (the id from the delimiter) plus all "
+        "fields above. Do not return anything except the array:"
+    )
+)
+
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+def pack_files(files, token_budget=PACK_TOKEN_BUDGET, short_case_tokens=SHORT_CASE_TOKENS,
+               max_cases=MAX_CASES_PER_PACK):
+    """
+    按文件大小把短案例贪心装入打包批次（保持原有顺序），长案例单独成批
+
+    文件大小（字节）作为字符数的近似，无需预先读取全部文件。
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+    for file_path in files:
+        tokens = os.path.getsize(file_path) // 4 + 1
+        if tokens > short_case_tokens:
+            batches.append([file_path])
+            continue
+        if current and (current_tokens + tokens > token_budget or len(current) >= max_cases):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(file_path)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def build_packed_text(items):
+    """Join (case_id, text) pairs with per-case delimiters"""
+    parts = []
+    for case_id, text in items:
+        parts.append(f"{CASE_START.format(case_id=case_id)}\n{text}\n{CASE_END.format(case_id=case_id)}")
+    return "\n\n".join(parts)
+
+
+def extract_json_array(response):
+    """Extract the first JSON array from a model response"""
+    start = response.find('[')
+    if start < 0:
+        return {"error": "No JSON array found"}
+    try:
+        cases, _ = json.JSONDecoder().raw_decode(response[start:])
+    except json.JSONDecodeError as e:
+        return {"error": f"JSON decode error: {e}"}
+    if not isinstance(cases, list):
+        return {"error": "Response is not a JSON array"}
+    return {"cases": cases}
+
+
+def fan_out(result, case_ids):
+    """
+    把打包结果拆回各案例，返回 {case_id: annotations 或 None}
+
+    优先按 case_id 对应；没有 case_id 时要求数组长度一致并按位置对应。
+    无法对应或未通过 schema 校验的条目为 None，由调用方回退为单案例请求。
+    """
+    fanned = {case_id: None for case_id in case_ids}
+    cases = result.get("cases") if isinstance(result, dict) else None
+    if not isinstance(cases, list):
+        return fanned
+
+    by_id = {}
+    for item in cases:
+        if isinstance(item, dict) and "case_id" in item:
+            by_id[str(item["case_id"])] = item
+    if set(by_id) & set(fanned):
+        matched = by_id
+    elif len(cases) == len(case_ids):
+        matched = dict(zip(case_ids, cases))
+    else:
+        return fanned
+
+    for case_id in case_ids:
+        item = matched.get(case_id)
+        if isinstance(item, dict) and "error" not in item:
+            record, errors = validate_annotation(item)
+            if not errors:
+                fanned[case_id] = record
+    return fanned
+
+
+def packed_request_tokens(items):
+    """Token budget of one packed request (prompt + all cases + completion)"""
+    return (estimate_tokens(PACKED_PROMPT_TEMPLATE) + sum(estimate_tokens(text) for _, text in items)
+            + COMPLETION_TOKENS_PER_CASE * len(items))
+
+
+def request_packed(items, api_url=None, annotate_fn=annotate_text):
+    """
+    Send one packed request for (case_id, text) pairs; returns {case_id: annotations or None}
+
+    无效的数组不重发整个打包请求（重发的花费是单案例的数倍），无效条目直接由调用方回退为单案例请求。
+    """
+    max_tokens = COMPLETION_TOKENS_PER_CASE * len(items)
+    result = annotate_fn(
+        build_packed_text(items), api_url,
+        payload_fn=lambda text: build_payload(text, PACKED_PROMPT_TEMPLATE, max_tokens),
+        parse_fn=extract_json_array,
+        retry_invalid=False
+    )
+    return fan_out(result, [case_id for case_id, _ in items])
+
+
+def annotate_packed(items, api_url=None, annotate_fn=annotate_text):
+    """
+    Annotate several short cases in one request; returns {case_id: annotations}
+
+    整个数组无效时所有案例回退为单案例请求，部分条目缺失时只回退缺失的案例。
+    """
+    if len(items) == 1:
+        return {items[0][0]: annotate_fn(items[0][1], api_url)}
+
+    fanned = request_packed(items, api_url, annotate_fn)
+    missing = [case_id for case_id, annotations in fanned.items() if annotations is None]
+    if missing:
+        print(f"打包结果中 {len(missing)}/{len(items)} 个案例无效，回退为单案例请求")
+        texts = dict(items)
+        for case_id in missing:
+            fanned[case_id] = annotate_fn(texts[case_id], api_url)
+    return fanned
@@ -0,0 +1,187 @@
+import re
+import json
+import math
+import random
+from collections import Counter
+
+# PROMPT_TEMPLATE 中字段的补充词表（模板中引号内的词会自动加入）
+BASE_VOCABULARY = [
+    "gdpr", "article", "art", "regulation", "fine", "fined", "penalty", "sanction", "eur", "euro", "€",
+    "amount", "million", "consent", "child", "children", "minor", "school", "legitimate", "interest",
+    "contract", "legal", "obligation", "vital", "public", "task", "breach", "security", "principle",
+    "minimisation", "minimization", "subject", "rights", "access", "erasure", "objection", "dpo",
+    "officer", "obligation", "special", "category", "health", "biometric", "genetic", "religion",
+    "criminal", "conviction", "financial", "bank", "location", "address", "birth", "identity",
+    "marketing", "cctv", "camera", "surveillance", "employee", "employer", "hospital", "patient",
+    "insurance", "website", "cookies", "affected", "records", "persons", "individuals", "volume",
+    "violation", "infringement", "infringed", "unlawful", "lawful", "decision", "authority",
+    "exception", "journalism", "freedom", "expression", "national", "investigation", "police",
+]
+
+TOKEN_PATTERN = re.compile(r"[a-z€]+|\d+", re.IGNORECASE)
+# 文章引用、金额、年份等强信号
+SIGNAL_PATTERNS = [
+    (re.compile(r'\bArt(?:icle|\.)?\s*\d+', re.IGNORECASE), 3.0),
+    (re.compile(r'(?:€|EUR|euro|USD|\$|£|GBP)\s*\d|\d[\d,. ]*\s*(?:€|EUR|euros?|million)', re.IGNORECASE), 3.0),
+    (re.compile(r'\b\d[\d,. ]*\s*(?:data subjects|persons|individuals|records|customers|employees)', re.IGNORECASE), 2.0),
+]
+
+DEFAULT_KEEP_RATIO = 0.4
+MIN_PASSAGE_CHARS = 40
+
+
+def build_field_vocabulary(prompt_template):
+    """Field vocabulary: quoted terms from the prompt template plus BASE_VOCABULARY"""
+    vocabulary = set(BASE_VOCABULARY)
+    for phrase in re.findall(r'"([^"{}]+)"', prompt_template):
+        vocabulary.update(t.lower() for t in TOKEN_PATTERN.findall(phrase) if len(t) > 2)
+    return vocabulary
+
+
+def split_passages(text):
+    """Split text into paragraphs; very long paragraphs are cut into ~5 sentence windows"""
+    passages = []
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= 2000:
+            passages.append(paragraph)
+            continue
+        sentences = re.split(r'(?<=[.!?])\s+', paragraph)
+        for i in range(0, len(sentences), 5):
+            passages.append(" ".join(sentences[i:i + 5]))
+    return passages
+
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+class RelevanceFilter:
+    """
+    抽取式相关段落过滤器
+
+    对每个段落按字段词表做本地 TF-IDF 打分（IDF 在案例内部的段落间计算，
+    再加上条款引用/金额/人数等强信号加权），保留首段（机构/国家/日期）、
+    末段（裁决/罚款）以及得分最高的段落，直到达到 keep_ratio 的字符预算，
+    并保持原文顺序。每个案例的token缩减情况记录在 self.stats。
+    """
+
+    def __init__(self, prompt_template, keep_ratio=DEFAULT_KEEP_RATIO, min_chars=4000):
+        self.vocabulary = build_field_vocabulary(prompt_template)
+        self.keep_ratio = keep_ratio
+        self.min_chars = min_chars  # 短于该长度的案例不过滤
+        self.stats = []
+
+    def score_passages(self, passages):
+        tokenized = [[t.lower() for t in TOKEN_PATTERN.findall(p)] for p in passages]
+        doc_freq = Counter()
+        for tokens in tokenized:
+            doc_freq.update(set(t for t in tokens if t in self.vocabulary))
+        n = len(passages)
+        scores = []
+        for passage, tokens in zip(passages, tokenized):
+            counts = Counter(t for t in tokens if t in self.vocabulary)
+            score = sum((1 + math.log(c)) * math.log(1 + n / doc_freq[t]) for t, c in counts.items())
+            for pattern, weight in SIGNAL_PATTERNS:
+                score += weight * len(pattern.findall(passage))
+            # 按长度归一，避免长段落天然占优
+            scores.append(score / math.sqrt(max(len(tokens), 1)))
+        return scores
+
+    def filter(self, text, case_id=None):
+        """Return the filtered text; per-case statistics are appended to self.stats"""
+        passages = split_passages(text)
+        if len(text) <= self.min_chars or len(passages) <= 3:
+            kept_text = text
+        else:
+            scores = self.score_passages(passages)
+            budget = max(self.min_chars, int(len(text) * self.keep_ratio))
+            keep = {0, len(passages) - 1}
+            used = len(passages[0]) + len(passages[-1])
+            ranked = sorted(range(1, len(passages) - 1), key=lambda i: (-scores[i], i))
+            for i in ranked:
+                if scores[i] <= 0 or len(passages[i]) < MIN_PASSAGE_CHARS:
+                    continue
+                if used + len(passages[i]) > budget:
+                    continue
+                keep.add(i)
+                used += len(passages[i])
+            kept_text = "\n\n".join(passages[i] for i in sorted(keep))
+
+        original_tokens = estimate_tokens(text)
+        kept_tokens = estimate_tokens(kept_text)
+        self.stats.append({
+            "case": case_id,
+            "original_chars": len(text),
+            "kept_chars": len(kept_text),
+            "original_tokens": original_tokens,
+            "kept_tokens": kept_tokens,
+            "reduction": 1 - kept_tokens / original_tokens
+        })
+        return kept_text
+
+    def report(self, output_file=None):
+        """Print a token-reduction summary and optionally write per-case stats as JSONL"""
+        if not self.stats:
+            print("没有过滤统计")
+            return {}
+        original = sum(s["original_tokens"] for s in self.stats)
+        kept = sum(s["kept_tokens"] for s in self.stats)
+        reductions = sorted(s["reduction"] for s in self.stats)
+        summary = {
+            "cases": len(self.stats),
+            "original_tokens": original,
+            "kept_tokens": kept,
+            "total_reduction": 1 - kept / original,
+            "median_reduction": reductions[len(reductions) // 2]
+        }
+        print(f"相关段落过滤: {summary['cases']} 个案例，估计 tokens {original} -> {kept} "
+              f"（总体减少 {summary['total_reduction']:.1%}，中位数 {summary['median_reduction']:.1%}）")
+        if output_file:
+            with open(output_file, 'w', encoding='utf-8') as f:
+                for s in self.stats:
+                    f.write(json.dumps(s, ensure_ascii=False) + "\n")
+            print(f"逐案例统计已保存至 {output_file}")
+        return summary
+
+
+def _normalise(value):
+    if isinstance(value, list):
+        return sorted(_normalise(v) for v in value)
+    return str(value).strip().lower()
+
+
+def agreement_check(files, relevance_filter, annotate_fn, sample_size=20, seed=42):
+    """
+    在抽样案例上比较全文标注与过滤后标注的一致性
+
+    Returns:
+        {"cases": n, "overall": 总体一致率, "fields": {字段: 一致率}}
+    """
+    rng = random.Random(seed)
+    sample = rng.sample(list(files), min(sample_size, len(files)))
+    agree = Counter()
+    total = Counter()
+    compared = 0
+    for file_path in sample:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        full = annotate_fn(text)
+        filtered = annotate_fn(relevance_filter.filter(text, case_id=file_path))
+        if "error" in full or "error" in filtered:
+            print(f"跳过 {file_path}：标注失败")
+            continue
+        compared += 1
+        for field in set(full) | set(filtered):
+            total[field] += 1
+            if _normalise(full.get(field)) == _normalise(filtered.get(field)):
+                agree[field] += 1
+
+    fields = {field: agree[field] / total[field] for field in sorted(total)}
+    overall = sum(agree.values()) / sum(total.values()) if total else 0.0
+    print(f"\n一致性检查（{compared} 个案例）: 总体一致率 {overall:.1%}")
+    for field, rate in sorted(fields.items(), key=lambda x: x[1]):
+        print(f"  {field}: {rate:.1%}")
+    return {"cases": compared, "overall": overall, "fields": fields}
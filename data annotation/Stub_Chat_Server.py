@@ -0,0 +1,137 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 默认返回的标注结果（一行JSON，字段与PROMPT_TEMPLATE一致）
+DEFAULT_CONTENT = json.dumps({
+    "data_category_Basic_personal_data": 1,
+    "data_category_Special_category_data": 0,
+    "data_category_Criminal_data": 0,
+    "data_category_Financial_location_data": 0,
+    "data_category_Children_data": 0,
+    "data_processing_basis_Legitimate_interest": 1,
+    "data_processing_basis_contract_performance": 0,
+    "data_processing_basis_Consent": 0,
+    "data_processing_basis_Legal_obligation": 0,
+    "data_processing_basis_Protection_of_vital_interests": 0,
+    "data_processing_basis_Performance_of_public_task": 0,
+    "fine_amount": "200,000",
+    "country": "Germany",
+    "company_industry": "Marketing",
+    "gdpr_clause": "Article 6(1)(f)",
+    "gdpr_conflict": "No conflict",
+    "violation_nature_Breach_of_Data_processing_principle": 1,
+    "violation_nature_Violation_of_data_subject_rights": 0,
+    "violation_nature_Breach_of_data_security": 0,
+    "violation_nature_Violation_of_Data_processing_obligation": 0,
+    "free_speech_exception": 0,
+    "country_security_exception": 0,
+    "Criminal_investigation_exception": 0,
+    "violation_result": 1,
+    "Affected_data_volume": "unspecific",
+    "Date": 2021
+})
+
+
+class StubChatHandler(BaseHTTPRequestHandler):
+    """Mimic the /v1/chat/completions endpoint with a canned answer"""
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        server = self.server
+
+        with server.lock:
+            server.request_count += 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            fail = server.request_count <= server.fail_first
+        try:
+            if fail:
+                # 模拟限流/服务端繁忙
+                self.send_response(server.fail_status)
+                if server.retry_after is not None:
+                    self.send_header("Retry-After", str(server.retry_after))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            if server.delay:
+                time.sleep(server.delay)
+
+            prompt = "".join(m.get("content", "") for m in body.get("messages", []))
+            content = server.responder(body) if server.responder else server.content
+            data = {
+                "id": f"stub-{server.request_count}",
+                "object": "chat.completion",
+                "model": body.get("model", "stub"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop"
+                }],
+                "usage": {
+                    "prompt_tokens": len(prompt) // 4,
+                    "completion_tokens": len(content) // 4,
+                    "total_tokens": len(prompt) // 4 + len(content) // 4
+                }
+            }
+            payload = json.dumps(data).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, format, *args):
+        # 静默，避免刷屏
+        pass
+
+
+def start_stub_server(port=0, content=DEFAULT_CONTENT, delay=0.0, responder=None,
+                      fail_first=0, fail_status=429, retry_after=None):
+    """
+    在后台线程启动本地桩服务器
+
+    Args:
+        port: 监听端口，0表示随机端口
+        content: 固定返回的 message.content
+        delay: 每个请求的模拟延迟（秒）
+        responder: 可选回调 responder(request_body) -> content，用于按请求定制返回
+        fail_first: 前N个请求返回 fail_status（默认429）
+        retry_after: 失败响应附带的 Retry-After 秒数
+
+    Returns:
+        (server, url)，用完后调用 server.shutdown()
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubChatHandler)
+    server.daemon_threads = True
+    server.content = content
+    server.delay = delay
+    server.responder = responder
+    server.fail_first = fail_first
+    server.fail_status = fail_status
+    server.retry_after = retry_after
+    server.lock = threading.Lock()
+    server.request_count = 0
+    server.in_flight = 0
+    server.max_in_flight = 0
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+    return server, url
+
+
+if __name__ == "__main__":
+    server, url = start_stub_server(port=8000, delay=1.0)
+    print(f"桩服务器已启动: {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
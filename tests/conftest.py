@@ -0,0 +1,9 @@
+import os
+import sys
+
+# 脚本目录不是包，测试直接导入其中的模块
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ("data annotation", "FINAL_CODE"):
+    path = os.path.join(ROOT, directory)
+    if path not in sys.path:
+        sys.path.insert(0, path)
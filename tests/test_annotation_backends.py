@@ -0,0 +1,126 @@
+import os
+import json
+
+import pytest
+
+pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+tokenizers = pytest.importorskip("tokenizers")
+
+from Annotation_Backends import LocalHFBackend, RemoteApiBackend, get_backend, process_cases_with_backend
+from LLM_Assisted_Dataset_Annotations import PROMPT_TEMPLATE
+from Stub_Chat_Server import DEFAULT_CONTENT, start_stub_server
+
+CASES = [
+    "The controller processed customer addresses for marketing without consent.",
+    "A hospital lost unencrypted patient records.",
+    "The school published pupils' photos online.",
+]
+
+
+@pytest.fixture(scope="module")
+def tiny_model_dir(tmp_path_factory):
+    """Tiny random GPT-2 and a word-level tokenizer trained on the prompt, built offline"""
+    from tokenizers import Tokenizer, models, pre_tokenizers, trainers
+
+    directory = str(tmp_path_factory.mktemp("tiny_causal_lm"))
+    tokenizer = Tokenizer(models.WordLevel(unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer.train_from_iterator([PROMPT_TEMPLATE, DEFAULT_CONTENT] + CASES,
+                                  trainers.WordLevelTrainer(special_tokens=["[UNK]", "[PAD]", "</s>"]))
+    tokenizer = transformers.PreTrainedTokenizerFast(tokenizer_object=tokenizer, unk_token="[UNK]",
+                                                     pad_token="[PAD]", eos_token="</s>")
+    tokenizer.save_pretrained(directory)
+
+    transformers.set_seed(0)
+    config = transformers.GPT2Config(vocab_size=len(tokenizer), n_positions=128, n_embd=32, n_layer=2, n_head=2,
+                                     bos_token_id=tokenizer.eos_token_id, eos_token_id=tokenizer.eos_token_id,
+                                     pad_token_id=tokenizer.pad_token_id)
+    transformers.GPT2LMHeadModel(config).save_pretrained(directory)
+    return directory
+
+
+@pytest.fixture
+def local_backend(tiny_model_dir):
+    # 完整指令模板远超这个小模型的 128 个位置，这里只用微调格式的标记
+    return get_backend("local", model_path=tiny_model_dir, batch_size=2, max_new_tokens=6, max_input_tokens=64,
+                       use_instructions=False)
+
+
+def write_cases(directory):
+    os.makedirs(directory, exist_ok=True)
+    for n, text in enumerate(CASES, 1):
+        with open(os.path.join(directory, f"case_{n}.txt"), "w", encoding="utf-8") as f:
+            f.write(text)
+    return directory
+
+
+def test_local_annotate_batch(local_backend):
+    results = local_backend.annotate_batch(CASES)
+
+    assert len(results) == len(CASES)
+    # 随机模型的输出不是合法标注：保留错误和原始输出，不进入数据集
+    assert all("error" in result and "raw_output" in result for result in results)
+    # 贪心解码可复现
+    assert local_backend.annotate_batch(CASES) == results
+
+
+def test_local_annotate_batch_parses_valid_output(local_backend, monkeypatch):
+    monkeypatch.setattr(local_backend, "generate", lambda prompts: [DEFAULT_CONTENT] * len(prompts))
+
+    results = local_backend.annotate_batch(CASES[:2])
+
+    assert [result["fine_amount"] for result in results] == [200000, 200000]
+
+
+def test_long_case_keeps_the_prompt_template(local_backend, monkeypatch):
+    long_case = " ".join([CASES[0]] * 40)
+    prompts = []
+    monkeypatch.setattr(local_backend, "generate", lambda batch: prompts.extend(batch) or [DEFAULT_CONTENT] * len(batch))
+
+    results = local_backend.annotate_batch([long_case, CASES[1]])
+
+    assert [result["fine_amount"] for result in results] == [200000, 200000]
+    assert prompts[1] == local_backend.build_prompt(CASES[1])
+    # 截断的是案例结尾，提示的开头和 ###Judgement 标记都保留
+    assert prompts[0].startswith("###GDPR related case\nThe controller processed")
+    assert prompts[0].endswith("\n###Judgement\n")
+    assert len(local_backend.tokenizer(prompts[0])["input_ids"]) <= local_backend.max_input_tokens
+    # 真实生成同样走截断后的提示
+    assert len(LocalHFBackend.generate(local_backend, prompts)) == 2
+
+
+def test_long_case_keeps_the_instructions(tiny_model_dir):
+    backend = get_backend("local", model_path=tiny_model_dir, max_input_tokens=2000)
+    prompt = backend.build_prompt(backend.fit_text(" ".join([CASES[0]] * 200)))
+
+    assert "Return valid JSON in this structure:" in prompt and prompt.endswith("###Judgement\n")
+    assert len(backend.tokenizer(prompt)["input_ids"]) <= 2000
+    with pytest.raises(ValueError):
+        get_backend("local", model_path=tiny_model_dir, max_input_tokens=64).fit_text(CASES[0] * 50)
+
+
+def test_process_cases_with_local_backend(local_backend, tmp_path):
+    input_dir = write_cases(str(tmp_path / "cases"))
+
+    process_cases_with_backend(input_dir, local_backend)
+
+    for n in range(1, len(CASES) + 1):
+        with open(os.path.join(input_dir, f"case_{n}.json"), encoding="utf-8") as f:
+            record = json.load(f)
+        assert record["metadata"]["source_file"] == f"case_{n}.txt"
+        assert "raw_output" in record["annotations"]
+
+
+def test_remote_backend_close():
+    server, url = start_stub_server()
+    backend = RemoteApiBackend(api_url=url, batch_size=2)
+    try:
+        results = backend.annotate_batch(CASES)
+    finally:
+        backend.close()
+        server.shutdown()
+
+    assert [result["country"] for result in results] == ["Germany"] * len(CASES)
+    with pytest.raises(RuntimeError):
+        backend.annotate_batch(CASES)
@@ -0,0 +1,53 @@
+import os
+import json
+
+import Annotation_Scheduler
+from Annotation_Scheduler import AnnotationBudget, schedule_files
+from Stub_Chat_Server import DEFAULT_CONTENT
+
+
+def test_labels_come_from_normalised_annotations(tmp_path, monkeypatch):
+    files = []
+    for n in range(1, 5):
+        path = os.path.join(str(tmp_path), f"case_{n}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"case {n}")
+        files.append(path)
+    # 旧记录：罚款是原始字符串，标记是字符串
+    legacy = dict(json.loads(DEFAULT_CONTENT), fine_amount="200,000", violation_result="1")
+    no_fine = dict(json.loads(DEFAULT_CONTENT), fine_amount="0", violation_result="0")
+    annotated = {files[0]: legacy, files[1]: no_fine}
+    captured = {}
+
+    def fake_scores(labeled_texts, labels, unlabeled_texts, targets):
+        captured["labels"] = labels
+        return [0.0] * len(unlabeled_texts)
+
+    monkeypatch.setattr(Annotation_Scheduler, "score_uncertainty", fake_scores)
+    pending, _ = schedule_files(files, annotated=annotated, min_labeled=2)
+
+    assert pending == files[2:]
+    assert captured["labels"] == [{"violation_result": 1, "fine_amount": 1},
+                                  {"violation_result": 0, "fine_amount": 0}]
+
+
+def test_budget_take_never_exceeds_max_cases():
+    budget = AnnotationBudget(max_cases=2)
+
+    assert not budget.take(3)
+    assert budget.remaining() == 2 and budget.dispatched == 0
+    assert budget.take(2)
+    assert budget.remaining() == 0
+    assert not budget.take(1)
+    assert budget.dispatched == 2
+    assert budget.exhausted()
+    # 已计入预算的案例（打包回退）只受花费/时间限制
+    assert not budget.exhausted(reserved=True)
+
+
+def test_reserved_cases_stop_at_the_time_limit():
+    budget = AnnotationBudget(max_cases=5, max_seconds=0)
+
+    assert budget.exhausted(reserved=True)
+    assert budget.remaining() == 5 and not budget.take(1)
+    assert AnnotationBudget().remaining() is None
@@ -0,0 +1,33 @@
+import pytest
+
+from Annotation_Schema import extract_json_object, parse_amount
+
+
+@pytest.mark.parametrize("response, expected", [
+    ('{"a": 1}', {"a": 1}),
+    ('Here is {the answer: {"a": 1}', {"a": 1}),
+    ('Result {not json} then {"a": 2} done', {"a": 2}),
+    ('```json\n{"a": "x } y", "b": {"c": 3}}\n```', {"a": "x } y", "b": {"c": 3}}),
+])
+def test_extract_json_object(response, expected):
+    assert extract_json_object(response) == (expected, None)
+
+
+def test_extract_json_object_errors():
+    assert extract_json_object('{"a": {"b": 1') == (None, "Unterminated JSON object")
+    assert extract_json_object("no braces") == (None, "No valid JSON found")
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("200,000", 200000.0),
+    ("€1,000.50", 1000.5),
+    ("1.000,50 EUR", 1000.5),
+    ("1,234,567.89", 1234567.89),
+    ("1.234.567", 1234567.0),
+    ("12,5", 12.5),
+    ("EUR 1.5 million", 1500000.0),
+    (9000, 9000.0),
+    ("Not specified", None),
+])
+def test_parse_amount(value, expected):
+    assert parse_amount(value) == expected
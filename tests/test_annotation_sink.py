@@ -0,0 +1,44 @@
+import json
+import math
+
+import pandas as pd
+
+from Annotation_Sink import JsonlSink, export_dataset
+from Stub_Chat_Server import DEFAULT_CONTENT
+
+
+def annotation(**fields):
+    return dict(json.loads(DEFAULT_CONTENT), **fields)
+
+
+def test_reannotated_case_replaces_exported_row(tmp_path):
+    jsonl, csv_path, parquet_dir = str(tmp_path / "a.jsonl"), str(tmp_path / "t.csv"), str(tmp_path / "parquet")
+    sink = JsonlSink(jsonl)
+    sink.write("case_1.txt", "text", annotation(country="Germany"))
+    sink.write("case_2.txt", "text", annotation(country="France"))
+    assert export_dataset(jsonl, csv_path, parquet_dir) == 2
+
+    sink.write("case_1.txt", "text", annotation(country="Spain"))
+    sink.write("case_3.txt", "text", annotation(country="Italy"))
+    sink.close()
+    export_dataset(jsonl, csv_path, parquet_dir)
+
+    table = pd.read_csv(csv_path)
+    assert list(table["country"]) == ["Spain", "France", "Italy"]
+    assert list(pd.read_parquet(parquet_dir)["country"]) == ["Spain", "France", "Italy"]
+    # 没有新记录时不再追加
+    assert export_dataset(jsonl, csv_path, parquet_dir) == 0
+    assert len(pd.read_csv(csv_path)) == 3
+
+
+def test_unspecified_fine_is_nan(tmp_path):
+    jsonl, csv_path = str(tmp_path / "a.jsonl"), str(tmp_path / "t.csv")
+    sink = JsonlSink(jsonl)
+    sink.write("case_1.txt", "text", annotation(fine_amount="Not specified"))
+    sink.write("case_2.txt", "text", annotation(fine_amount=0))
+    sink.close()
+    export_dataset(jsonl, csv_path)
+
+    fines = list(pd.read_csv(csv_path)["fine_amount"])
+    assert math.isnan(fines[0])
+    assert fines[1] == 0
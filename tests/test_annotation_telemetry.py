@@ -0,0 +1,37 @@
+import pytest
+
+from Annotation_Telemetry import RunTelemetry, percentile
+
+
+@pytest.mark.parametrize("values, q, expected", [
+    (range(1, 11), 50, 5),
+    (range(1, 11), 95, 10),
+    (range(1, 101), 95, 95),
+    (range(1, 101), 7, 7),
+    (range(1, 101), 29, 29),
+    (range(1, 101), 99, 99),
+    (range(1, 5), 25, 1),
+    (range(1, 5), 26, 2),
+    ([3.0], 50, 3.0),
+    ([5, 1, 4, 2, 3], 0, 1),
+    ([5, 1, 4, 2, 3], 100, 5),
+])
+def test_nearest_rank(values, q, expected):
+    assert percentile(list(values), q) == expected
+
+
+def test_empty():
+    assert percentile([], 50) is None
+
+
+def test_summary_percentiles():
+    telemetry = RunTelemetry()
+    # 乱序写入：分位数按排序后的名次取
+    for latency in [(n * 37) % 100 + 1 for n in range(100)]:
+        telemetry.record_request(latency / 100.0, 200, "ok", 1)
+    summary = telemetry.summary()
+
+    assert summary["requests"] == 100
+    assert summary["latency_p50"] == 0.5
+    assert summary["latency_p95"] == 0.95
+    assert summary["latency_p99"] == 0.99
@@ -0,0 +1,157 @@
+import os
+import re
+import json
+import time
+import asyncio
+
+import pytest
+
+import LLM_Assisted_Dataset_Annotations as annotations_module
+from Annotation_Scheduler import AnnotationBudget
+from Async_Annotation_Engine import AsyncAnnotationEngine, process_cases_async
+from Stub_Chat_Server import DEFAULT_CONTENT, start_stub_server
+
+CASE_TEXT = "CASE-{n}: the controller processed customer addresses for marketing without a legal basis."
+
+
+def case_responder(body):
+    """Canned answer whose country depends on the case number, so outputs differ per case"""
+    prompt = "".join(m.get("content", "") for m in body.get("messages", []))
+    number = re.search(r"CASE-(\d+)", prompt).group(1)
+    return json.dumps(dict(json.loads(DEFAULT_CONTENT), country=f"Country {number}"))
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(**kwargs):
+        server, url = start_stub_server(responder=case_responder, **kwargs)
+        servers.append(server)
+        return server, url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def write_cases(directory, count):
+    os.makedirs(directory, exist_ok=True)
+    for n in range(1, count + 1):
+        with open(os.path.join(directory, f"case_{n}.txt"), "w", encoding="utf-8") as f:
+            f.write(CASE_TEXT.format(n=n))
+    return directory
+
+
+def read_outputs(directory):
+    outputs = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".json"):
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                outputs[name] = json.load(f)
+    return outputs
+
+
+def test_concurrency_cap(stub, tmp_path):
+    server, url = stub(delay=0.2)
+    input_dir = write_cases(str(tmp_path / "cases"), 9)
+
+    results = process_cases_async(input_dir, concurrency=3, rpm=0, tpm=0, api_url=url)
+
+    assert len(results) == 9
+    assert server.request_count == 9
+    assert server.max_in_flight == 3
+
+
+def test_rpm_limit_throttles(stub, tmp_path):
+    server, url = stub()
+    input_dir = write_cases(str(tmp_path / "cases"), 31)
+
+    start = time.monotonic()
+    results = process_cases_async(input_dir, concurrency=8, rpm=30, tpm=0, api_url=url)
+    elapsed = time.monotonic() - start
+
+    # 桶容量为 30 个请求，第 31 个请求要等 60/30 = 2 秒
+    assert len(results) == 31
+    assert elapsed >= 1.8
+
+
+def test_tpm_limit_throttles(stub, tmp_path):
+    server, url = stub()
+    input_dir = write_cases(str(tmp_path / "cases"), 8)
+    engine = AsyncAnnotationEngine(concurrency=1)
+    with open(os.path.join(input_dir, "case_1.txt"), encoding="utf-8") as f:
+        per_request = engine.request_tokens(f.read())
+    engine.close()
+    # 总 token 比每分钟预算多 5%，超出部分按 tpm/60 的速度补充
+    tpm = int(8 * per_request / 1.05)
+    expected_wait = (8 * per_request - tpm) * 60.0 / tpm
+
+    start = time.monotonic()
+    results = process_cases_async(input_dir, concurrency=8, rpm=0, tpm=tpm, api_url=url)
+    elapsed = time.monotonic() - start
+
+    assert len(results) == 8
+    assert elapsed >= 0.9 * expected_wait
+
+
+def test_output_matches_sequential(stub, tmp_path, monkeypatch):
+    server, url = stub(delay=0.05)
+    sequential_dir = write_cases(str(tmp_path / "sequential"), 6)
+    concurrent_dir = write_cases(str(tmp_path / "concurrent"), 6)
+    monkeypatch.setattr(annotations_module, "DEEPSEEK_API_URL", url)
+
+    annotations_module.process_cases(sequential_dir)
+    process_cases_async(concurrent_dir, concurrency=4, api_url=url)
+
+    sequential, concurrent = read_outputs(sequential_dir), read_outputs(concurrent_dir)
+    assert len(sequential) == 6
+    assert concurrent == sequential
+    assert {record["annotations"]["country"] for record in concurrent.values()} == {f"Country {n}" for n in range(1, 7)}
+
+
+def test_packed_fallback_respects_budget(stub, tmp_path):
+    # 打包请求返回单个对象而不是数组：全部条目无效，需要回退为单案例请求
+    server, url = stub()
+    input_dir = write_cases(str(tmp_path / "cases"), 3)
+    files = annotations_module.list_case_files(input_dir)
+    engine = AsyncAnnotationEngine(concurrency=2, api_url=url, pack_budget=12000,
+                                   budget=AnnotationBudget(max_cases=2, max_seconds=0))
+    try:
+        results = asyncio.run(engine.run(files))
+    finally:
+        engine.close()
+
+    # 时间预算已用尽：不发任何请求
+    assert sorted(results) == sorted((f, None, None) for f in files)
+    assert engine.over_budget == 3
+    assert server.request_count == 0
+
+
+def test_pack_is_cut_to_the_case_budget(tmp_path):
+    sent = []
+
+    def recording_responder(body):
+        prompt = "".join(m.get("content", "") for m in body.get("messages", []))
+        sent.append(set(re.findall(r"CASE-(\d+)", prompt)))
+        return case_responder(body)
+
+    server, url = start_stub_server(responder=recording_responder)
+    input_dir = write_cases(str(tmp_path / "cases"), 3)
+    files = annotations_module.list_case_files(input_dir)
+    engine = AsyncAnnotationEngine(concurrency=2, api_url=url, pack_budget=12000,
+                                   budget=AnnotationBudget(max_cases=2))
+    try:
+        results = asyncio.run(engine.run(files))
+    finally:
+        engine.close()
+        server.shutdown()
+
+    # 3 个案例的包只派发 2 个；打包结果无效时，这 2 个已计入预算的案例按单案例回退
+    assert set().union(*sent) == {"1", "2"}
+    # 无效的打包结果不重发整个包：1 个打包请求 + 2 个单案例请求
+    assert [len(cases) for cases in sent] == [2, 1, 1]
+    assert engine.budget.dispatched == 2
+    assert engine.over_budget == 1
+    annotated = {os.path.basename(f): a["country"] for f, _, a in results if a is not None}
+    assert annotated == {"case_1.txt": "Country 1", "case_2.txt": "Country 2"}
@@ -0,0 +1,31 @@
+import os
+
+from Corpus_Auditor import audit_corpus
+
+
+def make_tree(root):
+    os.makedirs(os.path.join(root, "nested"))
+    files = {
+        "case_1.json": '{"annotations": {"error": "Max retries exceeded"}}',
+        "case_2.json": '{"annotations": {"violation_result": 1}}',
+        os.path.join("nested", "case_3.json"): '{"annotations": {"error": "Max retries exceeded"}}',
+    }
+    for name, content in files.items():
+        with open(os.path.join(root, name), "w", encoding="utf-8") as f:
+            f.write(content)
+
+
+def test_audit_corpus_recursive(tmp_path):
+    make_tree(str(tmp_path))
+    report = audit_corpus(str(tmp_path), markers=("Max retries exceeded",))
+
+    assert sorted(report["error_files"]) == ["case_1.json", os.path.join("nested", "case_3.json")]
+    assert report["files"] == 3
+
+
+def test_audit_corpus_top_level_only(tmp_path):
+    make_tree(str(tmp_path))
+    report = audit_corpus(str(tmp_path), markers=("Max retries exceeded",), recursive=False)
+
+    assert sorted(report["error_files"]) == ["case_1.json"]
+    assert report["files"] == 2
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+datasets = pytest.importorskip("datasets")
+
+from embedding_cache import FrozenEncoderCache
+from multi_task import MultiTaskModel, MISSING_LABEL
+
+CONFIG = dict(vocab_size=50, hidden_size=16, num_hidden_layers=2, num_attention_heads=2, intermediate_size=32)
+
+
+def corpus(n=40, seed=0):
+    rng = np.random.RandomState(seed)
+    lengths = rng.randint(4, 12, size=n)
+    ids = [[2] + list(rng.randint(5, 50, size=length - 1)) for length in lengths]
+    return datasets.Dataset.from_dict({"input_ids": ids, "attention_mask": [[1] * len(x) for x in ids]})
+
+
+@pytest.mark.parametrize("unfreeze_top", [0, 1])
+def test_multi_task_model_with_missing_labels(tmp_path, unfreeze_top):
+    torch.manual_seed(0)
+    config = transformers.BertConfig(**CONFIG)
+    model = MultiTaskModel.from_config(config, {"violation_result": 2, "fine_bracket": 5})
+    tokenized = corpus()
+    labels = np.tile([0, 1], 20)
+    labels[:6] = MISSING_LABEL
+    rows = np.arange(len(labels))
+
+    cache = FrozenEncoderCache(model, str(tmp_path), unfreeze_top=unfreeze_top).build(tokenized, "corpus")
+    result, head = cache.train_fold(rows[:30], rows[30:], labels, num_labels=2, epochs=2)
+
+    assert cache.base is model.encoder
+    assert result["eval_results"]["epoch"] in (1, 2)
+    # 编码一次后缓存与直接前向一致
+    if not unfreeze_top:
+        with torch.no_grad():
+            direct = model.encoder(input_ids=torch.tensor([tokenized[0]["input_ids"]])).last_hidden_state[0, 0]
+        np.testing.assert_allclose(cache.features[0], direct.numpy(), atol=1e-5)
+
+
+def test_missing_labels_are_left_out_of_the_fold(tmp_path):
+    torch.manual_seed(0)
+    model = transformers.BertForSequenceClassification(transformers.BertConfig(num_labels=2, **CONFIG))
+    labels = np.tile([0, 1], 20)
+    labels[30:] = MISSING_LABEL
+    cache = FrozenEncoderCache(model, str(tmp_path)).build(corpus(), "corpus")
+
+    # 验证集后半未知：-100 的行不参与训练和评估，否则 CrossEntropyLoss 会报越界
+    result, _ = cache.train_fold(np.arange(40), np.arange(20, 40), labels, num_labels=2, epochs=1)
+
+    assert 0.0 <= result["eval_results"]["eval_f1"] <= 1.0
@@ -0,0 +1,35 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from feature_store import load_csv_frame, load_encoded, legacy_encoded, sniff_separator
+
+DATASET = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Dataset", "FINAL_dataset.csv")
+
+
+def test_store_is_written_to_the_given_directory(tmp_path):
+    source_dir = tmp_path / "dataset"
+    source_dir.mkdir()
+    csv_path = str(source_dir / "FINAL_dataset.csv")
+    shutil.copy(DATASET, csv_path)
+    store_dir = str(tmp_path / "output" / "feature_store")
+
+    frame = load_csv_frame(csv_path, store_dir)
+
+    # 数据集目录保持只读：只有原始 CSV
+    assert os.listdir(str(source_dir)) == ["FINAL_dataset.csv"]
+    assert os.path.exists(os.path.join(store_dir, "features.arrow"))
+    raw = pd.read_csv(csv_path, sep=sniff_separator(csv_path))
+    pd.testing.assert_frame_equal(frame, raw.astype({c: object for c in raw.columns if raw[c].dtype != np.int64}),
+                                  check_dtype=False)
+
+
+def test_encoded_view_matches_notebook_preprocessing(tmp_path):
+    store_dir = str(tmp_path / "feature_store")
+    load_csv_frame(DATASET, store_dir)
+
+    encoded, _ = load_encoded(store_dir)
+
+    pd.testing.assert_frame_equal(encoded, legacy_encoded(DATASET), check_dtype=False)
@@ -0,0 +1,55 @@
+import os
+
+import pandas as pd
+import pytest
+
+import feature_text
+from feature_text import check_equivalence, edge_case_frame, features_to_text, features_to_text_reference
+
+DATASET = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Dataset", "FINAL_dataset.csv")
+
+
+def prepared(data):
+    """Feature frame as prepare_data builds it: excluded columns dropped, missing values filled"""
+    frame = data.drop(columns=['fine_amount', 'gdpr_clause', 'violation_result', 'case_group'] +
+                      [c for c in data.columns if c.startswith('violation_nature_')], errors='ignore')
+    for col in frame.select_dtypes(include=['object']).columns:
+        frame[col] = frame[col].fillna('')
+    for col in frame.select_dtypes(include=['number']).columns:
+        frame[col] = frame[col].fillna(frame[col].median())
+    return frame
+
+
+@pytest.fixture(scope="module")
+def dataset():
+    return pd.read_csv(DATASET)
+
+
+@pytest.mark.parametrize("prepare", [False, True], ids=["raw", "prepared"])
+def test_edge_cases_match_reference(prepare):
+    frame = edge_case_frame()
+    assert check_equivalence(prepared(frame) if prepare else frame)
+
+
+@pytest.mark.parametrize("prepare", [False, True], ids=["raw", "prepared"])
+def test_dataset_matches_reference(dataset, prepare):
+    assert check_equivalence(prepared(dataset) if prepare else dataset)
+
+
+def test_memo_recomputes_when_frame_changes(monkeypatch):
+    monkeypatch.setattr(feature_text, "_text_cache", type(feature_text._text_cache)())
+    frame = edge_case_frame()
+    first = features_to_text(frame)
+    assert len(feature_text._text_cache) == 1
+    assert features_to_text(frame) == first and len(feature_text._text_cache) == 1
+
+    changed = frame.copy()
+    changed.loc[0, 'country'] = 'Portugal'
+    texts = features_to_text(changed)
+
+    assert len(feature_text._text_cache) == 2
+    assert texts == features_to_text_reference(changed)
+    assert "country is Portugal. " in texts[0] and texts[0] != first[0]
+    # 缓存返回副本，调用方修改结果不会污染缓存
+    texts[0] = ""
+    assert features_to_text(changed)[0] != ""
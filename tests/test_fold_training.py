@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+datasets = pytest.importorskip("datasets")
+
+from fold_training import (_ARGUMENT_FIELDS, _version_arguments, run_folds_parallel, snapshot_state, train_fold,
+                           training_arguments)
+from token_batches import _offline_model, tokenize_cached
+
+TEXTS = [f"country is {country}. Date is {year}. {flag} is true. "
+         for country in ("Spain", "Italy", "France", "Germany", "Poland")
+         for year in (2019, 2020, 2021, 2022)
+         for flag in ("data category children data", "violation rate")]
+
+
+@pytest.mark.parametrize("group_by_length", [False, True])
+def test_version_arguments_match_installed_transformers(tmp_path, group_by_length):
+    kwargs = _version_arguments(group_by_length)
+
+    assert set(kwargs) <= _ARGUMENT_FIELDS
+    args = training_arguments(str(tmp_path), 1, 4, 3e-5, 0.01, group_by_length, checkpoint_mode="memory")
+    strategy = getattr(args, "eval_strategy", None) or getattr(args, "evaluation_strategy")
+    assert str(getattr(strategy, "value", strategy)) == "epoch"
+    grouped = (getattr(args, "train_sampling_strategy", None) == "group_by_length"
+               or getattr(args, "group_by_length", False) is True)
+    assert grouped == group_by_length
+
+
+@pytest.fixture(scope="module")
+def fold_setup(tmp_path_factory):
+    torch.manual_seed(0)
+    model, tokenizer = _offline_model(TEXTS, num_labels=2, layers=2)
+    labels = [i % 2 for i in range(len(TEXTS))]
+    corpus = tokenize_cached(datasets.Dataset.from_dict({"text": TEXTS, "labels": labels}), tokenizer,
+                             str(tmp_path_factory.mktemp("tokenized")), return_length=True)
+    rows = np.random.RandomState(0).permutation(len(TEXTS))
+    first, second = np.sort(rows[:len(rows) // 2]), np.sort(rows[len(rows) // 2:])
+    return model, tokenizer, corpus, [(second, first), (first, second)]
+
+
+def jobs(output_dir, folds):
+    return [{'fold': fold + 1, 'output_dir': f"{output_dir}/fold_{fold + 1}", 'train_idx': train_idx.tolist(),
+             'val_idx': val_idx.tolist(), 'epochs': 1, 'batch_size': 8, 'learning_rate': 5e-5, 'weight_decay': 0.01,
+             'group_by_length': True, 'checkpoint_mode': "memory", 'async_saves': False}
+            for fold, (train_idx, val_idx) in enumerate(folds)]
+
+
+def test_parallel_folds_match_sequential(tmp_path, fold_setup):
+    model, tokenizer, corpus, folds = fold_setup
+    initial_state = snapshot_state(model)
+    threads = torch.get_num_threads()
+    # 每折线程数与并行 worker 相同（1），指标才可逐位比较
+    torch.set_num_threads(1)
+    try:
+        sequential = [train_fold(job, model, tokenizer, corpus.select(job['train_idx']), corpus.select(job['val_idx']),
+                                 initial_state, device="cpu")[0]
+                      for job in jobs(str(tmp_path / "sequential"), folds)]
+    finally:
+        torch.set_num_threads(threads)
+
+    parallel = run_folds_parallel(jobs(str(tmp_path / "parallel"), folds), model.config, tokenizer,
+                                  corpus.cache_files[0]['filename'], initial_state, workers=2, threads_per_worker=1)
+
+    assert [r['fold'] for r in parallel] == [1, 2]
+    for seq, par in zip(sequential, parallel):
+        metrics = {k: v for k, v in seq['eval_results'].items() if not k.endswith(("_runtime", "_per_second"))}
+        assert metrics == {k: par['eval_results'][k] for k in metrics}
+        assert {'eval_loss', 'eval_f1', 'epoch'} <= set(metrics)
@@ -0,0 +1,25 @@
+import pytest
+
+from gdpr_articles import parse_clause
+from precedent_index import parse_articles
+
+
+@pytest.mark.parametrize("clause, expected", [
+    ("Article 21(1) GDPR", ("21", "21(1)")),
+    ("Art. 5(1)(a) and (f), Art 13", ("5", "5(1)", "5(1)(a)", "5(1)(f)", "13")),
+    ("Articles 5, 6 and 7 GDPR", ("5", "6", "7")),
+    ("Article 6 para. 1 lit. a", ("6", "6(1)", "6(1)(a)")),
+    ("Article 22.2 of the LSSI", ()),
+])
+def test_parse_clause(clause, expected):
+    assert parse_clause(clause) == expected
+
+
+@pytest.mark.parametrize("clause, expected", [
+    ("Articles 5, 6 and 7 GDPR", [5, 6, 7]),
+    ("Article 22.2 of the LSSI, Art. 32", [32]),
+    ("Art. 5(1)(a) and (f), Art 13", [5, 13]),
+    (float("nan"), []),
+])
+def test_precedent_articles_use_the_clause_parser(clause, expected):
+    assert parse_articles(clause) == expected
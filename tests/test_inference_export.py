@@ -0,0 +1,59 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+from inference_export import EXPORT_FORMATS, ExportedPredictor, check_parity, export_model, fp32_predict_proba
+from multi_task import MultiTaskModel
+
+TEXTS = [f"The {authority} fined the {sector} controller under Article {article} for {breach} in {year}."
+         for authority in ("Spanish authority", "Italian Garante", "Dutch regulator", "French CNIL")
+         for sector, article in (("telecom", "6(1)(e)"), ("health", "9"), ("retail", "32"))
+         for breach, year in (("missing consent", 2019), ("a data breach", 2021), ("late notification", 2023))]
+TASKS = {"violation_result": 2, "fine_bracket": 5}
+
+
+@pytest.fixture(scope="module")
+def tokenizer(tmp_path_factory):
+    from tokenizers import BertWordPieceTokenizer
+    wordpiece = BertWordPieceTokenizer(lowercase=True)
+    wordpiece.train_from_iterator(TEXTS, vocab_size=200, min_frequency=1)
+    directory = str(tmp_path_factory.mktemp("vocab"))
+    wordpiece.save_model(directory)
+    return transformers.BertTokenizerFast.from_pretrained(directory)
+
+
+def tiny_config(tokenizer, **kwargs):
+    return transformers.BertConfig(vocab_size=tokenizer.vocab_size, hidden_size=32, num_hidden_layers=2,
+                                   num_attention_heads=2, intermediate_size=64, **kwargs)
+
+
+@pytest.mark.parametrize("fmt", EXPORT_FORMATS)
+def test_sequence_classification_parity(tmp_path, tokenizer, fmt):
+    torch.manual_seed(0)
+    model = transformers.BertForSequenceClassification(tiny_config(tokenizer, num_labels=2)).eval()
+
+    export_model(model, tokenizer, str(tmp_path), fmt, max_length=64, label_names=["no", "yes"])
+    predictor = ExportedPredictor(str(tmp_path))
+    report = check_parity(fp32_predict_proba(model, tokenizer, max_length=64), predictor, TEXTS)
+
+    assert predictor.format == fmt
+    assert set(report) == {"logits"}
+    assert predictor.predict(TEXTS).shape == (len(TEXTS),)
+
+
+@pytest.mark.parametrize("fmt", EXPORT_FORMATS)
+def test_multi_task_parity(tmp_path, tokenizer, fmt):
+    torch.manual_seed(0)
+    model = MultiTaskModel.from_config(tiny_config(tokenizer), TASKS).eval()
+
+    export_model(model, tokenizer, str(tmp_path), fmt, max_length=64,
+                 task_config={"task_num_labels": TASKS, "task_weights": {}})
+    predictor = ExportedPredictor(str(tmp_path))
+    report = check_parity(fp32_predict_proba(model, tokenizer, max_length=64), predictor, TEXTS)
+
+    assert set(report) == set(TASKS)
+    probs = predictor.predict_proba(TEXTS)
+    assert {name: p.shape for name, p in probs.items()} == {name: (len(TEXTS), n) for name, n in TASKS.items()}
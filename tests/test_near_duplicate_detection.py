@@ -0,0 +1,94 @@
+import os
+import json
+
+from Near_Duplicate_Detection import (MinHashLSH, find_duplicate_groups, load_groups, propagate_annotations,
+                                      save_groups)
+from Stub_Chat_Server import DEFAULT_CONTENT
+
+WORDS = [f"w{i}" for i in range(200)]
+
+
+def edited(words, start, prefix):
+    """Copy of words with every 40th word from start changed (about 0.75-0.8 estimated Jaccard)"""
+    words = list(words)
+    for i in range(start, len(words), 40):
+        words[i] = prefix + words[i]
+    return words
+
+
+# A ~ B 与 B ~ C 超过阈值，A 与 C 不超过：只能靠并查集的传递合并归为一组
+A = " ".join(WORDS)
+B_WORDS = edited(WORDS, 0, "x")
+B = " ".join(B_WORDS)
+C = " ".join(edited(B_WORDS, 20, "y"))
+OTHER = " ".join(f"v{i}" for i in range(200))
+
+
+def test_similarity_is_deterministic_for_a_seed():
+    index, again = MinHashLSH(threshold=0.6), MinHashLSH(threshold=0.6)
+    for key, text in (("A", A), ("B", B), ("C", C)):
+        index.add(key, text)
+        again.add(key, text)
+
+    assert index.similarity("A", "B") == again.similarity("A", "B") >= 0.6
+    assert index.similarity("B", "C") >= 0.6
+    assert index.similarity("A", "C") < 0.6
+    assert MinHashLSH(seed=7).signature(A).tolist() != index.signature(A).tolist()
+
+
+def test_transitive_groups_keep_the_earliest_representative():
+    index = MinHashLSH(threshold=0.6)
+
+    assert index.add("A", A) == []
+    assert index.add("C", C) == []          # 与 A 不够相似，先单独成组
+    assert index.add("other", OTHER) == []
+    assert sorted(index.add("B", B)) == ["A", "C"]   # B 把两组连起来
+
+    assert index.groups() == {"A": "A", "C": "A", "other": "other", "B": "A"}
+
+
+def test_identical_and_empty_texts():
+    index = MinHashLSH()
+    index.add("a", "Same text here.")
+    index.add("b", "same   TEXT, here!")
+    index.add("empty", "")
+    index.add("empty too", "   ")
+
+    assert index.groups() == {"a": "a", "b": "a", "empty": "empty", "empty too": "empty"}
+
+
+def write(directory, name, text):
+    path = os.path.join(directory, name)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return path
+
+
+def test_groups_round_trip_through_csv(tmp_path):
+    files = [write(str(tmp_path), name, text) for name, text in
+             (("case_1.txt", A), ("case_2.txt", OTHER), ("case_3.txt", B))]
+
+    groups = find_duplicate_groups(files, threshold=0.6)
+    save_groups(groups, str(tmp_path / "groups.csv"))
+
+    assert groups == {files[0]: files[0], files[1]: files[1], files[2]: files[0]}
+    assert load_groups(str(tmp_path / "groups.csv")) == {
+        os.path.abspath(files[0]): "case_1.txt", os.path.abspath(files[1]): "case_2.txt",
+        os.path.abspath(files[2]): "case_1.txt"}
+
+
+def test_propagation_skips_failed_representatives(tmp_path):
+    rep_ok, dup_ok = write(str(tmp_path), "a.txt", A), write(str(tmp_path), "b.txt", B)
+    rep_bad, dup_bad = write(str(tmp_path), "c.txt", OTHER), write(str(tmp_path), "d.txt", OTHER)
+    rep_invalid, dup_invalid = write(str(tmp_path), "e.txt", "e"), write(str(tmp_path), "f.txt", "e")
+    groups = {rep_ok: rep_ok, dup_ok: rep_ok, rep_bad: rep_bad, dup_bad: rep_bad,
+              rep_invalid: rep_invalid, dup_invalid: rep_invalid}
+    good = json.loads(DEFAULT_CONTENT)
+    annotations = {rep_ok: good, rep_bad: {"error": "Max retries exceeded", "raw_output": ""},
+                   rep_invalid: {"country": "Spain"}}
+    written = []
+
+    count = propagate_annotations(groups, annotations, lambda path, content, result: written.append((path, result)))
+
+    assert count == 1
+    assert written == [(dup_ok, good)]
@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+from Packed_Annotation import annotate_packed, extract_json_array, fan_out
+from Stub_Chat_Server import DEFAULT_CONTENT, start_stub_server
+
+ITEMS = [("1", "First case about marketing e-mails."), ("2", "Second case about CCTV."),
+         ("3", "Third case about a data breach.")]
+RECORD = json.loads(DEFAULT_CONTENT)
+
+
+def packed_or_single(packed_content):
+    """Responder: packed_content for packed prompts, a valid single annotation otherwise"""
+    def respond(body):
+        prompt = "".join(m.get("content", "") for m in body.get("messages", []))
+        return packed_content if "<<<CASE" in prompt else DEFAULT_CONTENT
+    return respond
+
+
+@pytest.mark.parametrize("packed_content", [
+    DEFAULT_CONTENT,                                              # 单个对象而不是数组
+    "no json at all",
+    json.dumps([RECORD, RECORD]),                                 # 数组长度不对
+    json.dumps([{"case_id": "1", "country": 5}, "text", None]),   # 条目形状不对
+], ids=["object", "no-json", "wrong-length", "wrong-shape"])
+def test_malformed_pack_is_sent_once(packed_content):
+    server, url = start_stub_server(responder=packed_or_single(packed_content))
+    try:
+        fanned = annotate_packed(ITEMS, url)
+    finally:
+        server.shutdown()
+
+    # 打包请求只发一次，随后每个案例各一次单案例请求
+    assert server.request_count == 1 + len(ITEMS)
+    assert all(fanned[case_id]["country"] == "Germany" for case_id, _ in ITEMS)
+
+
+def test_partial_pack_falls_back_for_missing_cases_only():
+    partial = json.dumps([dict(RECORD, case_id="1", country="Spain"), dict(RECORD, case_id="3", country="Italy")])
+    server, url = start_stub_server(responder=packed_or_single(partial))
+    try:
+        fanned = annotate_packed(ITEMS, url)
+    finally:
+        server.shutdown()
+
+    assert server.request_count == 2
+    assert [fanned[case_id]["country"] for case_id, _ in ITEMS] == ["Spain", "Germany", "Italy"]
+
+
+def test_fan_out_by_position():
+    result = extract_json_array("Here: " + json.dumps([RECORD, dict(RECORD, country="France")]))
+
+    fanned = fan_out(result, ["a", "b"])
+
+    assert fanned["a"]["country"] == "Germany" and fanned["b"]["country"] == "France"
+    assert fan_out(result, ["a", "b", "c"]) == {"a": None, "b": None, "c": None}